@@ -0,0 +1,309 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+# Tectiform Open Source License (TOS)
+#
+# Copyright (c) 2015 Tectiform Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+################################################################################
+
+# The classes here hand back asyncio futures, which a coroutine awaits, and
+# are written with callbacks rather than async def so that the module still
+# compiles, and the package still imports, on Python 2.
+
+import os
+import signal
+import subprocess
+from shlex import split
+
+try:
+	import asyncio
+except ImportError as e:
+	asyncio = None
+
+from .. Objects import Object
+from .. Commands import CommandBase, CommandError
+from .. Commands.Shells import OutputStream, CommandLine
+
+
+if asyncio != None:
+
+	class _ProcessProtocol(asyncio.SubprocessProtocol):
+		# Feed the pipes of an AsyncProcess to its OutputStreams and tell it
+		# when the process has exited and both pipes are closed.
+
+		def __init__(self, process):
+			asyncio.SubprocessProtocol.__init__(self)
+			self.process = process
+
+		# End __init__
+
+
+		def pipe_data_received(self, fd, data):
+			if fd == 1:
+				self.process.stdout.feed(data)
+			elif fd == 2:
+				self.process.stderr.feed(data)
+
+		# End pipe_data_received
+
+
+		def connection_lost(self, exc):
+			self.process._finished()
+
+		# End connection_lost
+
+	# End _ProcessProtocol
+
+
+class AsyncProcess(Object):
+	"""A child process run on an asyncio event loop.
+
+	args is a command line for /bin/sh or a list or tuple of arguments run
+	directly, unless shell says otherwise.  The child leads a new process
+	group, so kill signals everything it started.  Each line of its stdout
+	and stderr goes to output_callback and error_callback as it arrives,
+	and stdout and stderr (OutputStream objects) keep the last tail_lines
+	of each, or all of it when tail_lines is None.
+
+	run returns a future for the exit code (negative for a signal).  When
+	timeout seconds pass first the process group is killed and timed_out
+	is set, and cancelling the future kills it too."""
+
+	def __init__(self, args, **kwargs):
+		Object.__init__(self, **kwargs)
+		if asyncio == None:
+			raise CommandError("AsyncProcess requires asyncio")
+		self.args = args
+		self.shell = not isinstance(args, (list, tuple))
+		self.output_callback = None
+		self.error_callback = None
+		self.tail_lines = 100
+		self.timeout = None
+		self.cwd = None
+		self.env = None
+		for key in ("shell", "output_callback", "error_callback", "tail_lines", "timeout", "cwd", "env"):
+			if key in kwargs:
+				setattr(self, key, kwargs[key])
+		if 'loop' in kwargs and kwargs["loop"] != None:
+			self.loop = kwargs["loop"]
+		else:
+			self.loop = asyncio.get_event_loop()
+
+		self.stdout = OutputStream(self.output_callback, self.tail_lines)
+		self.stderr = OutputStream(self.error_callback, self.tail_lines)
+		self.pid = None
+		self.returncode = None
+		self.timed_out = False
+		self.__transport = None
+		self.__timer = None
+		self.__result = None
+
+	# End __init__
+
+
+	@property
+	def text(self):
+		if isinstance(self.args, (list, tuple)):
+			return CommandLine(self.args)
+		return str(self.args)
+
+	# End text
+
+
+	def run(self):
+		"""Start the process and return a future for its exit code."""
+		if self.__result != None:
+			return self.__result
+		self.__result = self.loop.create_future()
+		self.__result.add_done_callback(self.__resultDone)
+
+		factory = lambda: _ProcessProtocol(self)
+		options = dict(stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+			start_new_session=True, cwd=self.cwd, env=self.env)
+		if self.shell:
+			if isinstance(self.args, (list, tuple)):
+				spawn = self.loop.subprocess_shell(factory, CommandLine(self.args), **options)
+			else:
+				spawn = self.loop.subprocess_shell(factory, str(self.args), **options)
+		else:
+			if isinstance(self.args, (list, tuple)):
+				args = [ str(argument) for argument in self.args ]
+			else:
+				args = split(str(self.args))
+			spawn = self.loop.subprocess_exec(factory, *args, **options)
+		asyncio.ensure_future(spawn, loop=self.loop).add_done_callback(self.__spawned)
+		return self.__result
+
+	# End run
+
+
+	def wait(self):
+		"""Return a future for the exit code, starting the process if it has
+		not been started."""
+		return self.run()
+
+	# End wait
+
+
+	def kill(self, signal_number=signal.SIGKILL):
+		"""Send signal_number to the process group of the process."""
+		if self.pid == None or self.returncode != None:
+			return
+		try:
+			os.killpg(self.pid, signal_number)
+		except OSError as e:
+			pass
+
+	# End kill
+
+
+	def __spawned(self, spawn):
+		if spawn.cancelled():
+			return
+		if spawn.exception() != None:
+			error = spawn.exception()
+			if not self.__result.done():
+				self.__result.set_exception(CommandError("'%s' could not be run: %s" % (self.text, str(error))))
+			return
+		self.__transport = spawn.result()[0]
+		self.pid = self.__transport.get_pid()
+		if self.__result.done():
+			# Cancelled while it was starting.
+			self.kill()
+		elif self.timeout != None:
+			self.__timer = self.loop.call_later(self.timeout, self.__timedOut)
+
+	# End __spawned
+
+
+	def __timedOut(self):
+		self.timed_out = True
+		self.kill()
+
+	# End __timedOut
+
+
+	def __resultDone(self, result):
+		if result.cancelled():
+			self.kill()
+
+	# End __resultDone
+
+
+	def _finished(self):
+		self.stdout.close()
+		self.stderr.close()
+		self.returncode = self.__transport.get_returncode()
+		self.__transport.close()
+		if self.__timer != None:
+			self.__timer.cancel()
+		if not self.__result.done():
+			self.__result.set_result(self.returncode)
+
+	# End _finished
+
+
+	def __repr__(self):
+		return self.__class__.__name__ + "(" + repr(self.args) + ")"
+
+	# End __repr__
+
+# End AsyncProcess
+
+
+class AsyncShell(CommandBase):
+	"""The AsyncShell class: Shell.execute for coroutines.
+
+	execute returns a future for the command's stdout, or raises
+	CommandError through it when the command fails or runs longer than
+	its timeout.  Output is streamed to output_callback and error_callback
+	(or the log when they are None), and kept in full with capture_output
+	or as the last tail_lines otherwise."""
+
+	def __init__(self, **kwargs):
+		CommandBase.__init__(self, **kwargs)
+		for key, value in (("output_callback", None), ("error_callback", None), ("tail_lines", 100), ("timeout", None)):
+			if not key in kwargs:
+				setattr(self, key, value)
+
+	# End __init__
+
+
+	def __logLine(self, line):
+		if Object.log_object and Object.getClassVerbose(self):
+			Object.log_object.log_without_format(line)
+
+	# End __logLine
+
+
+	def execute(self, command, return_value=0, shell=None, timeout=None):
+		"""Return a future for what command writes to stdout.  command and
+		shell are as for Shell.execute; timeout, in seconds, defaults to the
+		timeout of the AsyncShell."""
+		if asyncio == None:
+			raise CommandError("AsyncShell requires asyncio")
+		if shell == None:
+			shell = not isinstance(command, (list, tuple))
+		if timeout == None:
+			timeout = self.timeout
+
+		process = AsyncProcess(command, shell=shell, timeout=timeout,
+			output_callback=self.output_callback or self.__logLine,
+			error_callback=self.error_callback or self.__logLine,
+			tail_lines=None if self.capture_output else self.tail_lines)
+		CommandBase.execute(self, process.text)
+
+		result = process.loop.create_future()
+		if self.dry_run or Object.global_dry_run:
+			result.set_result(None)
+			return result
+
+		def finished(done):
+			if result.done():
+				return
+			if done.cancelled():
+				result.cancel()
+				return
+			if done.exception() != None:
+				result.set_exception(done.exception())
+				return
+			self.exit_code = done.result()
+			if process.timed_out:
+				result.set_exception(CommandError("'%s' timed out after %s seconds: %s" % (process.text, str(timeout), process.stderr.tail)))
+			elif self.exit_code != return_value:
+				result.set_exception(CommandError("'%s' failed with error %d: %s" % (process.text, self.exit_code, process.stderr.tail)))
+			else:
+				output = process.stdout.tail
+				result.set_result(output if len(output) > 0 else None)
+
+		def cancelled(done):
+			if done.cancelled():
+				process.kill()
+
+		process.run().add_done_callback(finished)
+		result.add_done_callback(cancelled)
+		return result
+
+	# End execute
+
+# End AsyncShell
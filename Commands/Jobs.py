@@ -0,0 +1,605 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+# Tectiform Open Source License (TOS)
+#
+# Copyright (c) 2015 Tectiform Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+################################################################################
+
+import os
+import time
+import fcntl
+import errno
+import heapq
+import signal
+import select
+import subprocess
+import multiprocessing
+
+try:
+	import selectors
+except ImportError as e:
+	selectors = None
+
+from .. Objects import Object
+from .. Commands import CommandError
+from .. Commands.Shells import OutputStream, CommandLine, STREAM_CHUNK_SIZE
+
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_SKIPPED = "skipped"
+
+
+class Job(Object):
+	"""A command run by a JobScheduler, and what happened to it: state,
+	exit_code, output and errors (the captured stdout and stderr, or their
+	last lines), their sizes in bytes, the start, end and elapsed times,
+	and the user and system CPU seconds and maximum resident set size in
+	kilobytes of the process from its rusage."""
+
+	def __init__(self, name, command, depends, priority, **kwargs):
+		Object.__init__(self, **kwargs)
+		self.name = name
+		self.command = command
+		self.depends = depends
+		self.priority = priority
+		self.cwd = None
+		self.env = None
+		self.return_value = 0
+		for key in ("cwd", "env", "return_value"):
+			if key in kwargs:
+				setattr(self, key, kwargs[key])
+		self.state = JOB_PENDING
+		self.pid = None
+		self.exit_code = None
+		self.rusage = None
+		self.start = None
+		self.end = None
+		self.note = None
+		self.stdout = None
+		self.stderr = None
+
+	# End __init__
+
+
+	@property
+	def text(self):
+		if isinstance(self.command, (list, tuple)):
+			return CommandLine(self.command)
+		return str(self.command)
+
+	# End text
+
+
+	@property
+	def elapsed(self):
+		if self.start == None or self.end == None:
+			return None
+		return self.end - self.start
+
+	# End elapsed
+
+
+	@property
+	def output(self):
+		if self.stdout == None:
+			return None
+		return self.stdout.tail
+
+	# End output
+
+
+	@property
+	def errors(self):
+		if self.stderr == None:
+			return self.note
+		return self.stderr.tail
+
+	# End errors
+
+
+	@property
+	def output_size(self):
+		if self.stdout == None:
+			return 0
+		return self.stdout.size
+
+	# End output_size
+
+
+	@property
+	def errors_size(self):
+		if self.stderr == None:
+			return 0
+		return self.stderr.size
+
+	# End errors_size
+
+
+	@property
+	def user_time(self):
+		if self.rusage == None:
+			return None
+		return self.rusage.ru_utime
+
+	# End user_time
+
+
+	@property
+	def system_time(self):
+		if self.rusage == None:
+			return None
+		return self.rusage.ru_stime
+
+	# End system_time
+
+
+	@property
+	def max_rss(self):
+		if self.rusage == None:
+			return None
+		return self.rusage.ru_maxrss
+
+	# End max_rss
+
+
+	def __str__(self):
+		if self.state == JOB_FAILED:
+			return "%s: '%s' failed with error %s: %s" % (self.name, self.text, str(self.exit_code), str(self.errors).rstrip())
+		if self.state == JOB_SKIPPED:
+			return "%s: '%s' skipped: %s" % (self.name, self.text, self.note)
+		return "%s: '%s' %s" % (self.name, self.text, self.state)
+
+	# End __str__
+
+
+	def __repr__(self):
+		return self.__class__.__name__ + "(" + repr(self.name) + ", " + repr(self.command) + ")"
+
+	# End __repr__
+
+# End Job
+
+
+class _Poller(Object):
+	# Wait for input on a set of file descriptors with selectors, or with
+	# select where it is missing.  A timeout of None waits until there is
+	# some.
+
+	def __init__(self):
+		Object.__init__(self)
+		if selectors != None:
+			self.selector = selectors.DefaultSelector()
+		else:
+			self.selector = None
+		self.descriptors = set()
+
+	# End __init__
+
+
+	def register(self, fd):
+		self.descriptors.add(fd)
+		if self.selector != None:
+			self.selector.register(fd, selectors.EVENT_READ)
+
+	# End register
+
+
+	def unregister(self, fd):
+		self.descriptors.discard(fd)
+		if self.selector != None:
+			self.selector.unregister(fd)
+
+	# End unregister
+
+
+	def poll(self, timeout):
+		if len(self.descriptors) == 0:
+			if timeout != None:
+				time.sleep(timeout)
+			return []
+		if self.selector != None:
+			return [ key.fd for key, events in self.selector.select(timeout) ]
+		while True:
+			try:
+				return select.select(list(self.descriptors), [], [], timeout)[0]
+			except select.error as e:
+				if e.args[0] != errno.EINTR:
+					raise
+
+	# End poll
+
+
+	def close(self):
+		if self.selector != None:
+			self.selector.close()
+
+	# End close
+
+# End _Poller
+
+
+class _ChildExits(Object):
+	# Make the exit of a child wake a _Poller: through a pidfd for each child
+	# where os.pidfd_open works (Python 3.9 on Linux 5.3 and later), or else
+	# through a pipe that a SIGCHLD handler writes to, which can only be
+	# installed from the main thread.  Where neither can be had, waking is
+	# False and the scheduler has to poll.
+
+	def __init__(self, poller):
+		Object.__init__(self)
+		self.poller = poller
+		self.pidfds = {}
+		self.pipe = None
+		self.previous = None
+		self.use_pidfd = False
+		if hasattr(os, "pidfd_open"):
+			try:
+				os.close(os.pidfd_open(os.getpid()))
+				self.use_pidfd = True
+			except OSError as e:
+				pass
+		if not self.use_pidfd and hasattr(signal, "SIGCHLD"):
+			self.pipe = os.pipe()
+			for fd in self.pipe:
+				fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+			try:
+				self.previous = signal.signal(signal.SIGCHLD, self.__signalled)
+				poller.register(self.pipe[0])
+			except ValueError as e:
+				# Not the main thread.
+				self.__closePipe()
+
+	# End __init__
+
+
+	@property
+	def waking(self):
+		return self.use_pidfd or self.pipe != None
+
+	# End waking
+
+
+	def __signalled(self, signal_number, frame):
+		try:
+			os.write(self.pipe[1], b"\0")
+		except OSError as e:
+			pass
+		if callable(self.previous):
+			self.previous(signal_number, frame)
+
+	# End __signalled
+
+
+	def watch(self, pid):
+		if self.use_pidfd:
+			fd = os.pidfd_open(pid)
+			self.pidfds[pid] = fd
+			self.poller.register(fd)
+
+	# End watch
+
+
+	def forget(self, pid):
+		if pid in self.pidfds:
+			fd = self.pidfds.pop(pid)
+			self.poller.unregister(fd)
+			os.close(fd)
+
+	# End forget
+
+
+	def consume(self, fd):
+		# A pidfd stays readable until it is closed by forget once its
+		# child is reaped; the pipe is drained.
+		if self.pipe != None and fd == self.pipe[0]:
+			try:
+				while os.read(fd, 512):
+					pass
+			except OSError as e:
+				pass
+
+	# End consume
+
+
+	def __closePipe(self):
+		for fd in self.pipe:
+			os.close(fd)
+		self.pipe = None
+
+	# End __closePipe
+
+
+	def close(self):
+		for pid in list(self.pidfds):
+			self.forget(pid)
+		if self.pipe != None:
+			signal.signal(signal.SIGCHLD, self.previous if self.previous != None else signal.SIG_DFL)
+			self.poller.unregister(self.pipe[0])
+			self.__closePipe()
+
+	# End close
+
+# End _ChildExits
+
+
+class _RunningJob(Object):
+	# What the scheduler keeps about a job while it runs.
+
+	def __init__(self, job, process):
+		Object.__init__(self)
+		self.job = job
+		self.process = process
+		self.open_pipes = 2
+		self.exited = False
+		self.exit_code = None
+		self.rusage = None
+
+	# End __init__
+
+# End _RunningJob
+
+
+class JobScheduler(Object):
+	"""Run many commands, each once the jobs it depends on have succeeded,
+	with at most max_jobs (by default the number of CPUs) running at a
+	time and the ready job of highest priority started first.
+
+	All jobs are watched from one loop in the calling thread, which sleeps
+	until output arrives or a child exits, reads the output and reaps the
+	child with os.wait4, so each job also gets its resource usage.  Exits
+	are seen through pidfds, or else a SIGCHLD handler when run is called
+	from the main thread; failing both the loop polls every 50ms.  A
+	command is a string for /bin/sh or a list or tuple of arguments run
+	directly, as with Shell.execute.  Their output is kept in full with
+	capture_output and otherwise only the last tail_lines of it.  POSIX
+	only."""
+
+	def __init__(self, **kwargs):
+		Object.__init__(self, **kwargs)
+		if 'max_jobs' in kwargs and kwargs["max_jobs"] != None:
+			self.max_jobs = kwargs["max_jobs"]
+		else:
+			self.max_jobs = multiprocessing.cpu_count()
+		if self.max_jobs < 1:
+			raise CommandError("max_jobs must be at least 1, not " + str(self.max_jobs))
+
+		if 'capture_output' in kwargs:
+			self.capture_output = kwargs["capture_output"]
+		else:
+			self.capture_output = True
+
+		if 'tail_lines' in kwargs:
+			self.tail_lines = kwargs["tail_lines"]
+		else:
+			self.tail_lines = 100
+
+		if 'keep_going' in kwargs:
+			self.keep_going = kwargs["keep_going"]
+		else:
+			self.keep_going = True
+
+		self.jobs = []
+
+	# End __init__
+
+
+	def add(self, command, name=None, depends=None, priority=0, **kwargs):
+		"""Add command as a job that runs after the jobs named in depends
+		have succeeded, and return its Job.  kwargs may give its cwd, env
+		and return_value (the exit code that is success, 0 by default)."""
+		if name == None:
+			name = str(len(self.jobs))
+		if name in [ job.name for job in self.jobs ]:
+			raise CommandError("A job named " + name + " already exists")
+		job = Job(name, command, list(depends or []), priority, **kwargs)
+		self.jobs.append(job)
+		return job
+
+	# End add
+
+
+	def __start(self, job, poller, pipes, exits):
+		# Start job and return its _RunningJob, or None when it finished
+		# without running.
+		job.state = JOB_RUNNING
+		job.start = time.time()
+		tail_lines = None if self.capture_output else self.tail_lines
+		job.stdout = OutputStream(None, tail_lines)
+		job.stderr = OutputStream(None, tail_lines)
+		Object.logIfVerbose(self, job.text)
+		if Object.global_dry_run:
+			Object.logIfDryRun(self, job.text)
+			self.__finish(job, 0, None)
+			return None
+
+		shell = not isinstance(job.command, (list, tuple))
+		command = job.command if shell else [ str(argument) for argument in job.command ]
+		try:
+			with open(os.devnull, "rb") as devnull:
+				process = subprocess.Popen(command, stdin=devnull, stdout=subprocess.PIPE,
+					stderr=subprocess.PIPE, shell=shell, cwd=job.cwd, env=job.env, close_fds=True)
+		except OSError as e:
+			job.stdout = job.stderr = None
+			job.note = "could not be run: " + e.strerror
+			self.__finish(job, 127, None)
+			return None
+
+		job.pid = process.pid
+		running = _RunningJob(job, process)
+		exits.watch(process.pid)
+		for pipe, stream in ((process.stdout, job.stdout), (process.stderr, job.stderr)):
+			pipes[pipe.fileno()] = (running, pipe, stream)
+			poller.register(pipe.fileno())
+		return running
+
+	# End __start
+
+
+	def __finish(self, job, exit_code, rusage):
+		job.exit_code = exit_code
+		job.rusage = rusage
+		job.end = time.time()
+		if exit_code == job.return_value:
+			job.state = JOB_SUCCEEDED
+		else:
+			job.state = JOB_FAILED
+
+	# End __finish
+
+
+	def __read(self, fd, poller, pipes):
+		running, pipe, stream = pipes[fd]
+		data = os.read(fd, STREAM_CHUNK_SIZE)
+		if data:
+			stream.feed(data)
+			return
+		stream.close()
+		poller.unregister(fd)
+		pipe.close()
+		del pipes[fd]
+		running.open_pipes -= 1
+
+	# End __read
+
+
+	def __reap(self, running, exits):
+		pid, status, rusage = os.wait4(running.process.pid, os.WNOHANG)
+		if pid == 0:
+			return False
+		if os.WIFSIGNALED(status):
+			exit_code = -os.WTERMSIG(status)
+		else:
+			exit_code = os.WEXITSTATUS(status)
+		running.process.returncode = exit_code
+		running.exited = True
+		running.exit_code = exit_code
+		running.rusage = rusage
+		exits.forget(pid)
+		return True
+
+	# End __reap
+
+
+	def run(self):
+		"""Run the jobs that were added and return them, in the order they
+		were added, once all have finished.  A job whose dependency fails
+		is skipped, as is every job not started yet after a failure when
+		keep_going is False.  If any job does not succeed a CommandError
+		listing them is raised, whose jobs attribute holds all the jobs."""
+		if not hasattr(os, "wait4"):
+			raise CommandError("JobScheduler requires os.wait4")
+		jobs = self.jobs
+		self.jobs = []
+		by_name = dict([ (job.name, job) for job in jobs ])
+		for job in jobs:
+			for name in job.depends:
+				if not name in by_name:
+					raise CommandError("Job %s depends on unknown job %s" % (job.name, name))
+
+		waiting = list(jobs)
+		ready = []
+		running = {}
+		pipes = {}
+		poller = _Poller()
+		exits = _ChildExits(poller)
+		timeout = None if exits.waking else 0.05
+		failed = False
+		order = dict([ (job.name, index) for index, job in enumerate(jobs) ])
+		try:
+			while len(waiting) > 0 or len(ready) > 0 or len(running) > 0:
+				still_waiting = []
+				for job in waiting:
+					states = [ by_name[name].state for name in job.depends ]
+					if JOB_FAILED in states or JOB_SKIPPED in states:
+						job.state = JOB_SKIPPED
+						job.note = "a job it depends on did not succeed"
+					elif len([ state for state in states if state != JOB_SUCCEEDED ]) == 0:
+						heapq.heappush(ready, (-job.priority, order[job.name], job))
+					else:
+						still_waiting.append(job)
+				waiting = still_waiting
+
+				started = 0
+				while len(ready) > 0 and len(running) < self.max_jobs:
+					job = heapq.heappop(ready)[2]
+					started += 1
+					if failed and not self.keep_going:
+						job.state = JOB_SKIPPED
+						job.note = "an earlier job failed"
+						continue
+					process = self.__start(job, poller, pipes, exits)
+					if process != None:
+						running[job] = process
+					elif job.state == JOB_FAILED:
+						failed = True
+
+				if len(running) == 0:
+					if started == 0 and len(waiting) > 0:
+						# Nothing is running and nothing could start.
+						for job in waiting:
+							job.state = JOB_SKIPPED
+							job.note = "its dependencies form a cycle"
+						waiting = []
+					continue
+
+				for fd in poller.poll(timeout):
+					if fd in pipes:
+						self.__read(fd, poller, pipes)
+					else:
+						exits.consume(fd)
+
+				for job, process in list(running.items()):
+					if not process.exited:
+						self.__reap(process, exits)
+					if process.exited and process.open_pipes == 0:
+						del running[job]
+						self.__finish(job, process.exit_code, process.rusage)
+						if job.state == JOB_FAILED:
+							failed = True
+		finally:
+			for process in running.values():
+				try:
+					process.process.kill()
+					process.process.wait()
+				except OSError as e:
+					pass
+			exits.close()
+			poller.close()
+
+		unsuccessful = [ job for job in jobs if job.state != JOB_SUCCEEDED ]
+		if len(unsuccessful) > 0:
+			message = "%d of %d jobs did not succeed:\n" % (len(unsuccessful), len(jobs))
+			message += "\n".join([ "  " + str(job) for job in unsuccessful ])
+			error = CommandError(message)
+			error.jobs = jobs
+			raise error
+
+		return jobs
+
+	# End run
+
+# End JobScheduler
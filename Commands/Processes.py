@@ -26,10 +26,19 @@
 #
 ################################################################################
 
+import os
 import sys
+import errno
+import signal
+import threading
 from .. Objects import Object
 from .. Errors import Error
 
+try:
+	import resource
+except ImportError as e:
+	resource = None
+
 class ProcessError(Error):
 	"""The ProcessError class."""
 
@@ -71,8 +80,67 @@ class ProcessCommandBase(Object):
 PIPE = 1
 STDOUT = 2
 
+
+def ResourceLimits(cpu_limit=None, memory_limit=None, open_files_limit=None):
+	"""Return the (resource, (soft, hard)) pairs to pass to setrlimit in a
+	child for a limit of cpu_limit seconds of CPU time (SIGXCPU at the
+	limit, SIGKILL a second later), memory_limit bytes of address space
+	and open_files_limit open files.  Limits above the current hard
+	limit are lowered to it."""
+	requested = []
+	if cpu_limit != None:
+		requested.append(("RLIMIT_CPU", int(cpu_limit), int(cpu_limit) + 1))
+	if memory_limit != None:
+		requested.append(("RLIMIT_AS", int(memory_limit), int(memory_limit)))
+	if open_files_limit != None:
+		requested.append(("RLIMIT_NOFILE", int(open_files_limit), int(open_files_limit)))
+	if len(requested) == 0:
+		return []
+	if resource == None:
+		raise ProcessError("Resource limits are not supported on this platform")
+
+	limits = []
+	for name, soft, hard in requested:
+		which = getattr(resource, name)
+		current = resource.getrlimit(which)[1]
+		if current != resource.RLIM_INFINITY:
+			soft, hard = (min(soft, current), min(hard, current))
+		limits.append((which, (soft, hard)))
+	return limits
+
+# End ResourceLimits
+
+
+def _ChildSetup(new_process_group, limits):
+	# The preexec_fn run in the child between fork and exec.  Running Python
+	# code there is unsafe when other threads exist: a lock one of them
+	# held at the fork stays locked in the child, which can deadlock.  So
+	# it is only used for what Popen cannot do itself, setrlimit and, on
+	# Python 2, setsid.
+	def setup():
+		if new_process_group:
+			os.setsid()
+		for which, values in limits:
+			resource.setrlimit(which, values)
+	return setup
+
+# End _ChildSetup
+
+
 class ProcessBaseObject(Object):
-	"""The ProcessBaseObject class."""
+	"""The ProcessBaseObject class.
+
+	With timeout, the process is killed once it has run for that many
+	seconds, and timed_out is set.  With new_process_group, which is the
+	default when there is a timeout, it leads a new process group (and
+	session) and kill signals the whole group, so nothing it started is
+	left running.  cpu_limit, memory_limit and open_files_limit cap the
+	CPU seconds, bytes of address space and open files of the process
+	with setrlimit.
+
+	setrlimit, and on Python 2 setsid, have to be run in the child before
+	exec, which CPython warns may deadlock when the parent has threads.
+	On Python 3 a new process group is made by Popen itself."""
 
 	def __init__(self, args, **kwargs):
 		self.args = args
@@ -88,6 +156,19 @@ class ProcessBaseObject(Object):
 		else:
 			self._stderr = None
 
+		if 'timeout' in kwargs:
+			self.timeout = kwargs["timeout"]
+		else:
+			self.timeout = None
+
+		if 'new_process_group' in kwargs:
+			self.new_process_group = kwargs["new_process_group"]
+		else:
+			self.new_process_group = self.timeout != None
+
+		self.limits = ResourceLimits(kwargs.get("cpu_limit"), kwargs.get("memory_limit"), kwargs.get("open_files_limit"))
+		self.timed_out = False
+
 	# End __init__
 
 
@@ -182,6 +263,48 @@ except ImportError as e:
 if useSubprocess:
 	from shlex import split
 
+	class _AccountedPopen(subprocess.Popen):
+		"""A Popen that reaps its child with os.wait4, where there is one,
+		and keeps the resource usage of the child in rusage."""
+
+		rusage = None
+
+		def __reap(self, options):
+			if self.returncode != None or not hasattr(os, "wait4"):
+				return
+			while True:
+				try:
+					pid, status, rusage = os.wait4(self.pid, options)
+					break
+				except OSError as e:
+					if e.errno == errno.EINTR:
+						continue
+					# Reaped elsewhere; Popen knows what to do.
+					return
+			if pid == self.pid:
+				self.rusage = rusage
+				self._handle_exitstatus(status)
+
+		# End __reap
+
+
+		def wait(self, *args, **kwargs):
+			if len(args) == 0 and kwargs.get("timeout") == None:
+				self.__reap(0)
+			return subprocess.Popen.wait(self, *args, **kwargs)
+
+		# End wait
+
+
+		def poll(self):
+			self.__reap(os.WNOHANG)
+			return subprocess.Popen.poll(self)
+
+		# End poll
+
+	# End _AccountedPopen
+
+
 	class Process(ProcessBaseObject):
 		"""The Process class."""
 
@@ -193,7 +316,7 @@ if useSubprocess:
 				if kwargs["shell"] == True:
 					self.shell = True
 
-			else:
+			if not self.shell and not isinstance(self.args, (list, tuple)):
 				command = ProcessCommand(self.args)
 				self.args = command.process_form
 
@@ -209,17 +332,62 @@ if useSubprocess:
 			else:
 				stderr_value = None
 
+			options = {}
+			setsid = self.new_process_group
+			if setsid and sys.version_info >= (3, 2):
+				options["start_new_session"] = True
+				setsid = False
+			if setsid or len(self.limits) > 0:
+				options["preexec_fn"] = _ChildSetup(setsid, self.limits)
+
+			self.__watchdog = None
 			if not Object.global_dry_run:
-				self.__process = subprocess.Popen(self.args,stdin=subprocess.PIPE,stdout=stdout_value,stderr=stderr_value,shell=self.shell)
+				self.__process = _AccountedPopen(self.args,stdin=subprocess.PIPE,stdout=stdout_value,stderr=stderr_value,shell=self.shell,**options)
+				if self.timeout != None:
+					self.__watchdog = threading.Timer(self.timeout, self.__expire)
+					self.__watchdog.daemon = True
+					self.__watchdog.start()
 			else:
 				self.__process = None
 
 		# End __init__
 
 
+		def __expire(self):
+			self.timed_out = True
+			self.kill()
+
+		# End __expire
+
+
+		def __disarm(self):
+			if self.__watchdog != None:
+				self.__watchdog.cancel()
+				self.__watchdog = None
+
+		# End __disarm
+
+
+		def kill(self):
+			"""Kill the process, or its process group if it leads one."""
+			if not self.__process or self.__process.returncode != None:
+				return
+			try:
+				if self.new_process_group:
+					os.killpg(self.__process.pid, signal.SIGKILL)
+				else:
+					self.__process.kill()
+			except OSError as e:
+				pass
+
+		# End kill
+
+
 		def wait(self):
 			if self.__process:
-				return self.__process.wait()
+				result = self.__process.wait()
+				self.__disarm()
+				return result
 
 			return 0
 
@@ -228,7 +396,10 @@ if useSubprocess:
 
 		def poll(self):
 			if self.__process:
-				return self.__process.poll()
+				result = self.__process.poll()
+				if result != None:
+					self.__disarm()
+				return result
 
 			return None
 
@@ -237,7 +408,10 @@ if useSubprocess:
 
 		def communicate(self, input=None):
 			if self.__process:
-				return self.__process.communicate(input)
+				result = self.__process.communicate(input)
+				self.__process.wait()
+				self.__disarm()
+				return result
 
 			return ("","")
 
@@ -284,6 +458,18 @@ if useSubprocess:
 
 		# End pid
 
+
+		@property
+		def rusage(self):
+			"""The resource usage of the process once it has been waited for,
+			as returned by os.wait4, or None."""
+			if self.__process:
+				return self.__process.rusage
+
+			return None
+
+		# End rusage
+
 	# End Process
 
 elif usePopen2:
@@ -299,15 +485,16 @@ elif usePopen2:
 			if 'shell' in kwargs:
 				if kwargs["shell"] == False:
 					self.shell = False
-					self.args = split(self.args)
 
 			if self._stderr == PIPE:
 				stderr_value = True
 			else:
 				stderr_value = False
 
-			command = ProcessCommand(self.args)
-			self.args = command.process_form
+			# Popen3 runs a string through /bin/sh and a list directly.
+			if not self.shell and not isinstance(self.args, (list, tuple)):
+				command = ProcessCommand(self.args)
+				self.args = command.process_form
 
 			if not Object.global_dry_run:
 				self.__process = popen2.Popen3(self.args, capturestderr=stderr_value)
@@ -26,15 +26,125 @@
 #
 ################################################################################
 
-import sys, re
+import os, sys, re
+import time
+import signal
+import threading
+import collections
+from shlex import split
+
+try:
+	import Queue as queue
+except ImportError as e:
+	import queue
+
+try:
+	from shlex import quote
+except ImportError as e:
+	from pipes import quote
 
 from .. Objects import Object
-from .. Commands import CommandBase, CommandError
+from .. Commands import CommandBase, CommandError, CommandRecord
 from .. Commands.Processes import Process, PIPE, STDOUT
 
 
+def CommandLine(arguments):
+	"""Return the shell command line that runs the argument vector
+	arguments."""
+	return " ".join([ quote(str(argument)) for argument in arguments ])
+
+# End CommandLine
+
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Output with no newline is delivered in pieces of at most this size.
+STREAM_LINE_LIMIT = 64 * 1024
+
+
+class OutputStream(Object):
+	"""Split the output of a command into lines as it arrives, hand each to
+	callback, and keep the last tail_lines of them and the byte count."""
+
+	def __init__(self, callback, tail_lines, **kwargs):
+		Object.__init__(self, **kwargs)
+		self.callback = callback
+		self.lines = collections.deque(maxlen=tail_lines)
+		self.size = 0
+		self.__partial = b""
+
+	# End __init__
+
+
+	def __deliver(self, line):
+		if not isinstance(line, str):
+			line = line.decode("utf-8", "replace")
+		self.lines.append(line)
+		if self.callback != None:
+			self.callback(line)
+
+	# End __deliver
+
+
+	def feed(self, data):
+		self.size += len(data)
+		pieces = (self.__partial + data).split(b"\n")
+		self.__partial = pieces.pop()
+		for line in pieces:
+			self.__deliver(line)
+		while len(self.__partial) > STREAM_LINE_LIMIT:
+			self.__deliver(self.__partial[:STREAM_LINE_LIMIT])
+			self.__partial = self.__partial[STREAM_LINE_LIMIT:]
+
+	# End feed
+
+
+	def close(self):
+		if len(self.__partial) > 0:
+			self.__deliver(self.__partial)
+			self.__partial = b""
+
+	# End close
+
+
+	@property
+	def tail(self):
+		return "\n".join(self.lines)
+
+	# End tail
+
+# End OutputStream
+
+
+def _ReadPipe(pipe, name, chunks):
+	try:
+		while True:
+			data = os.read(pipe.fileno(), STREAM_CHUNK_SIZE)
+			if not data:
+				break
+			chunks.put((name, data))
+	finally:
+		chunks.put((name, None))
+
+# End _ReadPipe
+
+
 class Shell(CommandBase):
-	"""The Shell class."""
+	"""The Shell class.
+
+	execute runs a command line through /bin/sh, or a list or tuple of
+	arguments directly, without a shell.
+
+	With stream, the output of a command is not collected: each line of
+	stdout and stderr goes to output_callback and error_callback as it
+	arrives, or to the log when they are None, and only the last
+	tail_lines of each are kept, for the error message.
+
+	timeout, cpu_limit, memory_limit and open_files_limit are passed to
+	each Process (see ProcessBaseObject): a command running longer than
+	timeout seconds is killed with its process group.
+
+	Every command that runs leaves a CommandRecord (see CommandBase)."""
 
 	def __init__(self, **kwargs):
 		CommandBase.__init__(self, **kwargs)
@@ -42,27 +152,164 @@ class Shell(CommandBase):
 			self.raise_error_on_shell_error = kwargs["raise_error_on_shell_error"]
 		else:
 			self.raise_error_on_shell_error = True
+
+		if 'stream' in kwargs:
+			self.stream = kwargs["stream"]
+		else:
+			self.stream = False
+
+		if 'output_callback' in kwargs:
+			self.output_callback = kwargs["output_callback"]
+		else:
+			self.output_callback = None
+
+		if 'error_callback' in kwargs:
+			self.error_callback = kwargs["error_callback"]
+		else:
+			self.error_callback = None
+
+		if 'tail_lines' in kwargs:
+			self.tail_lines = kwargs["tail_lines"]
+		else:
+			self.tail_lines = 100
+
+		for key in ("timeout", "cpu_limit", "memory_limit", "open_files_limit"):
+			if not key in kwargs:
+				setattr(self, key, None)
 	# End __init__
 
-	def execute(self,command,return_value=0):
-		CommandBase.execute(self,command)
+
+	def __logLine(self, line):
+		if Object.log_object:
+			Object.log_object.log_without_format(line)
+
+	# End __logLine
+
+
+	def __streamOutput(self, process):
+		# Read stdout and stderr on a thread each and hand the lines to the
+		# callbacks from this thread, so a callback need not be thread-safe.
+		chunks = queue.Queue(64)
+		streams = {
+			"stdout" : OutputStream(self.output_callback or self.__logLine, self.tail_lines),
+			"stderr" : OutputStream(self.error_callback or self.__logLine, self.tail_lines)
+		}
+		process.stdin.close()
+		threads = []
+		for name, pipe in (("stdout", process.stdout), ("stderr", process.stderr)):
+			thread = threading.Thread(target=_ReadPipe, args=(pipe, name, chunks))
+			thread.daemon = True
+			thread.start()
+			threads.append(thread)
+
+		open_streams = len(streams)
+		try:
+			while open_streams > 0:
+				name, data = chunks.get()
+				if data == None:
+					streams[name].close()
+					open_streams -= 1
+				else:
+					streams[name].feed(data)
+		finally:
+			if open_streams > 0:
+				# A callback raised: kill the command and empty the queue
+				# until the readers see the end of its output, so none of
+				# them is left blocked on a full queue or the child unreaped.
+				process.kill()
+				while open_streams > 0:
+					name, data = chunks.get()
+					if data == None:
+						open_streams -= 1
+				for thread in threads:
+					thread.join()
+				process.wait()
+		return streams
+
+	# End __streamOutput
+
+	def __record(self, record, process, output_bytes, error_bytes):
+		record.end = time.time()
+		record.exit_code = self.exit_code
+		record.timed_out = process.timed_out
+		record.setUsage(getattr(process, "rusage", None))
+		record.output_bytes = output_bytes
+		record.error_bytes = error_bytes
+		self.record(record)
+
+	# End __record
+
+
+	def __failure(self, process, text, errors):
+		# The CommandError for a command that did not exit with the return
+		# value it should have.
+		if process.timed_out:
+			return CommandError("'%s' timed out after %s seconds: %s" % (text, str(process.timeout), errors))
+		if self.exit_code == -getattr(signal, "SIGXCPU", 0) and self.cpu_limit != None:
+			return CommandError("'%s' exceeded its CPU limit of %s seconds: %s" % (text, str(self.cpu_limit), errors))
+		return CommandError("'%s' failed with error %d: %s" % (text, self.exit_code, errors))
+
+	# End __failure
+
+
+	def execute(self,command,return_value=0,shell=None,timeout=None):
+		"""Run command and return what it wrote to stdout when output is
+		captured (None when it is streamed).  A string is a command line for /bin/sh and a list or
+		tuple is an argument vector that is executed directly, unless shell
+		says otherwise: True runs an argument vector as a quoted command
+		line through the shell, and False splits a command line into words
+		and runs it without one.  timeout overrides the timeout of the
+		Shell.  Raises CommandError when the exit code is not return_value
+		or the command times out."""
+		if shell == None:
+			shell = not isinstance(command, (list, tuple))
+		if shell:
+			if isinstance(command, (list, tuple)):
+				command = CommandLine(command)
+			else:
+				command = str(command)
+			text = command
+		else:
+			if isinstance(command, (list, tuple)):
+				command = [ str(argument) for argument in command ]
+			else:
+				command = split(str(command))
+			text = CommandLine(command)
+
+		CommandBase.execute(self,text)
 
 		if self.dry_run or Object.global_dry_run:
 			return
 
-		if self.capture_output or Object.getClassVerbose(self):
+		if self.stream or self.capture_output or Object.getClassVerbose(self):
 			capture_output = PIPE
 		else:
 			capture_output = None
 
-		process = Process(str(command),stdout=capture_output, stderr=PIPE,shell=True)
+		record = CommandRecord(text, start=time.time())
+		try:
+			process = Process(command,stdout=capture_output, stderr=PIPE,shell=shell,
+				timeout=timeout if timeout != None else self.timeout, cpu_limit=self.cpu_limit,
+				memory_limit=self.memory_limit, open_files_limit=self.open_files_limit)
+		except OSError as e:
+			self.exit_code = 127
+			raise CommandError("'%s' could not be run: %s" % (text, e.strerror))
+
+		if self.stream:
+			streams = self.__streamOutput(process)
+			self.exit_code = process.wait()
+			self.__record(record, process, streams["stdout"].size, streams["stderr"].size)
+			if self.exit_code != return_value or process.timed_out:
+				raise self.__failure(process, text, streams["stderr"].tail)
+			return None
 
 		data,errors = process.communicate()
 
 		self.exit_code = process.wait()
+		self.__record(record, process, len(data) if data != None else None, len(errors) if errors != None else None)
 
-		if self.exit_code != return_value:
-			raise CommandError("'%s' failed with error %d: %s" % (str(command), self.exit_code, errors))
+		if self.exit_code != return_value or process.timed_out:
+			raise self.__failure(process, text, errors)
 
 
 		rvalue = data
@@ -26,6 +26,9 @@
 #
 ################################################################################
 
+import json
+import threading
+import collections
 from .. Objects import Object
 from .. Errors import Error
 
@@ -39,8 +42,124 @@ class CommandError(Error):
 # End CommandError
 
 
+class CommandRecord(Object):
+	"""What running one command cost: its wall time and, where the system
+	reports them, its user and system CPU seconds and maximum resident set
+	size (in kilobytes on Linux, bytes on Mac OS X), with its exit code,
+	whether it timed out and how many bytes it wrote to stdout and stderr
+	(None when they were not read)."""
+
+	def __init__(self, command, **kwargs):
+		Object.__init__(self)
+		self.command = command
+		self.exit_code = None
+		self.timed_out = False
+		self.start = None
+		self.end = None
+		self.user_time = None
+		self.system_time = None
+		self.max_rss = None
+		self.output_bytes = None
+		self.error_bytes = None
+		for key in kwargs:
+			if hasattr(self, key):
+				setattr(self, key, kwargs[key])
+
+	# End __init__
+
+
+	def setUsage(self, rusage):
+		if rusage != None:
+			self.user_time = rusage.ru_utime
+			self.system_time = rusage.ru_stime
+			self.max_rss = rusage.ru_maxrss
+
+	# End setUsage
+
+
+	@property
+	def wall_time(self):
+		if self.start == None or self.end == None:
+			return None
+		return self.end - self.start
+
+	# End wall_time
+
+
+	def asDictionary(self):
+		return {
+			"command" : self.command,
+			"exit_code" : self.exit_code,
+			"timed_out" : self.timed_out,
+			"start" : self.start,
+			"wall_time" : self.wall_time,
+			"user_time" : self.user_time,
+			"system_time" : self.system_time,
+			"max_rss" : self.max_rss,
+			"output_bytes" : self.output_bytes,
+			"error_bytes" : self.error_bytes
+		}
+
+	# End asDictionary
+
+
+	def __repr__(self):
+		return "%s(%r, exit_code=%r, wall_time=%r)" % (self.__class__.__name__, self.command, self.exit_code, self.wall_time)
+
+	# End __repr__
+
+# End CommandRecord
+
+
+class JsonRecordSink(Object):
+	"""A record sink that appends each CommandRecord to the file filename as
+	a line of JSON."""
+
+	def __init__(self, filename, **kwargs):
+		Object.__init__(self, **kwargs)
+		self.filename = filename
+		self.__lock = threading.Lock()
+
+	# End __init__
+
+
+	def __call__(self, record):
+		line = json.dumps(record.asDictionary(), sort_keys=True) + "\n"
+		with self.__lock:
+			with open(self.filename, "a") as f:
+				f.write(line)
+
+	# End __call__
+
+# End JsonRecordSink
+
+
+def HotCommands(records, count=10):
+	"""Return the count commands of records that took the most wall time in
+	all, as (command, runs, wall time, CPU time) tuples."""
+	totals = {}
+	for record in records:
+		runs, wall, cpu = totals.get(record.command, (0, 0.0, 0.0))
+		totals[record.command] = (runs + 1, wall + (record.wall_time or 0.0),
+			cpu + (record.user_time or 0.0) + (record.system_time or 0.0))
+	hot = [ (command,) + totals[command] for command in totals ]
+	hot.sort(key=lambda entry: entry[2], reverse=True)
+	return hot[:count]
+
+# End HotCommands
+
+
 class CommandBase(Object):
-	"""The CommandBase class."""
+	"""The CommandBase class.
+
+	Commands that report what they cost append a CommandRecord to records
+	and hand it to record_sink, if one was given, and to every sink in
+	CommandBase.record_sinks.  A sink is any callable taking the record.
+	records keeps only the last keep_records (100 by default, all of them
+	when it is None), so a long-lived command object does not grow
+	without bound; a sink sees every record."""
+
+	record_sinks = []
 
 
 	def __init__(self, **kwargs):
@@ -59,10 +178,31 @@ class CommandBase(Object):
 		else:
 			self.capture_output = False
 
+		if 'record_sink' in kwargs:
+			self.record_sink = kwargs["record_sink"]
+		else:
+			self.record_sink = None
+
+		if 'keep_records' in kwargs:
+			self.keep_records = kwargs["keep_records"]
+		else:
+			self.keep_records = 100
+
 		self.exit_code = 0
+		self.records = collections.deque(maxlen=self.keep_records)
 	# End __init__
 
 
+	def record(self, record):
+		self.records.append(record)
+		if self.record_sink != None:
+			self.record_sink(record)
+		for sink in CommandBase.record_sinks:
+			sink(record)
+
+	# End record
+
+
 	def execute(self,command):
 		if Object.log_object:
 			Object.log_object(command)
@@ -87,6 +227,6 @@ class CommandBase(Object):
 
 # End CommandBase
 
-__all__ = ["Shells", "CommandError"]
+__all__ = ["AsyncShells", "Jobs", "Shells", "CommandError", "CommandRecord", "JsonRecordSink", "HotCommands"]
 
-from . import Shells
\ No newline at end of file
+from . import AsyncShells, Jobs, Shells
\ No newline at end of file
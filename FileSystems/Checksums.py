@@ -0,0 +1,393 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+# Tectiform Open Source License (TOS)
+#
+# Copyright (c) 2015 Tectiform Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+################################################################################
+
+import os
+import json
+import mmap
+import zlib
+import hashlib
+import sqlite3
+import threading
+from .. Objects import Object
+from .. FileSystems import FileSystemError
+from . Files import DEFAULT_CHUNK_SIZE
+
+try:
+	import xxhash
+except ImportError as e:
+	xxhash = None
+
+
+DEFAULT_ALGORITHM = "sha256"
+
+
+class ZlibChecksum(Object):
+	"""Gives zlib.crc32 and zlib.adler32 the update()/hexdigest() interface
+	of the hashlib objects."""
+
+	def __init__(self, function, start):
+		Object.__init__(self)
+		self.function = function
+		self.value = start
+
+	# End __init__
+
+
+	def update(self, data):
+		self.value = self.function(data, self.value)
+
+	# End update
+
+
+	def hexdigest(self):
+		return "%08x" % (self.value & 0xffffffff)
+
+	# End hexdigest
+
+# End ZlibChecksum
+
+
+def Algorithms():
+	"""The names of the checksum algorithms available on this system."""
+	if hasattr(hashlib, "algorithms_available"):
+		names = set(hashlib.algorithms_available)
+	else:
+		names = set(hashlib.algorithms)
+	names.update(["crc32", "adler32"])
+	if xxhash:
+		names.update([ name for name in ("xxh32", "xxh64", "xxh3_64", "xxh3_128", "xxh128") if hasattr(xxhash, name) ])
+	return sorted(names)
+
+# End Algorithms
+
+
+def NewChecksum(algorithm=DEFAULT_ALGORITHM):
+	"""Return a new object with update() and hexdigest() methods for
+	algorithm.  Besides the hashlib algorithms, crc32 and adler32 are always
+	available and the xxHash family is available when the xxhash module is
+	installed."""
+	name = str(algorithm).lower()
+	if name == "crc32":
+		return ZlibChecksum(zlib.crc32, 0)
+	if name == "adler32":
+		return ZlibChecksum(zlib.adler32, 1)
+	if name.startswith("xxh"):
+		if xxhash and hasattr(xxhash, name):
+			return getattr(xxhash, name)()
+		raise FileSystemError("Checksum algorithm %s requires the xxhash module" % name)
+	try:
+		return hashlib.new(name)
+	except ValueError as e:
+		raise FileSystemError("Unknown checksum algorithm %s" % name)
+
+# End NewChecksum
+
+
+def ChecksumOfFile(name, algorithm=DEFAULT_ALGORITHM, chunk_size=DEFAULT_CHUNK_SIZE, use_mmap=False):
+	"""Return the hex digest of the contents of the file name.  The file is
+	read in chunk_size blocks, or mapped into memory and hashed in one
+	call when use_mmap is set."""
+	checksum = NewChecksum(algorithm)
+	try:
+		with open(str(name), "rb") as f:
+			if use_mmap and os.fstat(f.fileno()).st_size > 0:
+				mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+				try:
+					checksum.update(mapped)
+				finally:
+					mapped.close()
+			else:
+				while True:
+					chunk = f.read(chunk_size)
+					if not chunk:
+						break
+					checksum.update(chunk)
+	except EnvironmentError as e:
+		raise FileSystemError("Unable to checksum %s: %s" % (str(name), str(e)))
+	return checksum.hexdigest()
+
+# End ChecksumOfFile
+
+
+def ChecksumOfLink(name, algorithm=DEFAULT_ALGORITHM):
+	"""Return the hex digest of the target of the symbolic link name."""
+	checksum = NewChecksum(algorithm)
+	try:
+		target = os.readlink(str(name))
+		if not isinstance(target, bytes):
+			target = os.fsencode(target)
+		checksum.update(target)
+	except OSError as e:
+		raise FileSystemError("Unable to checksum %s: %s" % (str(name), str(e)))
+	return checksum.hexdigest()
+
+# End ChecksumOfLink
+
+
+def ModificationTimeNS(fsdata):
+	if hasattr(fsdata, "st_mtime_ns"):
+		return fsdata.st_mtime_ns
+	return int(round(fsdata.st_mtime * 1000000000))
+
+# End ModificationTimeNS
+
+
+class ChecksumCache(Object):
+	"""The ChecksumCache class.
+
+	Stores file checksums in an SQLite file keyed on the device and inode of
+	the file and validated against its size and modification time, so a
+	file that has not changed since it was last hashed is not read again,
+	across runs.  The cache can be shared between threads."""
+
+	def __init__(self, filename, **kwargs):
+		Object.__init__(self, **kwargs)
+		self.filename = str(filename)
+		self.hits = 0
+		self.misses = 0
+		self.__lock = threading.Lock()
+
+		try:
+			self.__connection = sqlite3.connect(self.filename, check_same_thread=False)
+			self.__connection.text_factory = str
+			self.__connection.execute("CREATE TABLE IF NOT EXISTS checksums (algorithm TEXT NOT NULL, " +
+				"device INTEGER NOT NULL, inode INTEGER NOT NULL, size INTEGER NOT NULL, " +
+				"mtime_ns INTEGER NOT NULL, digest TEXT NOT NULL, PRIMARY KEY (algorithm, device, inode))")
+			self.__connection.commit()
+		except sqlite3.Error as e:
+			raise FileSystemError("Unable to open checksum cache %s: %s" % (self.filename, str(e)))
+
+	# End __init__
+
+
+	def lookup(self, fsdata, algorithm=DEFAULT_ALGORITHM):
+		"""The cached digest for the file described by the stat result
+		fsdata, or None."""
+		with self.__lock:
+			cursor = self.__connection.execute("SELECT digest FROM checksums WHERE algorithm = ? AND " +
+				"device = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+				(algorithm, fsdata.st_dev, fsdata.st_ino, fsdata.st_size, ModificationTimeNS(fsdata)))
+			row = cursor.fetchone()
+			if row == None:
+				self.misses += 1
+				return None
+			self.hits += 1
+		return row[0]
+
+	# End lookup
+
+
+	def store(self, fsdata, digest, algorithm=DEFAULT_ALGORITHM):
+		with self.__lock:
+			self.__connection.execute("INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?)",
+				(algorithm, fsdata.st_dev, fsdata.st_ino, fsdata.st_size, ModificationTimeNS(fsdata), digest))
+			self.__connection.commit()
+
+	# End store
+
+
+	def checksum(self, name, algorithm=DEFAULT_ALGORITHM, chunk_size=DEFAULT_CHUNK_SIZE, use_mmap=False):
+		"""Return the digest of the regular file name, from the cache when the
+		file is unchanged and by hashing it (and caching the result)
+		otherwise."""
+		name = str(name)
+		algorithm = str(algorithm).lower()
+		try:
+			before = os.stat(name)
+		except OSError as e:
+			raise FileSystemError("Unable to checksum %s: %s" % (name, str(e)))
+
+		digest = self.lookup(before, algorithm)
+		if digest != None:
+			return digest
+
+		digest = ChecksumOfFile(name, algorithm, chunk_size, use_mmap)
+		try:
+			after = os.stat(name)
+		except OSError as e:
+			return digest
+		if (after.st_size, ModificationTimeNS(after)) == (before.st_size, ModificationTimeNS(before)):
+			self.store(after, digest, algorithm)
+		return digest
+
+	# End checksum
+
+
+	def clear(self):
+		with self.__lock:
+			self.__connection.execute("DELETE FROM checksums")
+			self.__connection.commit()
+
+	# End clear
+
+
+	def close(self):
+		with self.__lock:
+			self.__connection.close()
+
+	# End close
+
+
+	def __repr__(self):
+		return self.__class__.__name__ + "(" + self.filename + ")"
+
+	# End __repr__
+
+# End ChecksumCache
+
+
+def ManifestRecordOfFile(arguments):
+	"""Stat and hash one file for a manifest.  Takes a single
+	(name, algorithm, chunk_size, use_mmap) tuple and returns a
+	(name, digest, size, mtime, error) tuple so that it can be handed to
+	a thread or process pool."""
+	name, algorithm, chunk_size, use_mmap = arguments
+	try:
+		fsdata = os.stat(name)
+		digest = ChecksumOfFile(name, algorithm, chunk_size, use_mmap)
+	except OSError as e:
+		return (name, None, 0, 0, str(e))
+	except FileSystemError as e:
+		return (name, None, 0, 0, e.note)
+	return (name, digest, fsdata.st_size, fsdata.st_mtime, None)
+
+# End ManifestRecordOfFile
+
+
+class Manifest(Object):
+	"""The Manifest class.
+
+	Maps the paths of the files of a tree, relative to the root of the
+	tree, to their (digest, size, mtime)."""
+
+	def __init__(self, root=None, algorithm=DEFAULT_ALGORITHM, **kwargs):
+		Object.__init__(self, **kwargs)
+		self.root = root
+		self.algorithm = algorithm
+		self.records = {}
+
+	# End __init__
+
+
+	def add(self, path, digest, size, mtime):
+		self.records[path] = (digest, size, mtime)
+
+	# End add
+
+
+	def difference(self, other):
+		"""Compare with a newer manifest and return the (added, removed,
+		changed) lists of paths, each sorted.  Files are compared by digest."""
+		if self.algorithm != other.algorithm:
+			raise FileSystemError("Cannot compare a %s manifest with a %s manifest" % (self.algorithm, other.algorithm))
+		added = sorted([ path for path in other.records if not path in self.records ])
+		removed = sorted([ path for path in self.records if not path in other.records ])
+		changed = sorted([ path for path in self.records
+			if path in other.records and self.records[path][0] != other.records[path][0] ])
+		return (added, removed, changed)
+
+	# End difference
+
+
+	def write(self, filename):
+		try:
+			with open(str(filename), "w") as f:
+				json.dump({ "root" : self.root, "algorithm" : self.algorithm, "records" : self.records }, f)
+		except EnvironmentError as e:
+			raise FileSystemError("Unable to write manifest %s: %s" % (str(filename), str(e)))
+
+	# End write
+
+
+	def keys(self):
+		return sorted(self.records.keys())
+
+	# End keys
+
+
+	def __getitem__(self, path):
+		return self.records[path]
+
+	# End __getitem__
+
+
+	def __contains__(self, path):
+		return path in self.records
+
+	# End __contains__
+
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	# End __iter__
+
+
+	def __len__(self):
+		return len(self.records)
+
+	# End __len__
+
+
+	def __eq__(self, other):
+		if not isinstance(other, Manifest):
+			return False
+		return self.algorithm == other.algorithm and self.difference(other) == ([], [], [])
+
+	# End __eq__
+
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
+
+	# End __ne__
+
+
+	def __repr__(self):
+		return self.__class__.__name__ + "(" + str(self.root) + ", " + self.algorithm + ", " + str(len(self)) + " files)"
+
+	# End __repr__
+
+# End Manifest
+
+
+def ReadManifest(filename):
+	try:
+		with open(str(filename), "r") as f:
+			data = json.load(f)
+	except (EnvironmentError, ValueError) as e:
+		raise FileSystemError("Unable to read manifest %s: %s" % (str(filename), str(e)))
+
+	manifest = Manifest(data["root"], str(data["algorithm"]))
+	for path, record in data["records"].items():
+		if not isinstance(path, str):
+			path = path.encode("utf-8")
+		manifest.add(path, str(record[0]), record[1], record[2])
+	return manifest
+
+# End ReadManifest
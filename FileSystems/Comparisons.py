@@ -0,0 +1,113 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+# Tectiform Open Source License (TOS)
+#
+# Copyright (c) 2015 Tectiform Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+################################################################################
+
+import os
+import mmap
+from multiprocessing.pool import ThreadPool
+from .. Objects import Object
+from . Files import DEFAULT_CHUNK_SIZE
+
+
+def _SameMappedContents(a, b, size, chunk_size):
+	mapped_a = mmap.mmap(a.fileno(), 0, access=mmap.ACCESS_READ)
+	try:
+		mapped_b = mmap.mmap(b.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			for offset in range(0, size, chunk_size):
+				if mapped_a[offset:offset + chunk_size] != mapped_b[offset:offset + chunk_size]:
+					return False
+		finally:
+			mapped_b.close()
+	finally:
+		mapped_a.close()
+	return True
+
+# End _SameMappedContents
+
+
+def SameContents(a, b, chunk_size=DEFAULT_CHUNK_SIZE, use_mmap=False):
+	"""Return True if the files a and b have the same contents.
+
+	Two names for the same inode are the same without reading anything,
+	and files of different sizes differ without reading anything.
+	Otherwise the files are compared chunk_size bytes at a time, from
+	read-only maps when use_mmap is set, stopping at the first difference.
+	A file that cannot be read is never the same as another."""
+	try:
+		stat_a = os.stat(str(a))
+		stat_b = os.stat(str(b))
+		if stat_a.st_dev == stat_b.st_dev and stat_a.st_ino == stat_b.st_ino:
+			return True
+		if stat_a.st_size != stat_b.st_size:
+			return False
+		if stat_a.st_size == 0:
+			return True
+
+		with open(str(a), "rb") as file_a:
+			with open(str(b), "rb") as file_b:
+				if use_mmap:
+					return _SameMappedContents(file_a, file_b, stat_a.st_size, chunk_size)
+				while True:
+					chunk_a = file_a.read(chunk_size)
+					chunk_b = file_b.read(chunk_size)
+					if chunk_a != chunk_b:
+						return False
+					if not chunk_a:
+						return True
+	except (EnvironmentError, ValueError) as e:
+		return False
+
+# End SameContents
+
+
+def SameLinks(a, b):
+	"""Return True if the symbolic links a and b point at the same target."""
+	try:
+		return os.readlink(str(a)) == os.readlink(str(b))
+	except OSError as e:
+		return False
+
+# End SameLinks
+
+
+def SameContentsOfPairs(pairs, workers=8, chunk_size=DEFAULT_CHUNK_SIZE, use_mmap=False):
+	"""Compare many (a, b) pairs of files on a pool of worker threads and
+	return the list of SameContents results in the order of pairs."""
+	def compare(pair):
+		return SameContents(pair[0], pair[1], chunk_size, use_mmap)
+
+	# End compare
+
+	pool = ThreadPool(max(1, workers))
+	try:
+		return pool.map(compare, pairs)
+	finally:
+		pool.close()
+		pool.join()
+
+# End SameContentsOfPairs
@@ -0,0 +1,348 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+# Tectiform Open Source License (TOS)
+#
+# Copyright (c) 2015 Tectiform Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+################################################################################
+
+import os
+import mmap
+import difflib
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from .. Objects import Object
+from .. FileSystems import FileSystemError
+from . Files import DEFAULT_CHUNK_SIZE
+
+
+NO_NEWLINE = b'\n\\ No newline at end of file\n'
+
+
+def _Bytes(text):
+	if isinstance(text, bytes):
+		return text
+	return text.encode("utf-8")
+
+# End _Bytes
+
+
+def _Text(data):
+	# The diff as a native string: bytes are already one on Python 2, and
+	# on Python 3 bytes that are not UTF-8 survive as surrogate escapes.
+	if isinstance(data, str):
+		return data
+	return data.decode("utf-8", "surrogateescape")
+
+# End _Text
+
+
+def _OpenForDifference(name, use_mmap):
+	f = open(name, "rb")
+	try:
+		if use_mmap and os.fstat(f.fileno()).st_size > 0:
+			return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		return f.read()
+	finally:
+		f.close()
+
+# End _OpenForDifference
+
+
+def _CommonPrefixLength(a, b, chunk_size):
+	limit = min(len(a), len(b))
+	offset = 0
+	while offset < limit:
+		end = min(offset + chunk_size, limit)
+		if a[offset:end] != b[offset:end]:
+			# Narrow down to the first differing byte by bisection.
+			low, high = offset, end
+			while high - low > 1:
+				middle = (low + high) // 2
+				if a[low:middle] == b[low:middle]:
+					low = middle
+				else:
+					high = middle
+			return low
+		offset = end
+	return limit
+
+# End _CommonPrefixLength
+
+
+def _CommonSuffixLength(a, b, limit, chunk_size):
+	length_a = len(a)
+	length_b = len(b)
+	matched = 0
+	while matched < limit:
+		size = min(chunk_size, limit - matched)
+		if a[length_a - matched - size:length_a - matched] != b[length_b - matched - size:length_b - matched]:
+			low, high = 0, size
+			while high - low > 1:
+				middle = (low + high) // 2
+				if a[length_a - matched - middle:length_a - matched] == b[length_b - matched - middle:length_b - matched]:
+					low = middle
+				else:
+					high = middle
+			return matched + low
+		matched += size
+	return matched
+
+# End _CommonSuffixLength
+
+
+def _CountLines(data, end, chunk_size):
+	count = 0
+	for offset in range(0, end, chunk_size):
+		count += data[offset:min(offset + chunk_size, end)].count(b'\n')
+	return count
+
+# End _CountLines
+
+
+def _SplitLines(data):
+	parts = data.split(b'\n')
+	lines = [ part + b'\n' for part in parts[:-1] ]
+	if parts[-1]:
+		lines.append(parts[-1])
+	return lines
+
+# End _SplitLines
+
+
+def _FormatRange(start, stop):
+	beginning = start + 1
+	length = stop - start
+	if length == 1:
+		return '%d' % beginning
+	if not length:
+		beginning -= 1
+	return '%d,%d' % (beginning, length)
+
+# End _FormatRange
+
+
+def _FormatLine(prefix, line):
+	if line[-1:] == b'\n':
+		return prefix + line
+	return prefix + line + NO_NEWLINE
+
+# End _FormatLine
+
+
+class _WindowMatcher(difflib.SequenceMatcher):
+	# A SequenceMatcher over the differing regions of two files whose
+	# opcodes describe the whole files: offset equal lines come before the
+	# regions and trailing equal lines (as many as any hunk can use) after.
+
+	def __init__(self, a, b, offset, trailing):
+		difflib.SequenceMatcher.__init__(self, None, a, b)
+		self.offset = offset
+		self.trailing = trailing
+
+	# End __init__
+
+
+	def get_opcodes(self):
+		codes = []
+		if self.offset > 0:
+			codes.append(('equal', 0, self.offset, 0, self.offset))
+		for tag, i1, i2, j1, j2 in difflib.SequenceMatcher.get_opcodes(self):
+			if i1 == i2 and j1 == j2:
+				continue
+			i1, i2, j1, j2 = i1 + self.offset, i2 + self.offset, j1 + self.offset, j2 + self.offset
+			if tag == 'equal' and len(codes) > 0 and codes[-1][0] == 'equal':
+				codes[-1] = ('equal', codes[-1][1], i2, codes[-1][3], j2)
+			else:
+				codes.append((tag, i1, i2, j1, j2))
+		if self.trailing > 0:
+			i = self.offset + len(self.a)
+			j = self.offset + len(self.b)
+			if len(codes) > 0 and codes[-1][0] == 'equal':
+				codes[-1] = ('equal', codes[-1][1], i + self.trailing, codes[-1][3], j + self.trailing)
+			else:
+				codes.append(('equal', i, i + self.trailing, j, j + self.trailing))
+		return codes
+
+	# End get_opcodes
+
+# End _WindowMatcher
+
+
+def UnifiedDiff(a, b, fromfile=None, tofile=None, context=3, max_hunks=None,
+		use_mmap=True, chunk_size=DEFAULT_CHUNK_SIZE):
+	"""Generate the unified diff of the files a and b: first the file
+	header, then one string per hunk.  Nothing is generated when the files
+	are the same, and generation stops after max_hunks hunks if given.
+
+	Only the region between the longest common leading and trailing lines
+	of the two files is split into lines and handed to difflib; the common
+	parts are found by comparing blocks of the files, read-only maps of
+	them when use_mmap is set.  So two large files that differ in a few
+	places never exist as Python line lists.  The hunks are still grouped,
+	and take their context, over the lines of the whole files."""
+	if fromfile == None:
+		fromfile = str(a)
+	if tofile == None:
+		tofile = str(b)
+
+	try:
+		data_a = _OpenForDifference(str(a), use_mmap)
+		data_b = _OpenForDifference(str(b), use_mmap)
+	except EnvironmentError as e:
+		raise FileSystemError("Unable to compare %s and %s: %s" % (str(a), str(b), str(e)))
+
+	try:
+		length_a = len(data_a)
+		length_b = len(data_b)
+
+		# The common prefix is cut back to the start of a line, the common
+		# suffix forward to the start of a line, and they may not overlap.
+		prefix = _CommonPrefixLength(data_a, data_b, chunk_size)
+		if prefix == length_a and prefix == length_b:
+			return
+		prefix = data_a.rfind(b'\n', 0, prefix) + 1
+
+		suffix = _CommonSuffixLength(data_a, data_b, min(length_a, length_b) - prefix, chunk_size)
+		if suffix > 0:
+			newline = data_a.find(b'\n', length_a - suffix)
+			if newline == -1:
+				suffix = 0
+			else:
+				suffix = length_a - newline - 1
+		end_a = length_a - suffix
+		end_b = length_b - suffix
+
+		# Up to context of the common lines on either side of the region
+		# are kept for the hunks at its edges.
+		before = prefix
+		for i in range(context):
+			if before == 0:
+				break
+			before = data_a.rfind(b'\n', 0, before - 1) + 1
+		after = end_a
+		for i in range(context):
+			if after == length_a:
+				break
+			newline = data_a.find(b'\n', after)
+			if newline == -1:
+				after = length_a
+			else:
+				after = newline + 1
+
+		offset = _CountLines(data_a, prefix, chunk_size)
+		leading = _SplitLines(data_a[before:prefix])
+		trailing = _SplitLines(data_a[end_a:after])
+		lines_a = _SplitLines(data_a[prefix:end_a])
+		lines_b = _SplitLines(data_b[prefix:end_b])
+	finally:
+		for data in (data_a, data_b):
+			if isinstance(data, mmap.mmap):
+				data.close()
+
+	matcher = _WindowMatcher(lines_a, lines_b, offset, len(trailing))
+
+	def line_of_a(index):
+		# Equal lines, which are all the context ever needs, are the same
+		# in both files, so they are taken from a by whole file index.
+		index -= offset
+		if index < 0:
+			return leading[index]
+		if index < len(lines_a):
+			return lines_a[index]
+		return trailing[index - len(lines_a)]
+
+	hunks = 0
+	for group in matcher.get_grouped_opcodes(context):
+		if max_hunks != None and hunks >= max_hunks:
+			return
+		if hunks == 0:
+			yield b'--- ' + _Bytes(fromfile) + b'\n+++ ' + _Bytes(tofile) + b'\n'
+		first, last = group[0], group[-1]
+		hunk = [ b'@@ -' + _Bytes(_FormatRange(first[1], last[2])) +
+			b' +' + _Bytes(_FormatRange(first[3], last[4])) + b' @@\n' ]
+		for tag, i1, i2, j1, j2 in group:
+			if tag == 'equal':
+				hunk.extend([ _FormatLine(b' ', line_of_a(i)) for i in range(i1, i2) ])
+				continue
+			if tag in ('replace', 'delete'):
+				hunk.extend([ _FormatLine(b'-', line) for line in lines_a[i1 - offset:i2 - offset] ])
+			if tag in ('replace', 'insert'):
+				hunk.extend([ _FormatLine(b'+', line) for line in lines_b[j1 - offset:j2 - offset] ])
+		hunks += 1
+		yield b''.join(hunk)
+
+# End UnifiedDiff
+
+
+def DifferenceOfFiles(a, b, fromfile=None, tofile=None, context=3, max_hunks=None, use_mmap=True):
+	"""The unified diff of a and b as one string, or None if they are the
+	same."""
+	text = b''.join(UnifiedDiff(a, b, fromfile, tofile, context, max_hunks, use_mmap))
+	if len(text) == 0:
+		return None
+	return _Text(text)
+
+# End DifferenceOfFiles
+
+
+def DifferenceOfPair(arguments):
+	"""DifferenceOfFiles for a single (a, b, fromfile, tofile, context,
+	max_hunks, use_mmap) tuple, returning a (text, error) tuple so that it
+	can be handed to a thread or process pool."""
+	try:
+		return (DifferenceOfFiles(*arguments), None)
+	except FileSystemError as e:
+		return (None, e.note)
+
+# End DifferenceOfPair
+
+
+def DifferencesOfPairs(pairs, workers=8, processes=False, context=3, max_hunks=None, use_mmap=True):
+	"""Diff many (a, b) or (a, b, fromfile, tofile) tuples on a pool of
+	worker threads, or processes when processes is set (difflib holds the
+	GIL, so processes are what spread the work over the cores).  Returns
+	the DifferenceOfFiles results in the order of pairs."""
+	arguments = []
+	for pair in pairs:
+		pair = tuple(str(name) for name in pair)
+		if len(pair) == 2:
+			pair = pair + pair
+		arguments.append(pair + (context, max_hunks, use_mmap))
+
+	if processes:
+		pool = multiprocessing.Pool(max(1, workers))
+	else:
+		pool = ThreadPool(max(1, workers))
+	try:
+		results = pool.map(DifferenceOfPair, arguments)
+	finally:
+		pool.close()
+		pool.join()
+
+	failures = [ error for text, error in results if error != None ]
+	if len(failures) > 0:
+		raise FileSystemError("; ".join(failures))
+	return [ text for text, error in results ]
+
+# End DifferencesOfPairs
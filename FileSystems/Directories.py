@@ -28,17 +28,56 @@
 
 import os
 import shutil
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from .. Objects import Object
 from .. FileSystems import FileSystemBaseObject
+from .. FileSystems import FileSystemError
 from .. FileSystems import FindFullDirectory
+from .. FileSystems import TypeFromMode
+from .. FileSystems import DIRECTORY, CHARACTER_DEVICE, BLOCK_DEVICE, REGULAR_FILE
+from .. FileSystems import FIFO, SYMBOLIC_LINK, SOCKET, NO_TYPE
 from . BlockDevices import BlockDevice
 from . CharacterDevices import CharacterDevice
 from . Fifos import Fifo
 from . Files import File
 from . SymbolicLinks import SymbolicLink
 from . Sockets import Socket
+from . Checksums import Manifest, ManifestRecordOfFile, DEFAULT_ALGORITHM
+from . Comparisons import SameContentsOfPairs, SameLinks
+from . Differences import DifferencesOfPairs
+from . Files import DEFAULT_CHUNK_SIZE
 from types import *
 
+try:
+	from os import scandir
+except ImportError as e:
+	try:
+		from scandir import scandir
+	except ImportError as e:
+		scandir = None
+
+try:
+	import Queue as queue
+except ImportError as e:
+	import queue
+
+
+# The entry types reported by Directory.files and Directory.all_files.
+FILE_TYPES = (REGULAR_FILE, CHARACTER_DEVICE, BLOCK_DEVICE, NO_TYPE)
+
+# How diff names each type of entry.
+TYPE_DESCRIPTIONS = {
+	REGULAR_FILE : "regular file",
+	DIRECTORY : "directory",
+	SYMBOLIC_LINK : "symbolic link",
+	CHARACTER_DEVICE : "character special file",
+	BLOCK_DEVICE : "block special file",
+	FIFO : "fifo",
+	SOCKET : "socket"
+}
+
 
 class Directory(FileSystemBaseObject):
 	"""The Directory class."""
@@ -49,55 +88,121 @@ class Directory(FileSystemBaseObject):
 			if kwargs['autofind']:
 				dirname = FindFullDirectory(dirname)
 		FileSystemBaseObject.__init__(self, dirname, **kwargs)
+		self.__names = None
+		self.__extensions = None
 
 	# End __init__
 
 
 	@property
 	def parent(self):
-		return Directory(self.path)
+		return Directory(self.path, **self._snapshotOptions())
 
 	# End parent
 
 
-	def __getObjectAccordingToClass(self,name,path):
-		e = FileSystemBaseObject(self.fullpath + os.sep + name)
-		if e.directory:
-			obj = Directory(self.fullpath + os.sep + name)
-		elif e.characterSpecialDevice:
-			obj = CharacterDevice(self.fullpath + os.sep + name)
-		elif e.blockSpecialDevice:
-			obj = BlockDevice(self.fullpath + os.sep + name)
-		elif e.symbolicLink:
-			obj = SymbolicLink(self.fullpath + os.sep + name)
-		elif e.regular:
-			obj = File(self.fullpath + os.sep + name)
-		elif e.fifo:
-			obj = Fifo(self.fullpath + os.sep + name)
-		elif e.socket:
-			obj = Socket(self.fullpath + os.sep + name)
-		else:
-			obj = e
+	def __objectForType(self, name, entry_type, fsdata=None):
+		obj = MakeObjectForType(self.fullpath + os.sep + name, entry_type, **self._snapshotOptions())
+		if fsdata != None and obj.snapshot:
+			obj._seedSnapshot(fsdata)
 		return obj
 
+	# End __objectForType
+
+
+	def __getObjectAccordingToClass(self,name,path):
+		try:
+			fsdata = os.lstat(self.fullpath + os.sep + name)
+			entry_type = TypeFromMode(fsdata.st_mode)
+		except OSError as e:
+			fsdata = None
+			entry_type = NO_TYPE
+		return self.__objectForType(name, entry_type, fsdata)
+
 	# End __getObjectAccordingToClass
 
 
+	def __scan(self):
+		"""Yield a (name, type, fsdata) tuple for each entry of the directory.
+
+		With scandir available the type comes from the directory read itself
+		(d_type) and fsdata is None; the entry is only stat'ed when d_type
+		does not identify it, which is the case for device files, fifos,
+		sockets, and file systems that do not fill in d_type.  Without
+		scandir each entry costs exactly one lstat."""
+		if scandir:
+			entries = scandir(self.fullpath)
+			try:
+				for entry in entries:
+					fsdata = None
+					if entry.is_symlink():
+						entry_type = SYMBOLIC_LINK
+					elif entry.is_dir(follow_symlinks=False):
+						entry_type = DIRECTORY
+					elif entry.is_file(follow_symlinks=False):
+						entry_type = REGULAR_FILE
+					else:
+						try:
+							fsdata = entry.stat(follow_symlinks=False)
+							entry_type = TypeFromMode(fsdata.st_mode)
+						except OSError as e:
+							entry_type = NO_TYPE
+					yield (entry.name, entry_type, fsdata)
+			finally:
+				# Release the directory descriptor as soon as the scan is
+				# over, or abandoned, rather than when the iterator is
+				# collected.
+				if hasattr(entries, "close"):
+					entries.close()
+		else:
+			for name in os.listdir(self.fullpath):
+				try:
+					fsdata = os.lstat(self.fullpath + os.sep + name)
+					entry_type = TypeFromMode(fsdata.st_mode)
+				except OSError as e:
+					fsdata = None
+					entry_type = NO_TYPE
+				yield (name, entry_type, fsdata)
+
+	# End __scan
+
+
+	def __listing(self, entry_types=None, tolerate_dry_run=True):
+		try:
+			scanned = list(self.__scan())
+		except OSError as e:
+			if not tolerate_dry_run or not Object.global_dry_run:
+				raise e
+			scanned = []
+
+		listing = []
+		for name, entry_type, fsdata in scanned:
+			if entry_types == None or entry_type in entry_types:
+				listing.append(self.__objectForType(name, entry_type, fsdata))
+		return listing
+
+	# End __listing
+
 
 	@property
 	def entries(self):
-		entries = []
-		names = os.listdir(self.fullpath)
-		for name in names:
-			entries.append(self.__getObjectAccordingToClass(name,self.fullpath))
-
-		return entries
+		return self.__listing(tolerate_dry_run=False)
 	# End entries
 
 
 	@property
 	def empty(self):
-		return len(self.entries) == 0
+		try:
+			scanned = self.__scan()
+			try:
+				for entry in scanned:
+					return False
+			finally:
+				scanned.close()
+		except OSError as e:
+			if not Object.global_dry_run:
+				raise e
+		return True
 
 	# End empty
 
@@ -105,244 +210,516 @@ class Directory(FileSystemBaseObject):
 
 	@property
 	def files(self):
-		files = []
-		try:
-			entries = os.listdir(self.fullpath)
-		except OSError as e:
-			if not Object.global_dry_run:
-				raise e
-			entries = []
-
-		for entry in entries:
-			obj = FileSystemBaseObject(self.fullpath + os.sep + entry)
-			if not obj.directory and \
-			   not obj.socket and \
-			   not obj.symbolicLink and \
-			   not obj.fifo:
-				files.append(self.__getObjectAccordingToClass(entry,self.fullpath))
-		return files
+		return self.__listing(FILE_TYPES)
 	# End files
 
 	@property
 	def directories(self):
-		directories = []
-		try:
-			entries = os.listdir(self.fullpath)
-		except OSError as e:
-			if not Object.global_dry_run:
-				raise e
-			entries = []
-		for entry in entries:
-			obj = self.__getObjectAccordingToClass(entry,self.fullpath)
-			if obj.directory:
-				directories.append(obj)
-		return directories
+		return self.__listing((DIRECTORY,))
 	# End directories
 
 	@property
 	def characters(self):
-		specials = []
-		try:
-			entries = os.listdir(self.fullpath)
-		except OSError as e:
-			if not Object.global_dry_run:
-				raise e
-			entries = []
-		for entry in entries:
-			obj = self.__getObjectAccordingToClass(entry,self.fullpath)
-			if obj.characterSpecialDevice:
-				specials.append(obj)
-		return specials
+		return self.__listing((CHARACTER_DEVICE,))
 	# End characters
 
 	@property
 	def blocks(self):
-		specials = []
-		try:
-			entries = os.listdir(self.fullpath)
-		except OSError as e:
-			if not Object.global_dry_run:
-				raise e
-			entries = []
-		for entry in entries:
-			obj = self.__getObjectAccordingToClass(entry,self.fullpath)
-			if obj.blockSpecialDevice:
-				specials.append(obj)
-		return specials
+		return self.__listing((BLOCK_DEVICE,))
 	# End blocks
 
 	@property
 	def regulars(self):
-		regs = []
-		try:
-			entries = os.listdir(self.fullpath)
-		except OSError as e:
-			if not Object.global_dry_run:
-				raise e
-			entries = []
-		for entry in entries:
-			obj = self.__getObjectAccordingToClass(entry,self.fullpath)
-			if obj.regular:
-				regs.append(obj)
-		return regs
+		return self.__listing((REGULAR_FILE,))
 	# End regulars
 
 	@property
 	def fifos(self):
-		specials = []
-		try:
-			entries = os.listdir(self.fullpath)
-		except OSError as e:
-			if not Object.global_dry_run:
-				raise e
-			entries = []
-		for entry in entries:
-			obj = self.__getObjectAccordingToClass(entry,self.fullpath)
-			if obj.fifo:
-				specials.append(obj)
-		return specials
+		return self.__listing((FIFO,))
 	# End fifos
 
 	@property
 	def links(self):
-		specials = []
-		try:
-			entries = os.listdir(self.fullpath)
-		except OSError as e:
-			if not Object.global_dry_run:
-				raise e
-			entries = []
-		for entry in entries:
-			obj = self.__getObjectAccordingToClass(entry,self.fullpath)
-			if obj.symbolicLink:
-				specials.append(obj)
-		return specials
+		return self.__listing((SYMBOLIC_LINK,))
 	# End links
 
 	@property
 	def sockets(self):
-		specials = []
-		try:
-			entries = os.listdir(self.fullpath)
-		except OSError as e:
-			if not Object.global_dry_run:
-				raise e
-			entries = []
-		for entry in entries:
-			obj = self.__getObjectAccordingToClass(entry,self.fullpath)
-			if obj.socket:
-				specials.append(obj)
-		return specials
+		return self.__listing((SOCKET,))
 	# End sockets
 
 
+	def walk(self, entry_types=None, prune=None, onerror=None, workers=1, ordered=True):
+		"""Generate every entry below the directory, visiting each directory
+		exactly once.
+
+		Entries are yielded lazily, a directory at a time: first the entries
+		of a directory, then the entries of each of its subdirectories in
+		turn.  entry_types restricts what is yielded to a sequence of type
+		constants (DIRECTORY, REGULAR_FILE, ...) but does not stop the walk
+		from descending.  prune, if given, is called with each subdirectory
+		and returning True keeps the walk out of it.  onerror, if given, is
+		called with the OSError of a directory that cannot be read and the
+		walk carries on; otherwise the error is raised (or ignored during a
+		dry run).
+
+		With workers greater than one the directories are read on a pool of
+		that many threads, which overlaps the file system round trips of
+		different directories.  The entries then come out in the same order
+		as a serial walk when ordered is True, or as soon as each directory
+		has been read when ordered is False.  prune and onerror are always
+		called from the calling thread."""
+		if workers > 1:
+			return self.__parallelWalk(entry_types, prune, onerror, workers, ordered)
+		return self.__serialWalk(entry_types, prune, onerror)
+
+	# End walk
+
+
+	def __expand(self, scanned, entry_types, prune):
+		matches = []
+		subdirectories = []
+		for name, entry_type, fsdata in scanned:
+			obj = None
+			if entry_types == None or entry_type in entry_types:
+				obj = self.__objectForType(name, entry_type, fsdata)
+				matches.append(obj)
+			if entry_type == DIRECTORY:
+				if obj == None:
+					obj = self.__objectForType(name, entry_type, fsdata)
+				if prune == None or not prune(obj):
+					subdirectories.append(obj)
+		return (matches, subdirectories)
+
+	# End __expand
+
+
+	def __walkError(self, error, onerror):
+		if onerror != None:
+			onerror(error)
+		elif not Object.global_dry_run:
+			raise error
+
+	# End __walkError
+
+
+	def __serialWalk(self, entry_types, prune, onerror):
+		pending = [self]
+		while len(pending) > 0:
+			directory = pending.pop()
+			try:
+				scanned = list(directory.__scan())
+			except OSError as e:
+				self.__walkError(e, onerror)
+				continue
+
+			matches, subdirectories = directory.__expand(scanned, entry_types, prune)
+			for obj in matches:
+				yield obj
+
+			subdirectories.reverse()
+			pending.extend(subdirectories)
+
+	# End __serialWalk
+
+
+	def __scanWorker(self, tasks, results, stop):
+		while True:
+			task = tasks.get()
+			if task == None:
+				return
+			key, directory = task
+			if stop.is_set():
+				continue
+			try:
+				results.put((key, list(directory.__scan()), None))
+			except Exception as e:
+				results.put((key, None, e))
+
+	# End __scanWorker
+
+
+	def __parallelWalk(self, entry_types, prune, onerror, workers, ordered):
+		tasks = queue.Queue()
+		results = queue.Queue()
+		stop = threading.Event()
+		threads = []
+		for i in range(workers):
+			thread = threading.Thread(target=self.__scanWorker, args=(tasks, results, stop))
+			thread.daemon = True
+			thread.start()
+			threads.append(thread)
+
+		directories = { 0 : self }
+		expanded = {}
+		next_key = [1]
+		outstanding = [1]
+		tasks.put((0, self))
+
+		def collect():
+			key, scanned, error = results.get()
+			outstanding[0] -= 1
+			directory = directories.pop(key)
+			if error != None:
+				if not isinstance(error, OSError):
+					raise error
+				self.__walkError(error, onerror)
+				expanded[key] = ([], [])
+				return key
+
+			matches, subdirectories = directory.__expand(scanned, entry_types, prune)
+			children = []
+			for subdirectory in subdirectories:
+				child_key = next_key[0]
+				next_key[0] += 1
+				directories[child_key] = subdirectory
+				outstanding[0] += 1
+				tasks.put((child_key, subdirectory))
+				children.append(child_key)
+			expanded[key] = (matches, children)
+			return key
+
+		# End collect
+
+		try:
+			if ordered:
+				pending = [0]
+				while len(pending) > 0:
+					key = pending.pop()
+					while not key in expanded:
+						collect()
+					matches, children = expanded.pop(key)
+					for obj in matches:
+						yield obj
+					children.reverse()
+					pending.extend(children)
+			else:
+				while outstanding[0] > 0:
+					key = collect()
+					matches, children = expanded.pop(key)
+					for obj in matches:
+						yield obj
+		finally:
+			stop.set()
+			for thread in threads:
+				tasks.put(None)
+
+	# End __parallelWalk
+
+
 	@property
 	def all_directories(self):
-		dirs = self.directories
-		for d in self.directories:
-			dirs.extend(d.all_directories)
-		return dirs
+		return list(self.walk((DIRECTORY,)))
 	# End all_directories
 
 
 	@property
 	def all_files(self):
-		files = self.files
-		dirs = self.directories
-		for d in dirs:
-			files.extend(d.all_files)
-		return files
+		return list(self.walk(FILE_TYPES))
 	# End all_files
 
 	@property
 	def all_characters(self):
-		files = self.characters
-		dirs = self.directories
-		for d in dirs:
-			files.extend(d.all_characters)
-		return files
+		return list(self.walk((CHARACTER_DEVICE,)))
 	# End all_characters
 
 	@property
 	def all_blocks(self):
-		files = self.blocks
-		dirs = self.directories
-		for d in dirs:
-			files.extend(d.all_blocks)
-		return files
+		return list(self.walk((BLOCK_DEVICE,)))
 	# End all_blocks
 
 	@property
 	def all_regulars(self):
-		files = self.regulars
-		dirs = self.directories
-		for d in dirs:
-			files.extend(d.all_regulars)
-		return files
+		return list(self.walk((REGULAR_FILE,)))
 	# End all_regulars
 
 	@property
 	def all_fifos(self):
-		files = self.fifos
-		dirs = self.directories
-		for d in dirs:
-			files.extend(d.all_fifos)
-		return files
+		return list(self.walk((FIFO,)))
 	# End all_fifos
 
 	@property
 	def all_links(self):
-		files = self.links
-		dirs = self.directories
-		for d in dirs:
-			files.extend(d.all_links)
-		return files
+		return list(self.walk((SYMBOLIC_LINK,)))
 	# End all_links
 
 	@property
 	def all_sockets(self):
-		files = self.sockets
-		dirs = self.directories
-		for d in dirs:
-			files.extend(d.all_sockets)
-		return files
+		return list(self.walk((SOCKET,)))
 	# End all_sockets
 
 	@property
 	def all_entries(self):
-		entries = self.entries
-		dirs = self.directories
-		for d in dirs:
-			entries.append(d)
-			entries.extend(d.all_entries)
-		return entries
+		return list(self.walk())
 	# End all_entries
 
 
+	def __buildIndex(self):
+		if self.__names != None:
+			return
+		listings = {}
+		for entry in self.walk():
+			listings.setdefault(os.path.normpath(os.path.dirname(entry.fullpath)), []).append(entry)
+
+		# The lists keep the order of a depth-first search, each entry
+		# followed by everything below it, as the recursive getChildren
+		# returned them; the walk lists a whole directory first.
+		names = {}
+		extensions = {}
+		pending = [ iter(listings.get(os.path.normpath(self.fullpath), [])) ]
+		while len(pending) > 0:
+			for entry in pending[-1]:
+				names.setdefault(entry.name, []).append(entry)
+				if entry.hasExtension:
+					extensions.setdefault(entry.extension, []).append(entry)
+				if isinstance(entry, Directory):
+					pending.append(iter(listings.get(os.path.normpath(entry.fullpath), [])))
+					break
+			else:
+				pending.pop()
+		self.__names = names
+		self.__extensions = extensions
+
+	# End __buildIndex
+
+
+	def invalidateIndex(self):
+		"""Forget the name and extension index used by hasChild,
+		getChildren, filesWithExtension and extensions; the next lookup
+		walks the tree again."""
+		self.__names = None
+		self.__extensions = None
+
+	# End invalidateIndex
+
+
+	def invalidate(self):
+		FileSystemBaseObject.invalidate(self)
+		self.invalidateIndex()
+
+	# End invalidate
+
+
 	@property
 	def extensions(self):
-		allEntries = self.all_entries
-		extensions = {}
-		for entry in allEntries:
-			if entry.hasExtension:
-				if not entry.extension in extensions:
-					extensions[entry.extension] = True
-		return extensions.keys()
+		self.__buildIndex()
+		return self.__extensions.keys()
 
 	# End extensions
 
 
+	def filesWithExtension(self, extension):
+		self.__buildIndex()
+		return list(self.__extensions.get(str(extension), []))
+
+	# End filesWithExtension
+
+
+	def manifest(self, algorithm=DEFAULT_ALGORITHM, workers=8, processes=False, cache=None,
+			use_mmap=False, chunk_size=DEFAULT_CHUNK_SIZE, prune=None):
+		"""Hash every regular file below the directory and return a
+		Checksums.Manifest keyed on paths relative to the directory.
+
+		The files are hashed on a pool of workers threads; hashing releases
+		the GIL, so the threads overlap both the reads and the digests.
+		With processes set a pool of processes is used instead, which also
+		spreads the algorithms that hold the GIL (crc32, adler32) over the
+		cores.  When cache (a Checksums.ChecksumCache) is given, files it
+		already knows are not read.  prune is passed on to walk()."""
+		root = self.fullpath
+		names = [ entry.fullpath for entry in self.walk((REGULAR_FILE,), prune=prune) ]
+		algorithm = str(algorithm).lower()
+
+		result = Manifest(root, algorithm)
+		pending = []
+		for name in names:
+			if cache != None:
+				try:
+					fsdata = os.stat(name)
+				except OSError as e:
+					fsdata = None
+				if fsdata != None:
+					digest = cache.lookup(fsdata, algorithm)
+					if digest != None:
+						result.add(os.path.relpath(name, root), digest, fsdata.st_size, fsdata.st_mtime)
+						continue
+			pending.append((name, algorithm, chunk_size, use_mmap))
+
+		if processes:
+			pool = multiprocessing.Pool(max(1, workers))
+		else:
+			pool = ThreadPool(max(1, workers))
+		try:
+			records = pool.map(ManifestRecordOfFile, pending)
+		finally:
+			pool.close()
+			pool.join()
+
+		failures = []
+		for name, digest, size, mtime, error in records:
+			if error != None:
+				failures.append("%s: %s" % (name, error))
+				continue
+			result.add(os.path.relpath(name, root), digest, size, mtime)
+			if cache != None:
+				try:
+					fsdata = os.stat(name)
+				except OSError as e:
+					continue
+				if fsdata.st_size == size and fsdata.st_mtime == mtime:
+					cache.store(fsdata, digest, algorithm)
+
+		if len(failures) > 0:
+			raise FileSystemError("Unable to hash %s: %s" % (root, "; ".join(failures)))
+		return result
+
+	# End manifest
+
+
+	def __relativeTypes(self, workers):
+		# The type of each entry is the one the walk read from the directory
+		# (see _ScannedType); entry.type would lstat every entry again.
+		root = self.fullpath
+		return dict([ (os.path.relpath(entry.fullpath, root), _ScannedType(entry)) for entry in self.walk(workers=workers) ])
+
+	# End __relativeTypes
+
+
+	def compareTree(self, other, workers=8, use_mmap=False):
+		"""Compare the tree below the directory with the tree below other
+		and return (only_here, only_there, different), three sorted lists
+		of relative paths.  Entries of different types differ, regular
+		files are compared by contents on a pool of workers threads,
+		symbolic links by their targets, and other entries by type only."""
+		other = Directory(str(other))
+		here = self.__relativeTypes(workers)
+		there = other.__relativeTypes(workers)
+
+		only_here = sorted([ path for path in here if not path in there ])
+		only_there = sorted([ path for path in there if not path in here ])
+
+		different = []
+		files = []
+		for path in here:
+			if not path in there:
+				continue
+			if here[path] != there[path]:
+				different.append(path)
+			elif here[path] == REGULAR_FILE:
+				files.append(path)
+			elif here[path] == SYMBOLIC_LINK:
+				if not SameLinks(os.path.join(self.fullpath, path), os.path.join(other.fullpath, path)):
+					different.append(path)
+
+		pairs = [ (os.path.join(self.fullpath, path), os.path.join(other.fullpath, path)) for path in files ]
+		for path, same in zip(files, SameContentsOfPairs(pairs, workers, use_mmap=use_mmap)):
+			if not same:
+				different.append(path)
+
+		return (only_here, only_there, sorted(different))
+
+	# End compareTree
+
+
+	def ContentsSameQ(self, other):
+		"""Two directories have the same contents when the trees below them
+		hold the same entries and compareTree finds no difference."""
+		if self.__class__ != other.__class__:
+			raise FileSystemError("%s not a %s" % (str(other),str(self.__class__)))
+		try:
+			return self.compareTree(other) == ([], [], [])
+		except OSError as e:
+			return False
+
+	# End ContentsSameQ
+
+
+	def __pairTypes(self, other, path):
+		pair = []
+		for root in (self, other):
+			try:
+				pair.append(TypeFromMode(os.lstat(os.path.join(root.fullpath, path)).st_mode))
+			except OSError as e:
+				pair.append(NO_TYPE)
+		return tuple(pair)
+
+	# End __pairTypes
+
+
+	def __fileDifferences(self, other, files, workers, processes, context, max_hunks):
+		pairs = [ (os.path.join(self.fullpath, path), os.path.join(other.fullpath, path),
+			os.path.join(self.name, path), os.path.join(other.name, path)) for path in files ]
+		return dict(zip(files, DifferencesOfPairs(pairs, workers, processes, context, max_hunks)))
+
+	# End __fileDifferences
+
+
+	def differences(self, other, workers=8, processes=False, context=3, max_hunks=None):
+		"""Return a dictionary mapping the relative path of each regular file
+		that differs between the tree below the directory and the tree below
+		other to its unified diff.  The files are diffed on a pool of workers
+		threads, or processes when processes is set."""
+		other = Directory(str(other))
+		only_here, only_there, different = self.compareTree(other, workers)
+		files = [ path for path in different if self.__pairTypes(other, path) == (REGULAR_FILE, REGULAR_FILE) ]
+		return self.__fileDifferences(other, files, workers, processes, context, max_hunks)
+
+	# End differences
+
+
+	def Difference(self, other, context=3, max_hunks=None, workers=8):
+		"""The differences between the trees below the directory and below
+		other in the form of diff -ru --no-dereference: a line for each
+		entry found in only one of them, the unified diffs of the differing
+		regular files and a line for each other differing pair of entries.
+		None when the trees are the same."""
+		if self.__class__ != other.__class__:
+			raise FileSystemError("%s not a %s" % (str(other),str(self.__class__)))
+		only_here, only_there, different = self.compareTree(other, workers)
+		kinds = dict([ (path, self.__pairTypes(other, path)) for path in different ])
+		files = [ path for path in different if kinds[path] == (REGULAR_FILE, REGULAR_FILE) ]
+		texts = self.__fileDifferences(other, files, workers, False, context, max_hunks)
+
+		output = []
+		for root, paths in ((self, only_here), (other, only_there)):
+			for path in paths:
+				parent, name = os.path.split(os.path.join(root.fullpath, path))
+				output.append("Only in %s: %s\n" % (parent, name))
+		for path in different:
+			here = os.path.join(self.fullpath, path)
+			there = os.path.join(other.fullpath, path)
+			type_here, type_there = kinds[path]
+			if path in texts:
+				if texts[path] != None:
+					output.append(texts[path])
+			elif type_here == type_there == SYMBOLIC_LINK:
+				output.append("Symbolic links %s and %s differ\n" % (here, there))
+			elif type_here != type_there:
+				output.append("File %s is a %s while file %s is a %s\n" % (here,
+					TYPE_DESCRIPTIONS.get(type_here, "file"), there, TYPE_DESCRIPTIONS.get(type_there, "file")))
+			else:
+				output.append("File %s differs from %s\n" % (here, there))
+
+		if len(output) == 0:
+			return None
+		return "".join(output)
+
+	# End Difference
+
+
 	def create(self):
 		if Object.log_object and Object.global_dry_run:
 			Object.log_object.log("mkdir " + self.fullpath)
 		if not Object.global_dry_run:
 			os.makedirs(self.fullpath)
+		self.invalidate()
 
 	# End create
 
 	def remove(self):
 		if os.path.exists(self.fullpath):
 			shutil.rmtree(self.fullpath)
+		self.invalidate()
 
 	# End remove
 
@@ -352,6 +729,7 @@ class Directory(FileSystemBaseObject):
 			theStuff = self.entries
 			for theObject in theStuff:
 				theObject.remove()
+		self.invalidateIndex()
 	# End removeContents
 
 
@@ -390,25 +768,15 @@ class Directory(FileSystemBaseObject):
 
 
 	def hasChild(self,child):
-		for entry in self.entries:
-			if child == entry.name:
-				return True
-			if entry.directory:
-				if entry.hasChild(child):
-					return True
-		return False
+		self.__buildIndex()
+		return child in self.__names
 
 	# End hasChild
 
 
 	def getChildren(self,child):
-		children = []
-		for entry in self.entries:
-			if child == entry.name:
-				children.append(entry)
-			if entry.directory:
-				children.extend(entry.getChildren(child))
-		return children
+		self.__buildIndex()
+		return list(self.__names.get(child, []))
 	# End getChildren
 
 
@@ -430,6 +798,44 @@ class Directory(FileSystemBaseObject):
 
 
 
+def MakeObjectForType(name, entry_type, **kwargs):
+	if entry_type == DIRECTORY:
+		return Directory(name, **kwargs)
+	elif entry_type == CHARACTER_DEVICE:
+		return CharacterDevice(name, **kwargs)
+	elif entry_type == BLOCK_DEVICE:
+		return BlockDevice(name, **kwargs)
+	elif entry_type == SYMBOLIC_LINK:
+		return SymbolicLink(name, **kwargs)
+	elif entry_type == REGULAR_FILE:
+		return File(name, **kwargs)
+	elif entry_type == FIFO:
+		return Fifo(name, **kwargs)
+	elif entry_type == SOCKET:
+		return Socket(name, **kwargs)
+	return FileSystemBaseObject(name, **kwargs)
+
+# End MakeObjectForType
+
+
+def _ScannedType(obj):
+	# The entry type that MakeObjectForType made obj for.
+	return _SCANNED_TYPES.get(type(obj), NO_TYPE)
+
+# End _ScannedType
+
+
+_SCANNED_TYPES = {
+	Directory : DIRECTORY,
+	CharacterDevice : CHARACTER_DEVICE,
+	BlockDevice : BLOCK_DEVICE,
+	SymbolicLink : SYMBOLIC_LINK,
+	File : REGULAR_FILE,
+	Fifo : FIFO,
+	Socket : SOCKET
+}
+
+
 def MakeDirectoryAndRemovePreviousContents(name,clearDirectory=True):
 	if os.path.exists(name):
 		if not clearDirectory:
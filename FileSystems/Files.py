@@ -26,11 +26,32 @@
 #
 ################################################################################
 
+import os
 import re
+import mmap
+import stat
+import tempfile
+from multiprocessing.pool import ThreadPool
 from .. Objects import Object
 from .. FileSystems import FileSystemBaseObject
 from .. FileSystems import FileSystemError
 
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+LINE_ENDING_EXPRESSION = re.compile(b'\r?\n')
+
+
+def ConvertLineEndingsOfChunk(chunk, platform = None):
+	if platform == "Unix":
+		return chunk.replace(b'\r\n', b'\n')
+	elif platform == "Windows":
+		return chunk.replace(b'\r\n', b'\n').replace(b'\n', b'\r\n')
+	return LINE_ENDING_EXPRESSION.sub(lambda m: b'\n' if len(m.group(0)) == 2 else b'\r\n', chunk)
+
+# End ConvertLineEndingsOfChunk
+
+
 class File(FileSystemBaseObject):
 	"""The File class."""
 
@@ -67,6 +88,71 @@ class File(FileSystemBaseObject):
 	# End contentsAsString
 
 
+	def __checkReadable(self):
+		if not self.regular:
+			raise FileSystemError("%s not a regular file, no contents available" % (str(self.fullpath)))
+		if not self.canRead:
+			raise FileSystemError("Current user does not have read permissions for %s" % (str(self.fullpath)))
+
+	# End __checkReadable
+
+
+	def __generateLines(self, f):
+		try:
+			for line in f:
+				yield line
+		finally:
+			f.close()
+
+	# End __generateLines
+
+
+	def __generateChunks(self, f, chunk_size):
+		try:
+			while True:
+				chunk = f.read(chunk_size)
+				if not chunk:
+					break
+				yield chunk
+		finally:
+			f.close()
+
+	# End __generateChunks
+
+
+	def lines(self, mode="r"):
+		"""Iterate over the lines of the file without reading the whole file
+		into memory."""
+		self.__checkReadable()
+		return self.__generateLines(self.openForReading(mode))
+
+	# End lines
+
+
+	def chunks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+		"""Iterate over the raw bytes of the file in blocks of at most
+		chunk_size bytes."""
+		self.__checkReadable()
+		return self.__generateChunks(self.openForReading("rb"), chunk_size)
+
+	# End chunks
+
+
+	def memoryMap(self):
+		"""Return a read-only mmap of the file.  The caller owns the map
+		and should close() it.  Empty files cannot be mapped."""
+		self.__checkReadable()
+		f = self.openForReading("rb")
+		try:
+			return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		except (ValueError, EnvironmentError) as e:
+			raise FileSystemError("Unable to map file %s: %s" % (str(self.fullpath), str(e)))
+		finally:
+			f.close()
+
+	# End memoryMap
+
+
 	@property
 	def extension(self):
 		if self.name.count('.') > 0:
@@ -82,11 +168,19 @@ class File(FileSystemBaseObject):
 	def lineEndings(self):
 		unix = False
 		windows = False
-		for line in self.contents:
-			if line[-2:] == '\r\n':
+		previous = b''
+		for chunk in self.chunks():
+			newlines = chunk.count(b'\n')
+			crlfs = chunk.count(b'\r\n')
+			if previous == b'\r' and chunk[:1] == b'\n':
+				crlfs += 1
+			if crlfs > 0:
 				windows = True
-			elif line[-1] == '\n':
+			if newlines > crlfs:
 				unix = True
+			if unix and windows:
+				break
+			previous = chunk[-1:]
 
 		if unix and windows:
 			return ("Unix", "Windows")
@@ -99,41 +193,71 @@ class File(FileSystemBaseObject):
 	# End lineEndings
 
 
-	def convertLineEndings(self, platform = None):
-		newlines = []
-		if platform == "Unix":
-			for line in self.contents:
-				modLine = line
-				if line[-2:] == '\r\n':
-					modLine = line[:-2] + '\n'
-				newlines.append(modLine)
+	def __convertChunks(self, platform, chunk_size):
+		# A chunk ending in CR is held back and joined to the next one so
+		# that a CRLF pair is never split between two conversions.
+		carry = b''
+		for chunk in self.chunks(chunk_size):
+			chunk = carry + chunk
+			if chunk[-1:] == b'\r':
+				carry = b'\r'
+				chunk = chunk[:-1]
+			else:
+				carry = b''
+			yield ConvertLineEndingsOfChunk(chunk, platform)
+		if carry:
+			yield carry
 
-		elif platform == "Windows":
-			for line in self.contents:
-				modLine = line
-				if line[-1:] == '\n' and (not line[-2:] == '\r\n'):
-					modLine = line[:-1] + '\r\n'
-				newlines.append(modLine)
+	# End __convertChunks
 
-		else:
-			for line in self.contents:
-				modLine = line
-				if re.search(r'\r\n$', line):
-					modLine = re.sub(r'\r\n$','\n', line)
-				elif re.search(r'\n$', line):
-					modLine = re.sub(r'\n$', r'\r\n', line)
-				newlines.append(modLine)
 
+	def convertLineEndings(self, platform = None, chunk_size = DEFAULT_CHUNK_SIZE):
+		"""Convert the line endings of the file to platform ("Unix" or
+		"Windows"), or swap LF and CRLF when platform is None.  The file is
+		converted a chunk at a time into a temporary file that then replaces
+		the original, so a failure never leaves a partially written file."""
+		self.writeAtomically(self.__convertChunks(platform, chunk_size))
 
+	# End convertLineEndings
+
+
+	def writeAtomically(self, chunks):
+		"""Replace the contents of the file with the given sequence of byte
+		strings.  The data is written to a temporary file in the same
+		directory which is renamed over the file once it is complete.  The
+		permission bits of an existing file are kept."""
 		try:
-			f = open(self.fullpath,"w")
-		except IOError as e:
+			fd, temporary = tempfile.mkstemp(prefix="." + self.name + ".", dir=self.path)
+		except EnvironmentError as e:
 			raise FileSystemError("Cannot write to file %s: %s" % (str(self.fullpath), str(e)))
 
-		f.writelines(newlines)
-		f.close()
+		try:
+			with os.fdopen(fd, "wb") as f:
+				for chunk in chunks:
+					f.write(chunk)
+				f.flush()
+				os.fsync(f.fileno())
+			try:
+				os.chmod(temporary, stat.S_IMODE(os.stat(self.fullpath).st_mode))
+			except OSError as e:
+				pass
+			os.rename(temporary, self.fullpath)
+		except EnvironmentError as e:
+			try:
+				os.remove(temporary)
+			except OSError:
+				pass
+			raise FileSystemError("Cannot write to file %s: %s" % (str(self.fullpath), str(e)))
+		except:
+			try:
+				os.remove(temporary)
+			except OSError:
+				pass
+			raise
+		finally:
+			self.invalidate()
 
-	# End convertLineEndings
+	# End writeAtomically
 
 
 	def updateContents(self, newlines=[]):
@@ -159,9 +283,9 @@ class File(FileSystemBaseObject):
 			f.writelines([" "])
 
 
-	def openForReading(self):
+	def openForReading(self, mode="r"):
 		try:
-			f = open(self.fullpath, "r")
+			f = open(self.fullpath, mode)
 		except IOError as e:
 			raise FileSystemError("Cannot open file %s for reading: %s" % (str(self.fullpath), str(e)))
 
@@ -189,3 +313,32 @@ class File(FileSystemBaseObject):
 	# End openForAppending
 
 # End File
+
+
+
+def ConvertLineEndings(files, platform = None, workers = 8):
+	"""Convert the line endings of many files on a pool of worker threads.
+	Every file is attempted; if any conversion fails a FileSystemError
+	naming each failed file is raised once all the others are done."""
+	def convert(name):
+		try:
+			File(str(name)).convertLineEndings(platform)
+		except FileSystemError as e:
+			return (str(name), e.note)
+		except EnvironmentError as e:
+			return (str(name), str(e))
+		return None
+
+	# End convert
+
+	pool = ThreadPool(max(1, workers))
+	try:
+		failures = [ failure for failure in pool.map(convert, files) if failure != None ]
+	finally:
+		pool.close()
+		pool.join()
+
+	if len(failures) > 0:
+		raise FileSystemError("Unable to convert line endings: " + "; ".join([ "%s: %s" % f for f in failures ]))
+
+# End ConvertLineEndings
@@ -0,0 +1,316 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+# Tectiform Open Source License (TOS)
+#
+# Copyright (c) 2015 Tectiform Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+################################################################################
+
+import os
+import re
+import stat
+import sqlite3
+from .. Objects import Object
+from .. FileSystems import FileSystemError
+from .. FileSystems import TypeFromMode
+from .. FileSystems import DIRECTORY, REGULAR_FILE
+from . Directories import Directory, MakeObjectForType, FILE_TYPES, scandir
+from . Checksums import ModificationTimeNS
+
+
+# Bumped whenever the tables change; an index of another schema is rebuilt.
+INDEX_SCHEMA = "2"
+
+
+class DirectoryIndex(Object):
+	"""The DirectoryIndex class.
+
+	A DirectoryIndex keeps the path, type, size, mtime and inode of every
+	entry below a directory in an SQLite file so that inventory queries can
+	be answered without walking the tree.  rescan() brings the index up to
+	date; it stats every indexed directory but lists only those whose own
+	mtime (to the nanosecond), size or inode changed since they were last
+	listed.  Because a directory's mtime
+	only changes when entries are added, removed or renamed, the size and
+	mtime recorded for a file that was modified in place are refreshed only
+	when its directory is relisted (see rescan(full=True))."""
+
+	def __init__(self, directory, filename, **kwargs):
+		Object.__init__(self, **kwargs)
+		self.directory = Directory(str(directory))
+		self.root = self.directory.fullpath
+		self.filename = str(filename)
+
+		try:
+			self.__connection = sqlite3.connect(self.filename)
+			self.__connection.text_factory = str
+			self.__createTables()
+		except sqlite3.Error as e:
+			raise FileSystemError("Unable to open directory index %s: %s" % (self.filename, str(e)))
+
+	# End __init__
+
+
+	def __createTables(self):
+		cursor = self.__connection.cursor()
+		cursor.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+		cursor.execute("SELECT value FROM meta WHERE key = 'schema'")
+		row = cursor.fetchone()
+		if row == None or row[0] != INDEX_SCHEMA:
+			cursor.execute("DROP TABLE IF EXISTS entries")
+			cursor.execute("DROP TABLE IF EXISTS scanned")
+			cursor.execute("DELETE FROM meta")
+			cursor.execute("INSERT INTO meta VALUES ('schema', ?)", (INDEX_SCHEMA,))
+		cursor.execute("CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, parent TEXT NOT NULL, " +
+			"name TEXT NOT NULL, extension TEXT, type INTEGER NOT NULL, size INTEGER, mtime REAL, inode INTEGER)")
+		cursor.execute("CREATE TABLE IF NOT EXISTS scanned (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, inode INTEGER)")
+		cursor.execute("CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent)")
+		cursor.execute("CREATE INDEX IF NOT EXISTS entries_name ON entries (name)")
+		cursor.execute("CREATE INDEX IF NOT EXISTS entries_extension ON entries (extension)")
+
+		cursor.execute("SELECT value FROM meta WHERE key = 'root'")
+		row = cursor.fetchone()
+		if row == None or row[0] != self.root:
+			cursor.execute("DELETE FROM entries")
+			cursor.execute("DELETE FROM scanned")
+			cursor.execute("INSERT OR REPLACE INTO meta VALUES ('root', ?)", (self.root,))
+		self.__connection.commit()
+
+	# End __createTables
+
+
+	def __extension(self, name, entry_type):
+		# Mirrors File.extension, only regular files have extensions.
+		if entry_type != REGULAR_FILE or name.count('.') == 0:
+			return None
+		match = re.search(r'.*\.(.*)$', name)
+		if match and match.group(1):
+			return match.group(1)
+		return None
+
+	# End __extension
+
+
+	def __list(self, path):
+		if scandir:
+			entries = scandir(path)
+			try:
+				for entry in entries:
+					yield (entry.name, entry.stat(follow_symlinks=False))
+			finally:
+				# As Directory does, release the directory descriptor when
+				# the listing is over or abandoned.
+				if hasattr(entries, "close"):
+					entries.close()
+		else:
+			for name in os.listdir(path):
+				yield (name, os.lstat(os.path.join(path, name)))
+
+	# End __list
+
+
+	def __below(self, path):
+		# Every path strictly below path sorts between path/ and path0.
+		return (path.rstrip(os.sep) + os.sep, path.rstrip(os.sep) + chr(ord(os.sep) + 1))
+
+	# End __below
+
+
+	def __forget(self, cursor, path, keep_entry=False):
+		if not keep_entry:
+			cursor.execute("DELETE FROM entries WHERE path = ?", (path,))
+		cursor.execute("DELETE FROM entries WHERE path > ? AND path < ?", self.__below(path))
+		cursor.execute("DELETE FROM scanned WHERE path = ?", (path,))
+		cursor.execute("DELETE FROM scanned WHERE path > ? AND path < ?", self.__below(path))
+
+	# End __forget
+
+
+	def __relist(self, cursor, path, fsdata):
+		cursor.execute("SELECT name, type FROM entries WHERE parent = ?", (path,))
+		previous = dict(cursor.fetchall())
+
+		rows = []
+		subdirectories = []
+		for name, childdata in self.__list(path):
+			childpath = os.path.join(path, name)
+			entry_type = TypeFromMode(childdata.st_mode)
+			if name in previous:
+				if previous.pop(name) == DIRECTORY and entry_type != DIRECTORY:
+					self.__forget(cursor, childpath, keep_entry=True)
+			if entry_type == DIRECTORY:
+				subdirectories.append(childpath)
+			rows.append((childpath, path, name, self.__extension(name, entry_type), entry_type,
+				childdata.st_size, childdata.st_mtime, childdata.st_ino))
+
+		for name in previous:
+			self.__forget(cursor, os.path.join(path, name))
+
+		cursor.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+		cursor.execute("INSERT OR REPLACE INTO scanned VALUES (?, ?, ?, ?)", (path, ModificationTimeNS(fsdata), fsdata.st_size, fsdata.st_ino))
+		return subdirectories
+
+	# End __relist
+
+
+	def rescan(self, full=False):
+		"""Bring the index up to date with the file system and return the
+		number of directories that had to be listed.  With full set every
+		directory is listed again, refreshing the data of every entry."""
+		cursor = self.__connection.cursor()
+		relisted = 0
+		pending = [self.root]
+		try:
+			while len(pending) > 0:
+				path = pending.pop()
+				try:
+					fsdata = os.lstat(path)
+				except OSError as e:
+					self.__forget(cursor, path)
+					continue
+
+				if not stat.S_ISDIR(fsdata.st_mode):
+					self.__forget(cursor, path, keep_entry=True)
+					continue
+
+				if not full:
+					cursor.execute("SELECT mtime_ns, size, inode FROM scanned WHERE path = ?", (path,))
+					row = cursor.fetchone()
+					if row != None and tuple(row) == (ModificationTimeNS(fsdata), fsdata.st_size, fsdata.st_ino):
+						cursor.execute("SELECT path FROM entries WHERE parent = ? AND type = ?", (path, DIRECTORY))
+						pending.extend([ r[0] for r in cursor.fetchall() ])
+						continue
+
+				try:
+					pending.extend(self.__relist(cursor, path, fsdata))
+				except OSError as e:
+					if not Object.global_dry_run:
+						raise e
+				relisted += 1
+			self.__connection.commit()
+		except:
+			self.__connection.rollback()
+			raise
+
+		return relisted
+
+	# End rescan
+
+
+	def __objects(self, query, args=()):
+		cursor = self.__connection.cursor()
+		cursor.execute(query, args)
+		return [ MakeObjectForType(path, entry_type) for path, entry_type in cursor.fetchall() ]
+
+	# End __objects
+
+
+	def __typeClause(self, entry_types):
+		return "type IN (" + ", ".join([ str(int(t)) for t in entry_types ]) + ")"
+
+	# End __typeClause
+
+
+	def entries(self, entry_types=None):
+		"""The indexed entries, optionally restricted to a sequence of type
+		constants, in path order."""
+		if entry_types == None:
+			return self.__objects("SELECT path, type FROM entries ORDER BY path")
+		return self.__objects("SELECT path, type FROM entries WHERE " + self.__typeClause(entry_types) +
+			" ORDER BY path")
+
+	# End entries
+
+
+	@property
+	def all_files(self):
+		return self.entries(FILE_TYPES)
+
+	# End all_files
+
+
+	@property
+	def all_directories(self):
+		return self.entries((DIRECTORY,))
+
+	# End all_directories
+
+
+	def filesWithExtension(self, extension):
+		return self.__objects("SELECT path, type FROM entries WHERE extension = ? ORDER BY path", (str(extension),))
+
+	# End filesWithExtension
+
+
+	@property
+	def extensions(self):
+		cursor = self.__connection.cursor()
+		cursor.execute("SELECT DISTINCT extension FROM entries WHERE extension IS NOT NULL")
+		return [ row[0] for row in cursor.fetchall() ]
+
+	# End extensions
+
+
+	def hasChild(self, child):
+		cursor = self.__connection.cursor()
+		cursor.execute("SELECT 1 FROM entries WHERE name = ? LIMIT 1", (str(child),))
+		return cursor.fetchone() != None
+
+	# End hasChild
+
+
+	def getChildren(self, child):
+		return self.__objects("SELECT path, type FROM entries WHERE name = ? ORDER BY path", (str(child),))
+
+	# End getChildren
+
+
+	def record(self, path):
+		"""The (type, size, mtime, inode) recorded for path, or None."""
+		cursor = self.__connection.cursor()
+		cursor.execute("SELECT type, size, mtime, inode FROM entries WHERE path = ?", (str(path),))
+		return cursor.fetchone()
+
+	# End record
+
+
+	def close(self):
+		self.__connection.close()
+
+	# End close
+
+
+	def __len__(self):
+		cursor = self.__connection.cursor()
+		cursor.execute("SELECT COUNT(*) FROM entries")
+		return cursor.fetchone()[0]
+
+	# End __len__
+
+
+	def __repr__(self):
+		return self.__class__.__name__ + "(" + self.root + ", " + self.filename + ")"
+
+	# End __repr__
+
+# End DirectoryIndex
@@ -32,12 +32,9 @@ import re
 import time
 import stat
 import types
-import hashlib
 
 from .. Objects import Object
 from .. Errors import Error
-from .. Commands.Shells import Shell
-from .. Commands import CommandError
 
 
 DIRECTORY = 1
@@ -64,6 +61,40 @@ SETGID        = 0x800
 STICKYBIT     = 0x1000
 
 
+def EnableStatSnapshots(ttl=None):
+	"""Make newly created file system objects take a single lstat snapshot
+	and answer every st_* query from it.  If ttl is given (in seconds) the
+	snapshot is retaken once it is older than ttl."""
+	FileSystemBaseObject.snapshot_default = True
+	FileSystemBaseObject.snapshot_ttl_default = ttl
+# End EnableStatSnapshots
+
+
+def DisableStatSnapshots():
+	FileSystemBaseObject.snapshot_default = False
+	FileSystemBaseObject.snapshot_ttl_default = None
+# End DisableStatSnapshots
+
+
+def TypeFromMode(mode):
+	if stat.S_ISDIR(mode):
+		return DIRECTORY
+	if stat.S_ISCHR(mode):
+		return CHARACTER_DEVICE
+	if stat.S_ISBLK(mode):
+		return BLOCK_DEVICE
+	if stat.S_ISREG(mode):
+		return REGULAR_FILE
+	if stat.S_ISFIFO(mode):
+		return FIFO
+	if stat.S_ISLNK(mode):
+		return SYMBOLIC_LINK
+	if stat.S_ISSOCK(mode):
+		return SOCKET
+	return NO_TYPE
+# End TypeFromMode
+
+
 def FindFullDirectory(directory):
 	currentdirectory = os.getcwd()
 	if re.search(r'^\.\/', directory):
@@ -88,7 +119,16 @@ class FileSystemError(Error):
 
 
 class FileSystemBaseObject(Object):
-	"""The FileSystemBaseObject class."""
+	"""The FileSystemBaseObject class.
+
+	By default every st_* property performs its own lstat call.  When the
+	object is created with snapshot=True (or after EnableStatSnapshots()),
+	the first query performs one lstat and every later query is answered
+	from that record until refresh() or invalidate() is called, or until
+	the record is older than snapshot_ttl seconds."""
+
+	snapshot_default = False
+	snapshot_ttl_default = None
 
 	def __init__(self, name, **kwargs):
 		Object.__init__(self, **kwargs)
@@ -101,9 +141,98 @@ class FileSystemBaseObject(Object):
 		else:
 			self.name = strname
 			self._path = None
+
+		if 'snapshot' in kwargs:
+			self.snapshot = kwargs["snapshot"]
+		else:
+			self.snapshot = FileSystemBaseObject.snapshot_default
+
+		if 'snapshot_ttl' in kwargs:
+			self.snapshot_ttl = kwargs["snapshot_ttl"]
+		else:
+			self.snapshot_ttl = FileSystemBaseObject.snapshot_ttl_default
+
+		self._stat = None
+		self._stat_error = None
+		self._stat_time = None
 	# End __init__
 
 
+	def _snapshotOptions(self):
+		return { "snapshot" : self.snapshot, "snapshot_ttl" : self.snapshot_ttl }
+
+	# End _snapshotOptions
+
+
+	def _snapshotValid(self):
+		if self._stat_time == None:
+			return False
+		if self.snapshot_ttl != None:
+			if (time.time() - self._stat_time) > self.snapshot_ttl:
+				return False
+		return True
+
+	# End _snapshotValid
+
+
+	def _lstat(self):
+		if not self.snapshot:
+			return os.lstat(self.fullpath)
+
+		if not self._snapshotValid():
+			self.refresh()
+
+		if self._stat_error:
+			raise self._stat_error
+		return self._stat
+
+	# End _lstat
+
+
+	def refresh(self):
+		"""Take a new lstat snapshot of the object, replacing any previous one.
+		A failed lstat is recorded as well so that repeated queries of a
+		missing object do not go back to the file system."""
+		try:
+			self._stat = os.lstat(self.fullpath)
+			self._stat_error = None
+		except OSError as e:
+			self._stat = None
+			self._stat_error = e
+		self._stat_time = time.time()
+
+	# End refresh
+
+
+	def invalidate(self):
+		"""Drop the current snapshot, the next query will lstat again."""
+		self._stat = None
+		self._stat_error = None
+		self._stat_time = None
+
+	# End invalidate
+
+
+	def _seedSnapshot(self, fsdata):
+		self._stat = fsdata
+		self._stat_error = None
+		self._stat_time = time.time()
+
+	# End _seedSnapshot
+
+
+	@property
+	def statSnapshot(self):
+		"""The os.stat_result the st_* properties are answered from, or
+		None if the object does not exist."""
+		try:
+			return self._lstat()
+		except OSError as e:
+			return None
+
+	# End statSnapshot
+
+
 	@property
 	def basename(self):
 		if self.hasExtension:
@@ -138,7 +267,7 @@ class FileSystemBaseObject(Object):
 	@property
 	def st_mode(self):
 		if not Object.global_dry_run:
-			fsdata = os.lstat(self.fullpath)
+			fsdata = self._lstat()
 			return fsdata.st_mode
 		return 0
 	# End st_mode
@@ -146,7 +275,7 @@ class FileSystemBaseObject(Object):
 	@property
 	def st_ino(self):
 		if not Object.global_dry_run:
-			fsdata = os.lstat(self.fullpath)
+			fsdata = self._lstat()
 			return fsdata.st_ino
 		return 0
 	# End st_ino
@@ -154,7 +283,7 @@ class FileSystemBaseObject(Object):
 	@property
 	def st_dev(self):
 		if not Object.global_dry_run:
-			fsdata = os.lstat(self.fullpath)
+			fsdata = self._lstat()
 			return fsdata.st_dev
 		return 0
 	# End st_dev
@@ -162,7 +291,7 @@ class FileSystemBaseObject(Object):
 	@property
 	def st_nlink(self):
 		if not Object.global_dry_run:
-			fsdata = os.lstat(self.fullpath)
+			fsdata = self._lstat()
 			return fsdata.st_nlink
 		return 0
 	# End st_nlink
@@ -170,7 +299,7 @@ class FileSystemBaseObject(Object):
 	@property
 	def st_uid(self):
 		if not Object.global_dry_run:
-			fsdata = os.lstat(self.fullpath)
+			fsdata = self._lstat()
 			return fsdata.st_uid
 		return 0
 	# End st_uid
@@ -178,7 +307,7 @@ class FileSystemBaseObject(Object):
 	@property
 	def st_gid(self):
 		if not Object.global_dry_run:
-			fsdata = os.lstat(self.fullpath)
+			fsdata = self._lstat()
 			return fsdata.st_gid
 		return 0
 	# End st_gid
@@ -186,7 +315,7 @@ class FileSystemBaseObject(Object):
 	@property
 	def st_size(self):
 		if not Object.global_dry_run:
-			fsdata = os.lstat(self.fullpath)
+			fsdata = self._lstat()
 			return fsdata.st_size
 		return 0
 	# End st_size
@@ -194,7 +323,7 @@ class FileSystemBaseObject(Object):
 	@property
 	def st_atime(self):
 		if not Object.global_dry_run:
-			fsdata = os.lstat(self.fullpath)
+			fsdata = self._lstat()
 			return fsdata.st_atime
 		return 0
 	# End st_atime
@@ -202,7 +331,7 @@ class FileSystemBaseObject(Object):
 	@property
 	def st_mtime(self):
 		if not Object.global_dry_run:
-			fsdata = os.lstat(self.fullpath)
+			fsdata = self._lstat()
 			return fsdata.st_mtime
 		return 0
 	# End st_ino
@@ -210,7 +339,7 @@ class FileSystemBaseObject(Object):
 	@property
 	def st_ctime(self):
 		if not Object.global_dry_run:
-			fsdata = os.lstat(self.fullpath)
+			fsdata = self._lstat()
 			return fsdata.st_ctime
 		return 0
 	# End st_ctime
@@ -258,7 +387,7 @@ class FileSystemBaseObject(Object):
 	@property
 	def symbolicLink(self):
 		try:
-			return os.path.islink(self.fullpath)
+			return stat.S_ISLNK(self.st_mode)
 		except OSError as e:
 			return False
 	# End symbolicLink
@@ -273,21 +402,10 @@ class FileSystemBaseObject(Object):
 
 	@property
 	def type(self):
-		if self.directory:
-			return DIRECTORY
-		if self.characterSpecialDevice:
-			return CHARACTER_DEVICE
-		if self.blockSpecialDevice:
-			return BLOCK_DEVICE
-		if self.regular:
-			return REGULAR_FILE
-		if self.fifo:
-			return FIFO
-		if self.symbolicLink:
-			return SYMBOLIC_LINK
-		if self.socket:
-			return SOCKET
-		return NO_TYPE
+		try:
+			return TypeFromMode(self.st_mode)
+		except OSError as e:
+			return NO_TYPE
 	# End type
 
 	@property
@@ -322,7 +440,7 @@ class FileSystemBaseObject(Object):
 	@property
 	def exists(self):
 		try:
-			result = os.lstat(self.fullpath)
+			result = self._lstat()
 		except OSError as e:
 			return False
 		return True;
@@ -332,13 +450,28 @@ class FileSystemBaseObject(Object):
 	@property
 	def checksum(self):
 		if self.regular:
-			sha256 = hashlib.sha256()
-			with open(self.fullpath, "rb") as f:
-				for chunk in iter(lambda: f.read(4096), b""):
-					sha256.update(chunk)
-			return sha256.hexdigest()
+			return self.computeChecksum()
 		return ""
 
+	# End checksum
+
+
+	def computeChecksum(self, algorithm="sha256", cache=None, use_mmap=False):
+		"""Return the hex digest of the object using algorithm (any name
+		accepted by Checksums.NewChecksum).  Regular files are hashed by
+		content, through cache (a Checksums.ChecksumCache) when one is
+		given; symbolic links are hashed by their target.  Other objects
+		have no checksum and give an empty string."""
+		if self.regular:
+			if cache != None:
+				return cache.checksum(self.fullpath, algorithm, use_mmap=use_mmap)
+			return Checksums.ChecksumOfFile(self.fullpath, algorithm, use_mmap=use_mmap)
+		if self.symbolicLink:
+			return Checksums.ChecksumOfLink(self.fullpath, algorithm)
+		return ""
+
+	# End computeChecksum
+
 	@property
 	def ownerHasReadPermission(self):
 		if stat.S_IMODE(self.st_mode) & stat.S_IRUSR:
@@ -494,6 +627,8 @@ class FileSystemBaseObject(Object):
 			os.chmod(self.fullpath, mode)
 		except OSError as e:
 			raise FileSystemError("Unable to change permissions on file %s: %s" % (self.fullpath, str(e)))
+		finally:
+			self.invalidate()
 
 	# End setPermissions
 
@@ -501,28 +636,22 @@ class FileSystemBaseObject(Object):
 	def remove(self):
 		if self.exists:
 			os.remove(self.fullpath)
+			self.invalidate()
 
 
-	def Difference(self,other):
+	def Difference(self,other,context=3,max_hunks=None):
+		"""The unified diff from the object to other as a string, or None
+		when their contents are the same."""
 		if self.__class__ != other.__class__:
 			raise FileSystemError("%s not a %s" % (str(other),str(self.__class__)))
-		shell = Shell()
-		shell.capture_output = True
-		o = shell.execute("diff " + self.fullpath + " " + other.fullpath)
-		return o
+		return Differences.DifferenceOfFiles(self.fullpath, other.fullpath, context=context, max_hunks=max_hunks)
 	# End Difference
 
 
 	def ContentsSameQ(self,other):
 		if self.__class__ != other.__class__:
 			raise FileSystemError("%s not a %s" % (str(other),str(self.__class__)))
-		shell = Shell()
-		shell.capture_output = True
-		try:
-			shell.execute("diff " + self.fullpath + " " + other.fullpath)
-		except CommandError as e:
-			return False
-		return True
+		return Comparisons.SameContents(self.fullpath, other.fullpath)
 
 	# End ContentsSameQ
 
@@ -534,13 +663,13 @@ class FileSystemBaseObject(Object):
 
 
 	def __add__(self, other):
-		return self.__class__(self.fullpath + os.sep + str(other))
+		return self.__class__(self.fullpath + os.sep + str(other), **self._snapshotOptions())
 
 	# End __add__
 
 
 	def __radd__(self, other):
-		return self.__class__(str(other) + os.sep + self.fullpath)
+		return self.__class__(str(other) + os.sep + self.fullpath, **self._snapshotOptions())
 
 	# End __radd__
 
@@ -593,9 +722,13 @@ def Difference(a,b):
 
 __all__ = ["BlockDevices",
 	"CharacterDevices",
+	"Checksums",
+	"Comparisons",
+	"Differences",
 	"Directories",
 	"Fifos",
 	"Files",
+	"Indexes",
 	"Sockets",
 	"SymbolicLinks",
 	"DIRECTORY",
@@ -618,10 +751,13 @@ __all__ = ["BlockDevices",
 	"SETUID",
 	"SETGID",
 	"STICKYBIT",
-	"FileSystemError"
+	"FileSystemError",
+	"TypeFromMode",
+	"EnableStatSnapshots",
+	"DisableStatSnapshots"
 ]
 
-from . import BlockDevices, CharacterDevices, Directories, Fifos, Files, Sockets, SymbolicLinks
+from . import BlockDevices, CharacterDevices, Checksums, Comparisons, Differences, Directories, Fifos, Files, Indexes, Sockets, SymbolicLinks
 
 
 
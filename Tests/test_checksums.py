@@ -0,0 +1,73 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+# Tectiform Open Source License (TOS)
+#
+# Copyright (c) 2015 Tectiform Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+################################################################################
+
+
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+from .. FileSystems import FileSystemBaseObject
+from .. FileSystems.Checksums import ChecksumOfLink
+from .. FileSystems.Directories import Directory
+
+
+class ChecksumTests(unittest.TestCase):
+
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+
+	# End setUp
+
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	# End tearDown
+
+
+	def testLink(self):
+		with open(os.path.join(self.root, "file"), "wb") as f:
+			f.write(b"contents\n")
+		link = os.path.join(self.root, "link")
+		os.symlink("file", link)
+
+		expected = hashlib.sha256(b"file").hexdigest()
+		self.assertEqual(ChecksumOfLink(link, "sha256"), expected)
+		self.assertEqual(FileSystemBaseObject(link).computeChecksum("sha256"), expected)
+
+		manifest = Directory(self.root).manifest("sha256", workers=2)
+		self.assertEqual(manifest["file"][0], hashlib.sha256(b"contents\n").hexdigest())
+
+	# End testLink
+
+# End ChecksumTests
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,124 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+# Tectiform Open Source License (TOS)
+#
+# Copyright (c) 2015 Tectiform Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+################################################################################
+
+
+import os
+import shutil
+import tempfile
+import unittest
+from .. Tools import ToolError
+from .. Tools.CopyTools import CopyTool, COMPARE_CHECKSUM, LINK_REFLINK
+from .. FileSystems.Checksums import ChecksumCache
+
+
+class VanishingCache(ChecksumCache):
+	"""A ChecksumCache under which the file named vanishing disappears
+	just before it is hashed."""
+
+	def __init__(self, filename, vanishing, **kwargs):
+		ChecksumCache.__init__(self, filename, **kwargs)
+		self.vanishing = vanishing
+
+	# End __init__
+
+
+	def checksum(self, name, *args, **kwargs):
+		if name == self.vanishing and os.path.exists(name):
+			os.remove(name)
+		return ChecksumCache.checksum(self, name, *args, **kwargs)
+
+	# End checksum
+
+# End VanishingCache
+
+
+class CopyToolTests(unittest.TestCase):
+
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+		self.source = os.path.join(self.root, "source")
+		self.destination = os.path.join(self.root, "destination")
+
+	# End setUp
+
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	# End tearDown
+
+
+	def write(self, name, data):
+		if not os.path.isdir(os.path.dirname(name)):
+			os.makedirs(os.path.dirname(name))
+		with open(name, "wb") as f:
+			f.write(data)
+
+	# End write
+
+
+	def testSourceVanishesDuringSync(self):
+		for index in range(4):
+			self.write(os.path.join(self.source, "f%d" % index), b"new %d\n" % index)
+			self.write(os.path.join(self.destination, "f%d" % index), b"old %d\n" % index)
+		vanishing = os.path.join(self.source, "f2")
+		cache = VanishingCache(os.path.join(self.root, "cache.sqlite"), vanishing)
+		try:
+			CopyTool(workers=4).sync(self.source, self.destination, COMPARE_CHECKSUM, cache=cache)
+			self.fail("sync did not raise")
+		except ToolError as e:
+			self.assertTrue(vanishing in e.note, e.note)
+		for index in (0, 1, 3):
+			with open(os.path.join(self.destination, "f%d" % index), "rb") as f:
+				self.assertEqual(f.read(), b"new %d\n" % index)
+
+	# End testSourceVanishesDuringSync
+
+
+	def testDeduplicateDoesNotCopy(self):
+		# Where the file system has no reflinks the duplicate must be left
+		# as it is rather than copied over.
+		self.write(os.path.join(self.source, "a"), b"same\n")
+		self.write(os.path.join(self.source, "b"), b"same\n")
+		before = os.stat(os.path.join(self.source, "b"))
+		tool = CopyTool()
+		replaced, saved = tool.deduplicate(self.source, LINK_REFLINK)
+		self.assertEqual(replaced + tool.files_not_linked, 1)
+		if tool.files_not_linked == 1:
+			after = os.stat(os.path.join(self.source, "b"))
+			self.assertEqual(saved, 0)
+			self.assertEqual(after.st_ino, before.st_ino)
+			self.assertEqual(after.st_mtime, before.st_mtime)
+
+	# End testDeduplicateDoesNotCopy
+
+# End CopyToolTests
+
+
+if __name__ == "__main__":
+	unittest.main()
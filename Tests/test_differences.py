@@ -0,0 +1,164 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+# Tectiform Open Source License (TOS)
+#
+# Copyright (c) 2015 Tectiform Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+################################################################################
+
+
+import os
+import re
+import random
+import shutil
+import tempfile
+import unittest
+from .. FileSystems.Differences import UnifiedDiff
+
+
+HUNK_HEADER = re.compile(br'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@\n')
+
+
+def SplitLines(data):
+	lines = data.split(b'\n')
+	result = [ line + b'\n' for line in lines[:-1] ]
+	if lines[-1]:
+		result.append(lines[-1])
+	return result
+
+# End SplitLines
+
+
+def ApplyHunks(test, hunks, old, context):
+	"""Apply the hunks of a unified diff to the lines old the way patch
+	does without fuzz: every context and removed line must be where the
+	header says.  Also check that each hunk carries all the context there
+	is around it, up to context lines."""
+	new = []
+	position = 0
+	for hunk in hunks:
+		lines = hunk.split(b'\n')[:-1]
+		match = HUNK_HEADER.match(lines[0] + b'\n')
+		test.assertTrue(match != None, hunk)
+		start = int(match.group(1))
+		length = int(match.group(2)) if match.group(2) != None else 1
+		if length > 0:
+			start -= 1
+		test.assertTrue(start >= position)
+		new.extend(old[position:start])
+		position = start
+
+		body = []
+		for line in lines[1:]:
+			if line == b'\\ No newline at end of file':
+				body[-1] = (body[-1][0], body[-1][1][:-1])
+			else:
+				body.append((line[:1], line[1:] + b'\n'))
+		for tag, line in body:
+			if tag in (b' ', b'-'):
+				test.assertEqual(old[position], line)
+				position += 1
+			if tag in (b' ', b'+'):
+				new.append(line)
+		test.assertEqual(position - start, length)
+
+		tags = [ tag for tag, line in body ]
+		leading = len(tags) - len(b''.join(tags).lstrip(b' '))
+		trailing = len(tags) - len(b''.join(tags).rstrip(b' '))
+		test.assertTrue(leading == context or start == 0, hunk)
+		test.assertTrue(trailing == context or position == len(old), hunk)
+	new.extend(old[position:])
+	return new
+
+# End ApplyHunks
+
+
+class DifferenceTests(unittest.TestCase):
+
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+		self.a = os.path.join(self.root, "a")
+		self.b = os.path.join(self.root, "b")
+
+	# End setUp
+
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	# End tearDown
+
+
+	def diff(self, old, new, context):
+		with open(self.a, "wb") as f:
+			f.write(old)
+		with open(self.b, "wb") as f:
+			f.write(new)
+		hunks = list(UnifiedDiff(self.a, self.b, context=context, use_mmap=False))
+		if old == new:
+			self.assertEqual(hunks, [])
+			return
+		self.assertEqual(hunks[0], ("--- %s\n+++ %s\n" % (self.a, self.b)).encode("utf-8"))
+		self.assertEqual(b''.join(ApplyHunks(self, hunks[1:], SplitLines(old), context)), new)
+
+	# End diff
+
+
+	def testRoundTrip(self):
+		generator = random.Random(12)
+		alphabet = [ b"a", b"b", b"c", b"", b"dd" ]
+		for run in range(1500):
+			old = [ generator.choice(alphabet) + b"\n" for i in range(generator.randint(0, 30)) ]
+			new = list(old)
+			for edit in range(generator.randint(1, 4)):
+				where = generator.randint(0, len(new))
+				action = generator.randint(0, 2)
+				if action == 0:
+					new[where:where] = [ generator.choice(alphabet) + b"\n" for i in range(generator.randint(1, 3)) ]
+				elif action == 1:
+					del new[where:where + generator.randint(1, 3)]
+				else:
+					new[where:where + 1] = [ generator.choice(alphabet) + b"\n" ]
+			old = b"".join(old)
+			new = b"".join(new)
+			if generator.randint(0, 4) == 0:
+				old = old.rstrip(b"\n")
+			if generator.randint(0, 4) == 0:
+				new = new.rstrip(b"\n")
+			self.diff(old, new, generator.randint(0, 4))
+
+	# End testRoundTrip
+
+
+	def testMiddleOfLargeFile(self):
+		old = b"".join([ ("line %d\n" % i).encode("utf-8") for i in range(1000) ])
+		new = old.replace(b"line 500\n", b"changed\n").replace(b"line 10\n", b"")
+		self.diff(old, new, 3)
+
+	# End testMiddleOfLargeFile
+
+# End DifferenceTests
+
+
+if __name__ == "__main__":
+	unittest.main()
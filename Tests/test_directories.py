@@ -0,0 +1,160 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+# Tectiform Open Source License (TOS)
+#
+# Copyright (c) 2015 Tectiform Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+################################################################################
+
+import gc
+import os
+import shutil
+import tempfile
+import warnings
+import unittest
+from .. FileSystems.Directories import Directory
+
+
+def WriteFile(name, data):
+	parent = os.path.dirname(name)
+	if not os.path.isdir(parent):
+		os.makedirs(parent)
+	with open(name, "wb") as f:
+		f.write(data)
+
+# End WriteFile
+
+
+class DirectoryTests(unittest.TestCase):
+
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+
+	# End setUp
+
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	# End tearDown
+
+
+	def testDifference(self):
+		a = os.path.join(self.root, "a")
+		b = os.path.join(self.root, "b")
+		WriteFile(os.path.join(a, "same"), b"same\n")
+		WriteFile(os.path.join(b, "same"), b"same\n")
+		WriteFile(os.path.join(a, "sub", "changed"), b"one\ntwo\nthree\n")
+		WriteFile(os.path.join(b, "sub", "changed"), b"one\n2\nthree\n")
+		WriteFile(os.path.join(a, "only_a"), b"a\n")
+		WriteFile(os.path.join(b, "sub", "only_b"), b"b\n")
+
+		text = Directory(a).Difference(Directory(b))
+		self.assertTrue(isinstance(text, str))
+		self.assertTrue(("Only in %s: only_a\n" % a) in text)
+		self.assertTrue(("Only in %s: only_b\n" % os.path.join(b, "sub")) in text)
+		self.assertTrue("-two\n+2\n" in text)
+		self.assertEqual(Directory(a).Difference(Directory(a)), None)
+
+	# End testDifference
+
+
+	def testDifferenceOfOtherEntries(self):
+		a = os.path.join(self.root, "a")
+		b = os.path.join(self.root, "b")
+		for root in (a, b):
+			WriteFile(os.path.join(root, "one"), b"same\n")
+			WriteFile(os.path.join(root, "two"), b"same\n")
+		os.symlink("one", os.path.join(a, "link"))
+		os.symlink("two", os.path.join(b, "link"))
+		WriteFile(os.path.join(a, "kind"), b"file\n")
+		os.mkdir(os.path.join(b, "kind"))
+
+		text = Directory(a).Difference(Directory(b))
+		self.assertEqual(text, "File %s is a regular file while file %s is a directory\n" % (os.path.join(a, "kind"), os.path.join(b, "kind")) +
+			"Symbolic links %s and %s differ\n" % (os.path.join(a, "link"), os.path.join(b, "link")))
+		self.assertEqual(Directory(a).differences(Directory(b)), {})
+
+	# End testDifferenceOfOtherEntries
+
+
+	def testCompareTree(self):
+		a = os.path.join(self.root, "a")
+		b = os.path.join(self.root, "b")
+		WriteFile(os.path.join(a, "d", "same"), b"same\n")
+		WriteFile(os.path.join(b, "d", "same"), b"same\n")
+		WriteFile(os.path.join(a, "d", "changed"), b"one\n")
+		WriteFile(os.path.join(b, "d", "changed"), b"two\n")
+		WriteFile(os.path.join(b, "d", "kind"), b"same\n")
+		os.symlink("same", os.path.join(a, "d", "kind"))
+		os.symlink("same", os.path.join(a, "d", "link"))
+		os.symlink("same", os.path.join(b, "d", "link"))
+		os.mkdir(os.path.join(a, "empty"))
+
+		self.assertEqual(Directory(a).compareTree(Directory(b), workers=2),
+			(["empty"], [], [os.path.join("d", "changed"), os.path.join("d", "kind")]))
+
+	# End testCompareTree
+
+
+	def testEmpty(self):
+		os.mkdir(os.path.join(self.root, "empty"))
+		WriteFile(os.path.join(self.root, "full", "file"), b"")
+		with warnings.catch_warnings(record=True) as caught:
+			warnings.simplefilter("always")
+			self.assertTrue(Directory(os.path.join(self.root, "empty")).empty)
+			self.assertFalse(Directory(os.path.join(self.root, "full")).empty)
+			gc.collect()
+		self.assertEqual([ warning for warning in caught if warning.category.__name__ == "ResourceWarning" ], [])
+
+	# End testEmpty
+
+
+	def testGetChildrenOrder(self):
+		# Whatever order the file system lists them in, the matches come in
+		# depth-first order, each entry before the entries below it.
+		for name in ("a", "b", "c"):
+			WriteFile(os.path.join(self.root, name, "n"), b"")
+			WriteFile(os.path.join(self.root, name, "m", "n"), b"")
+			os.makedirs(os.path.join(self.root, name, "n.d", "n"))
+
+		def search(directory):
+			found = []
+			for entry in directory.entries:
+				if entry.name == "n":
+					found.append(entry.fullpath)
+				if isinstance(entry, Directory):
+					found.extend(search(entry))
+			return found
+
+		expected = search(Directory(self.root))
+		self.assertEqual(len(expected), 9)
+		self.assertEqual([ entry.fullpath for entry in Directory(self.root).getChildren("n") ], expected)
+
+	# End testGetChildrenOrder
+
+# End DirectoryTests
+
+
+if __name__ == "__main__":
+	unittest.main()
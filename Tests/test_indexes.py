@@ -0,0 +1,91 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+# Tectiform Open Source License (TOS)
+#
+# Copyright (c) 2015 Tectiform Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+################################################################################
+
+
+import os
+import shutil
+import tempfile
+import unittest
+from .. FileSystems.Indexes import DirectoryIndex
+
+
+class DirectoryIndexTests(unittest.TestCase):
+
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+		self.tree = os.path.join(self.root, "tree")
+		os.makedirs(os.path.join(self.tree, "sub"))
+		self.index = DirectoryIndex(self.tree, os.path.join(self.root, "index.sqlite"))
+
+	# End setUp
+
+
+	def tearDown(self):
+		self.index.close()
+		shutil.rmtree(self.root)
+
+	# End tearDown
+
+
+	def testChangeWithinTimestampTick(self):
+		sub = os.path.join(self.tree, "sub")
+		mtime_ns = 1700000000 * 1000000000 + 123456700
+		if not hasattr(os.stat(sub), "st_mtime_ns"):
+			self.skipTest("needs st_mtime_ns")
+		os.utime(sub, ns=(mtime_ns, mtime_ns))
+		self.index.rescan()
+		self.assertEqual(self.index.record(os.path.join(sub, "new")), None)
+
+		# One nanosecond later: the same st_mtime as a float.
+		open(os.path.join(sub, "new"), "w").close()
+		os.utime(sub, ns=(mtime_ns + 1, mtime_ns + 1))
+		self.assertEqual(os.stat(sub).st_mtime, float(mtime_ns) / 1000000000)
+		self.index.rescan()
+		self.assertNotEqual(self.index.record(os.path.join(sub, "new")), None)
+
+	# End testChangeWithinTimestampTick
+
+
+	def testReplacedDirectory(self):
+		sub = os.path.join(self.tree, "sub")
+		self.index.rescan()
+		fsdata = os.stat(sub)
+		os.rename(sub, os.path.join(self.root, "old"))
+		os.mkdir(sub)
+		open(os.path.join(sub, "new"), "w").close()
+		os.utime(sub, (fsdata.st_atime, fsdata.st_mtime))
+		self.index.rescan()
+		self.assertNotEqual(self.index.record(os.path.join(sub, "new")), None)
+
+	# End testReplacedDirectory
+
+# End DirectoryIndexTests
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,91 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+# Tectiform Open Source License (TOS)
+#
+# Copyright (c) 2015 Tectiform Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+################################################################################
+
+
+import time
+import threading
+import unittest
+from .. Commands import CommandError
+from .. Commands.Jobs import JobScheduler, JOB_SUCCEEDED, JOB_FAILED, JOB_SKIPPED
+
+
+class JobSchedulerTests(unittest.TestCase):
+
+	def testMaxJobs(self):
+		self.assertRaises(CommandError, JobScheduler, max_jobs=0)
+		self.assertRaises(CommandError, JobScheduler, max_jobs=-2)
+
+	# End testMaxJobs
+
+
+	def testRun(self):
+		scheduler = JobScheduler(max_jobs=2)
+		scheduler.add("echo first", "first")
+		scheduler.add(["sh", "-c", "echo second >&2; exit 3"], "second", depends=["first"])
+		scheduler.add("echo third", "third", depends=["second"])
+		# Closes its output long before it exits, so only its exit can
+		# wake the scheduler.
+		scheduler.add("exec >/dev/null 2>&1; sleep 0.3", "quiet")
+		start = time.time()
+		try:
+			scheduler.run()
+			self.fail("run did not raise")
+		except CommandError as e:
+			jobs = dict([ (job.name, job) for job in e.jobs ])
+		self.assertTrue(time.time() - start < 5)
+		self.assertEqual(jobs["first"].state, JOB_SUCCEEDED)
+		self.assertEqual(jobs["first"].output, "first")
+		self.assertEqual(jobs["second"].state, JOB_FAILED)
+		self.assertEqual(jobs["second"].exit_code, 3)
+		self.assertEqual(jobs["second"].errors, "second")
+		self.assertEqual(jobs["third"].state, JOB_SKIPPED)
+		self.assertEqual(jobs["quiet"].state, JOB_SUCCEEDED)
+		self.assertTrue(jobs["quiet"].elapsed >= 0.3)
+		self.assertTrue(jobs["quiet"].max_rss > 0)
+
+	# End testRun
+
+
+	def testRunInThread(self):
+		scheduler = JobScheduler()
+		for index in range(8):
+			scheduler.add("sleep 0.05; echo %d" % index)
+		results = []
+		thread = threading.Thread(target=lambda: results.extend(scheduler.run()))
+		thread.start()
+		thread.join(10)
+		self.assertFalse(thread.is_alive())
+		self.assertEqual([ job.output for job in results ], [ str(index) for index in range(8) ])
+
+	# End testRunInThread
+
+# End JobSchedulerTests
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,128 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+# Tectiform Open Source License (TOS)
+#
+# Copyright (c) 2015 Tectiform Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+################################################################################
+
+
+import os
+import stat
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+from .. Tools import ToolError, NewFileMode
+from .. Tools.LibTools import LibTool
+
+
+def Which(program):
+	for path in os.environ.get("PATH", "").split(os.pathsep):
+		if os.access(os.path.join(path, program), os.X_OK):
+			return True
+	return False
+
+# End Which
+
+
+class LibToolTests(unittest.TestCase):
+
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+
+	# End setUp
+
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	# End tearDown
+
+
+	def compile(self, name, source):
+		source_name = os.path.join(self.root, name + ".c")
+		with open(source_name, "w") as f:
+			f.write(source)
+		object_name = os.path.join(self.root, name + ".o")
+		subprocess.check_call(["cc", "-c", "-o", object_name, source_name])
+		return object_name
+
+	# End compile
+
+
+	@unittest.skipUnless(Which("cc") and Which("ar") and Which("nm"), "needs cc, ar and nm")
+	def testJoin(self):
+		first = self.compile("first", "int first(void) { return 1; }\n")
+		second = self.compile("second", "int second(void) { return 2; }\n")
+		third = self.compile("third", "int third(void) { return 3; }\n")
+		library = os.path.join(self.root, "libpart.a")
+		subprocess.check_call(["ar", "rcs", library, first, second])
+
+		output = os.path.join(self.root, "libjoined.a")
+		LibTool().join(output, [library, third])
+		self.assertEqual(stat.S_IMODE(os.stat(output).st_mode), NewFileMode())
+
+		listing = subprocess.check_output(["ar", "t", output]).decode("utf-8").split()
+		self.assertEqual(listing, ["first.o", "second.o", "third.o"])
+		index = subprocess.check_output(["nm", "--print-armap", output]).decode("utf-8")
+		for symbol, member in (("first", "first.o"), ("second", "second.o"), ("third", "third.o")):
+			self.assertTrue(("%s in %s" % (symbol, member)) in index, index)
+
+		self.assertRaises(ToolError, LibTool().join, output, third)
+
+	# End testJoin
+
+
+	def testNativeDefault(self):
+		libtool = os.path.join(self.root, "libtool")
+		with open(libtool, "w") as f:
+			f.write("#! /bin/sh\n")
+		os.chmod(libtool, 0o755)
+		platform = sys.platform
+		path = os.environ.get("PATH")
+		try:
+			os.environ["PATH"] = self.root
+			sys.platform = "darwin"
+			self.assertFalse(LibTool().native)
+			self.assertTrue(LibTool(native=True).native)
+			sys.platform = "linux"
+			self.assertTrue(LibTool().native)
+			os.remove(libtool)
+			sys.platform = "darwin"
+			self.assertTrue(LibTool().native)
+		finally:
+			sys.platform = platform
+			if path == None:
+				del os.environ["PATH"]
+			else:
+				os.environ["PATH"] = path
+
+	# End testNativeDefault
+
+# End LibToolTests
+
+
+if __name__ == "__main__":
+	unittest.main()
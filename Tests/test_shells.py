@@ -0,0 +1,98 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+# Tectiform Open Source License (TOS)
+#
+# Copyright (c) 2015 Tectiform Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+################################################################################
+
+
+import os
+import errno
+import shutil
+import tempfile
+import unittest
+from .. Commands.Shells import Shell
+
+
+class CallbackError(Exception):
+	pass
+
+# End CallbackError
+
+
+class ShellTests(unittest.TestCase):
+
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+
+	# End setUp
+
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	# End tearDown
+
+
+	def testStreamCallbackRaises(self):
+		def callback(line):
+			raise CallbackError(line)
+
+		pid_file = os.path.join(self.root, "pid")
+		shell = Shell(stream=True, output_callback=callback)
+		try:
+			shell.execute("echo $$ > %s; exec yes" % pid_file)
+			self.fail("execute did not raise")
+		except CallbackError as e:
+			self.assertEqual(str(e), "y")
+		with open(pid_file) as f:
+			pid = int(f.read())
+		# The command was killed and reaped.
+		try:
+			os.kill(pid, 0)
+			self.fail("the command is still running")
+		except OSError as e:
+			self.assertEqual(e.errno, errno.ESRCH)
+
+	# End testStreamCallbackRaises
+
+
+	def testKeepRecords(self):
+		seen = []
+		shell = Shell(keep_records=2, record_sink=seen.append)
+		for index in range(3):
+			shell.execute("echo %d" % index)
+		self.assertEqual([ record.command for record in shell.records ], ["echo 1", "echo 2"])
+		self.assertEqual(len(seen), 3)
+		shell = Shell(keep_records=0)
+		shell.execute("true")
+		self.assertEqual(len(shell.records), 0)
+
+	# End testKeepRecords
+
+# End ShellTests
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,90 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+# Tectiform Open Source License (TOS)
+#
+# Copyright (c) 2015 Tectiform Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+################################################################################
+
+
+import unittest
+from .. import Tools
+from .. Tools import ToolBaseObject, ToolError, STEP_SUCCEEDED, STEP_FAILED, STEP_SKIPPED
+from .. FileSystems import FileSystemError
+
+
+class FailingShell(object):
+	"""A Shell whose commands named fail raise a FileSystemError, which
+	derives from BaseException and not Exception."""
+
+	def __init__(self, **kwargs):
+		self.exit_code = 0
+
+	# End __init__
+
+
+	def execute(self, command):
+		if command == "fail":
+			raise FileSystemError("no such file")
+		return command
+
+	# End execute
+
+# End FailingShell
+
+
+class ToolTests(unittest.TestCase):
+
+	def setUp(self):
+		self.shell = Tools.Shell
+		Tools.Shell = FailingShell
+
+	# End setUp
+
+
+	def tearDown(self):
+		Tools.Shell = self.shell
+
+	# End tearDown
+
+
+	def testRunQueuedReportsErrors(self):
+		tool = ToolBaseObject()
+		tool.queue("first", "first")
+		tool.queue("fail", "fail", depends=["first"])
+		tool.queue("after", "after", depends=["fail"])
+		tool.queue("other", "other")
+		try:
+			tool.runQueued(workers=2)
+			self.fail("runQueued did not raise")
+		except ToolError as e:
+			states = dict([ (step.name, step.state) for step in e.steps ])
+		self.assertEqual(states, { "first" : STEP_SUCCEEDED, "fail" : STEP_FAILED, "after" : STEP_SKIPPED, "other" : STEP_SUCCEEDED })
+
+	# End testRunQueuedReportsErrors
+
+# End ToolTests
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,129 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+# Tectiform Open Source License (TOS)
+#
+# Copyright (c) 2015 Tectiform Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+################################################################################
+
+
+import os
+import stat
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import unittest
+from .. Tools import NewFileMode
+from .. Tools.ZipTools import ZipTool
+
+
+class ZipToolTests(unittest.TestCase):
+
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+
+	# End setUp
+
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	# End tearDown
+
+
+	def write(self, name, data):
+		name = os.path.join(self.root, name)
+		if not os.path.isdir(os.path.dirname(name)):
+			os.makedirs(os.path.dirname(name))
+		with open(name, "wb") as f:
+			f.write(data)
+
+	# End write
+
+
+	def testZipDirectoryKeepsMembers(self):
+		self.write("other/q", b"q\n")
+		self.write("tree/a", b"a\n" * 1000)
+		output = os.path.join(self.root, "out.zip")
+
+		tool = ZipTool()
+		tool.zip_directory(os.path.join(self.root, "other"), output)
+		tool.zip_directory(os.path.join(self.root, "tree"), output)
+		self.write("tree/b", b"b\n")
+		tool.zip_directory(os.path.join(self.root, "tree"), output)
+
+		with zipfile.ZipFile(output) as archive:
+			self.assertEqual(archive.testzip(), None)
+			self.assertEqual(sorted(archive.namelist()), ["other/", "other/q", "tree/", "tree/a", "tree/b"])
+			self.assertEqual(archive.read("other/q"), b"q\n")
+			self.assertEqual(archive.read("tree/a"), b"a\n" * 1000)
+		self.assertEqual(tool.members_reused, 1)
+		self.assertEqual(stat.S_IMODE(os.stat(output).st_mode), NewFileMode())
+
+	# End testZipDirectoryKeepsMembers
+
+
+	def testTrailingSeparator(self):
+		self.write("tree/s/f", b"f\n")
+		tool = ZipTool()
+		directory = os.path.join(self.root, "tree") + os.sep
+		tool.archive(directory, os.path.join(self.root, "out.zip"))
+		tool.archive(directory, os.path.join(self.root, "out.tar"))
+		with zipfile.ZipFile(os.path.join(self.root, "out.zip")) as archive:
+			self.assertEqual(sorted(archive.namelist()), ["tree/", "tree/s/", "tree/s/f"])
+		archive = tarfile.open(os.path.join(self.root, "out.tar"))
+		try:
+			self.assertEqual(sorted(archive.getnames()), ["tree", "tree/s", "tree/s/f"])
+		finally:
+			archive.close()
+
+	# End testTrailingSeparator
+
+
+	def testSymbolicLinks(self):
+		self.write("tree/s/f", b"f\n")
+		os.symlink("s/f", os.path.join(self.root, "tree", "l"))
+		os.symlink("s", os.path.join(self.root, "tree", "d"))
+		os.symlink("..", os.path.join(self.root, "tree", "s", "up"))
+		os.symlink("missing", os.path.join(self.root, "tree", "x"))
+		tool = ZipTool()
+		directory = os.path.join(self.root, "tree")
+		tool.archive(directory, os.path.join(self.root, "followed.zip"))
+		tool.archive(directory, os.path.join(self.root, "stored.zip"), store_links=True)
+		with zipfile.ZipFile(os.path.join(self.root, "followed.zip")) as archive:
+			self.assertEqual(sorted(archive.namelist()), ["tree/", "tree/d/", "tree/d/f", "tree/l", "tree/s/", "tree/s/f"])
+			self.assertEqual(archive.read("tree/l"), b"f\n")
+			self.assertEqual(archive.read("tree/d/f"), b"f\n")
+		with zipfile.ZipFile(os.path.join(self.root, "stored.zip")) as archive:
+			self.assertEqual(sorted(archive.namelist()), ["tree/", "tree/d", "tree/l", "tree/s/", "tree/s/f", "tree/s/up", "tree/x"])
+			self.assertTrue(stat.S_ISLNK(archive.getinfo("tree/l").external_attr >> 16))
+			self.assertEqual(archive.read("tree/l"), b"s/f")
+
+	# End testSymbolicLinks
+
+# End ZipToolTests
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -3,15 +3,270 @@
 import os
 import re
 import sys
+import stat
 import types
+import errno
+import shutil
+import tempfile
+import uuid
+from shlex import split
+from multiprocessing.pool import ThreadPool
 from .. Objects import Object
+from .. Errors import Error
 from .. Tools import ToolBaseObject, ToolError
 from .. Commands import CommandError
 from .. Commands.Shells import Shell
+from .. FileSystems import FileSystemError
+from .. FileSystems import DIRECTORY, REGULAR_FILE, SYMBOLIC_LINK, FIFO
+from .. FileSystems.Directories import Directory, _ScannedType
+from .. FileSystems.Comparisons import SameContents
+
+try:
+	import fcntl
+except ImportError as e:
+	fcntl = None
+
+
+COMPARE_NONE = 0
+COMPARE_SIZE_MTIME = 1
+COMPARE_CHECKSUM = 2
+
+LINK_NONE = 0
+LINK_REFLINK = 1
+LINK_HARD = 2
+LINK_ONLY = 4
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# The Linux ioctl that makes a file share the extents of another (a reflink).
+FICLONE = 0x40049409
+
+# cp options whose effect the native engine always has.
+NATIVE_OPTIONS = ["-f", "-p", "-R", "-r", "-a"]
+RECURSIVE_OPTIONS = ["-R", "-r", "-a"]
+
+
+def Reflink(source, destination):
+	"""Make the open file destination share the data of the open file source
+	(copy on write).  Returns False when the platform or file system cannot
+	do it."""
+	if fcntl == None or not sys.platform.startswith("linux"):
+		return False
+	try:
+		fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+	except (IOError, OSError) as e:
+		return False
+	return True
+
+# End Reflink
+
+
+def HardLink(source, destination):
+	"""Replace destination by a hard link to source.  The link is made under a
+	temporary name and renamed into place.  Returns False when a hard link
+	cannot be made, for example across file systems."""
+	temporary = os.path.join(os.path.dirname(destination) or ".",
+		"." + os.path.basename(destination) + "." + uuid.uuid4().hex[:8])
+	try:
+		os.link(source, temporary)
+	except OSError as e:
+		return False
+	try:
+		os.rename(temporary, destination)
+	finally:
+		# rename does nothing when both names are already the same file.
+		if os.path.lexists(temporary):
+			os.remove(temporary)
+	return True
+
+# End HardLink
+
+
+def CopyFileData(source, destination):
+	"""Copy the bytes of the open file source to the open file destination
+	and return the number of bytes copied.  The copy is done in the kernel
+	with copy_file_range or sendfile where the platform offers them, and
+	through a large user space buffer otherwise."""
+	size = os.fstat(source.fileno()).st_size
+	copied = 0
+	for name in ("copy_file_range", "sendfile"):
+		if not hasattr(os, name) or not sys.platform.startswith("linux"):
+			continue
+		function = getattr(os, name)
+		try:
+			while copied < size:
+				if name == "copy_file_range":
+					sent = function(source.fileno(), destination.fileno(), size - copied, copied, copied)
+				else:
+					sent = function(destination.fileno(), source.fileno(), copied, size - copied)
+				if sent == 0:
+					break
+				copied += sent
+			if copied >= size:
+				return copied
+		except OSError as e:
+			if not e.errno in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP):
+				raise
+		# Fall back from wherever the offload stopped.
+		source.seek(copied)
+		destination.seek(copied)
+
+	while True:
+		chunk = source.read(COPY_BUFFER_SIZE)
+		if not chunk:
+			break
+		destination.write(chunk)
+		copied += len(chunk)
+	return copied
+
+# End CopyFileData
+
+
+def Unchanged(source, destination, compare, source_stat=None, cache=None):
+	"""Return True if destination already holds what copying source would
+	put there: the same size and modification second (COMPARE_SIZE_MTIME,
+	the same rule as rsync) or the same contents (COMPARE_CHECKSUM).
+	Contents are compared by digest through cache, a ChecksumCache, when
+	one is given, so files unchanged since an earlier run are not read."""
+	if compare == COMPARE_NONE:
+		return False
+	try:
+		if source_stat == None:
+			source_stat = os.stat(source)
+		destination_stat = os.stat(destination)
+	except OSError as e:
+		return False
+	if not stat.S_ISREG(destination_stat.st_mode) or destination_stat.st_size != source_stat.st_size:
+		return False
+	if compare == COMPARE_SIZE_MTIME:
+		return int(destination_stat.st_mtime) == int(source_stat.st_mtime)
+	if cache != None:
+		try:
+			return cache.checksum(source) == cache.checksum(destination)
+		except FileSystemError as e:
+			# Unreadable or gone: not known to be unchanged, and copying
+			# it reports why.
+			return False
+	return SameContents(source, destination)
+
+# End Unchanged
+
+
+def CopyFile(source, destination, preserve=True, compare=COMPARE_NONE, atomic=False, link=LINK_NONE):
+	"""Copy the regular file source to destination, keeping its permission
+	bits and, with preserve, its access and modification times.  Returns
+	the number of bytes copied, or None if destination was left alone
+	because it is unchanged according to compare.  With atomic the data is
+	written to a temporary file next to destination that is renamed over
+	it when complete, so destination is never seen partially written.
+
+	link is a mask of LINK_REFLINK, LINK_HARD and LINK_ONLY.  With LINK_REFLINK the
+	copy shares the data of source where the file system supports it; with
+	LINK_HARD destination becomes a hard link to source when no reflink
+	was made.  Either way no data is copied when it works (0 is returned),
+	and the file is copied normally when it does not, unless LINK_ONLY is
+	also given: then destination is left alone and None is returned."""
+	if link & LINK_ONLY:
+		# A reflink that fails must not have truncated destination.
+		atomic = True
+	source_stat = os.stat(source)
+	if Unchanged(source, destination, compare, source_stat):
+		return None
+
+	try:
+		destination_stat = os.stat(destination)
+	except OSError as e:
+		destination_stat = None
+	if destination_stat != None:
+		if (destination_stat.st_dev, destination_stat.st_ino) == (source_stat.st_dev, source_stat.st_ino):
+			return None
+		if not atomic and destination_stat.st_nlink > 1:
+			# Do not write through a hard link into the other names of the file.
+			os.remove(destination)
+
+	target = destination
+	if atomic:
+		fd, target = tempfile.mkstemp(prefix="." + os.path.basename(destination) + ".", dir=os.path.dirname(destination) or ".")
+		os.close(fd)
+
+	try:
+		copied = None
+		with open(source, "rb") as fsrc:
+			with open(target, "wb") as fdst:
+				if link & LINK_REFLINK and Reflink(fsrc, fdst):
+					copied = 0
+				elif not link & (LINK_HARD | LINK_ONLY):
+					copied = CopyFileData(fsrc, fdst)
+
+		if copied == None:
+			if link & LINK_HARD and HardLink(source, destination):
+				if atomic:
+					os.remove(target)
+				return 0
+			if link & LINK_ONLY:
+				os.remove(target)
+				return None
+			with open(source, "rb") as fsrc:
+				with open(target, "wb") as fdst:
+					copied = CopyFileData(fsrc, fdst)
+
+		if preserve:
+			shutil.copystat(source, target)
+		else:
+			shutil.copymode(source, target)
+		if atomic:
+			os.rename(target, destination)
+	except:
+		if atomic and os.path.lexists(target):
+			os.remove(target)
+		raise
+	return copied
+
+# End CopyFile
+
+
+class SyncReport(Object):
+	"""What a CopyTool.sync call did."""
+
+	def __init__(self, **kwargs):
+		Object.__init__(self, **kwargs)
+		self.files_copied = 0
+		self.bytes_copied = 0
+		self.files_skipped = 0
+		self.bytes_skipped = 0
+		self.files_deleted = 0
+
+	# End __init__
+
+
+	def __str__(self):
+		return "%d files (%d bytes) copied, %d files (%d bytes) unchanged, %d deleted" % (self.files_copied,
+			self.bytes_copied, self.files_skipped, self.bytes_skipped, self.files_deleted)
+
+	# End __str__
+
+
+	def __repr__(self):
+		return self.__class__.__name__ + "(" + str(self) + ")"
+
+	# End __repr__
+
+# End SyncReport
 
 
 class CopyTool(ToolBaseObject):
-	"""The CopyTool class."""
+	"""The CopyTool class.
+
+	By default files are copied in-process: file data is copied by the
+	kernel where possible, metadata is preserved, and the files of
+	copy_multiple and copy_recursively are copied on a pool of workers
+	threads.  With skip_unchanged set to COMPARE_SIZE_MTIME or
+	COMPARE_CHECKSUM, destination files that already match are left
+	alone.  With link_mode set to LINK_REFLINK and/or LINK_HARD, copies
+	share the data of their source where the file system allows (see
+	CopyFile).  The cp (or cmake -E copy) command is used instead when
+	use_cmake is given, when native is False, or when options are given
+	that the native engine does not know."""
 
 	def __init__(self, **kwargs):
 		ToolBaseObject.__init__(self,**kwargs)
@@ -21,11 +276,41 @@ class CopyTool(ToolBaseObject):
 		else:
 			self.copy_command = 'cp'
 
+		self.native = True
 		if 'use_cmake' in kwargs:
 			if kwargs["use_cmake"]:
 				self.copy_command = 'cmake -E copy'
+				self.native = False
+
+		if 'native' in kwargs:
+			self.native = kwargs["native"]
+
+		if 'workers' in kwargs:
+			self.workers = kwargs["workers"]
+		else:
+			self.workers = 8
+
+		if 'preserve' in kwargs:
+			self.preserve = kwargs["preserve"]
+		else:
+			self.preserve = True
+
+		if 'skip_unchanged' in kwargs:
+			self.skip_unchanged = kwargs["skip_unchanged"]
+		else:
+			self.skip_unchanged = COMPARE_NONE
+
+		if 'link_mode' in kwargs:
+			self.link_mode = kwargs["link_mode"]
+		else:
+			self.link_mode = LINK_NONE
+
+		self.files_not_linked = 0
 
 		self.use_escaped_characters = True
+		self.files_copied = 0
+		self.files_skipped = 0
+		self.bytes_copied = 0
 
 	# End __init__
 
@@ -44,44 +329,366 @@ class CopyTool(ToolBaseObject):
 	# End __escapeDifficultCharacters
 
 
+	def __useNative(self, options):
+		if not self.native:
+			return False
+		for opt in options:
+			if not str(opt) in NATIVE_OPTIONS:
+				return False
+		return True
+
+	# End __useNative
 
-	def copy(self, source, destination, options = []):
-		shell = Shell()
 
-		command = self.copy_command
+	def __target(self, source, destination):
+		if os.path.isdir(destination):
+			return os.path.join(destination, os.path.basename(source.rstrip(os.sep)))
+		return destination
+
+	# End __target
+
+
+	def __copyFiles(self, pairs, compare=None, atomic=False, cache=None, report=None):
+		"""Copy the (source, destination) file pairs on the worker pool and
+		raise a single ToolError naming every failure."""
+		if compare == None:
+			compare = self.skip_unchanged
+
+		def copy(pair):
+			try:
+				source_stat = os.stat(pair[0])
+				if Unchanged(pair[0], pair[1], compare, source_stat, cache):
+					return (None, source_stat.st_size, None)
+				return (CopyFile(pair[0], pair[1], self.preserve, COMPARE_NONE, atomic, self.link_mode), 0, None)
+			except EnvironmentError as e:
+				return (None, 0, "%s: %s" % (pair[0], str(e)))
+			except Error as e:
+				# The errors of the package derive from BaseException, and
+				# one escaping here would kill the worker and hang map.
+				return (None, 0, "%s: %s" % (pair[0], e.note))
+
+		# End copy
+
+		if len(pairs) <= 1:
+			results = [ copy(pair) for pair in pairs ]
+		else:
+			pool = ThreadPool(max(1, min(self.workers, len(pairs))))
+			try:
+				results = pool.map(copy, pairs)
+			finally:
+				pool.close()
+				pool.join()
+
+		failures = []
+		for copied, skipped, error in results:
+			if error != None:
+				failures.append(error)
+			elif copied == None:
+				self.files_skipped += 1
+				if report != None:
+					report.files_skipped += 1
+					report.bytes_skipped += skipped
+			else:
+				self.files_copied += 1
+				self.bytes_copied += copied
+				if report != None:
+					report.files_copied += 1
+					report.bytes_copied += copied
+
+		if len(failures) > 0:
+			raise ToolError("Unable to copy " + "; ".join(failures))
+
+	# End __copyFiles
+
+
+	def __copyNative(self, sources, destination, recursive):
+		destination = str(destination)
+		if len(sources) > 1 and not os.path.isdir(destination):
+			raise ToolError("Unable to copy: %s is not a directory" % destination)
+
+		pairs = []
+		directories = []
+		for source in sources:
+			source = str(source)
+			target = self.__target(source, destination)
+			if Object.global_dry_run:
+				Object.logIfDryRun(self, "cp " + ("-R " if recursive else "") + source + " " + target)
+				continue
+			if not os.path.isdir(source):
+				if not os.path.exists(source):
+					raise ToolError("Unable to copy %s: no such file or directory" % source)
+				pairs.append((source, target))
+				continue
+			if not recursive:
+				raise ToolError("Unable to copy %s: is a directory" % source)
+			try:
+				self.__prepareTree(source, target, pairs, directories)
+			except EnvironmentError as e:
+				raise ToolError("Unable to copy %s: %s" % (source, str(e)))
+
+		self.__copyFiles(pairs)
+
+		if self.preserve:
+			for source, target in reversed(directories):
+				try:
+					shutil.copystat(source, target)
+				except OSError as e:
+					pass
+
+	# End __copyNative
+
+
+	def __prepareTree(self, source, target, pairs, directories):
+		"""Create the directories, symbolic links and fifos of the tree below
+		source under target and add its regular files to pairs."""
+		if not os.path.isdir(target):
+			os.makedirs(target)
+		directories.append((source, target))
+
+		for entry in Directory(source).walk():
+			relative = os.path.relpath(entry.fullpath, source)
+			destination = os.path.join(target, relative)
+			# The type the walk found, without the lstat of entry.type.
+			entry_type = _ScannedType(entry)
+			if entry_type == DIRECTORY:
+				if not os.path.isdir(destination):
+					os.mkdir(destination)
+				directories.append((entry.fullpath, destination))
+			elif entry_type == REGULAR_FILE:
+				pairs.append((entry.fullpath, destination))
+			elif entry_type == SYMBOLIC_LINK:
+				link = os.readlink(entry.fullpath)
+				if os.path.islink(destination) and os.readlink(destination) == link:
+					self.files_skipped += 1
+					continue
+				if os.path.lexists(destination):
+					os.remove(destination)
+				os.symlink(link, destination)
+				self.files_copied += 1
+			elif entry_type == FIFO:
+				if not os.path.exists(destination):
+					os.mkfifo(destination, stat.S_IMODE(entry.st_mode))
+			else:
+				raise ToolError("Unable to copy special file %s" % entry.fullpath)
+
+	# End __prepareTree
+
+
+	def __relativeEntries(self, root):
+		if not os.path.isdir(root):
+			return {}
+		return dict([ (os.path.relpath(entry.fullpath, root), entry) for entry in Directory(root).walk() ])
+
+	# End __relativeEntries
+
+
+	def __removeEntry(self, path):
+		if os.path.isdir(path) and not os.path.islink(path):
+			shutil.rmtree(path)
+		else:
+			os.remove(path)
+
+	# End __removeEntry
+
+
+	def sync(self, source, destination, compare=COMPARE_SIZE_MTIME, delete=False, cache=None):
+		"""Make the directory destination hold the same tree as the
+		directory source, copying only the files that differ according to
+		compare (COMPARE_SIZE_MTIME or COMPARE_CHECKSUM, see Unchanged) and,
+		with delete, removing what is not in source.  Files are written to a
+		temporary name and renamed into place.  Returns a SyncReport."""
+		source = str(source).rstrip(os.sep) or os.sep
+		destination = str(destination).rstrip(os.sep) or os.sep
+		report = SyncReport()
+
+		if not os.path.isdir(source):
+			raise ToolError("Unable to sync %s: not a directory" % source)
+
+		if Object.global_dry_run:
+			Object.logIfDryRun(self, "sync " + source + " " + destination)
+			return report
+
+		try:
+			if not os.path.isdir(destination):
+				os.makedirs(destination)
+
+			wanted = self.__relativeEntries(source)
+			existing = self.__relativeEntries(destination)
+
+			if delete:
+				for relative in sorted(existing.keys(), reverse=True):
+					if not relative in wanted and os.path.lexists(existing[relative].fullpath):
+						self.__removeEntry(existing[relative].fullpath)
+						report.files_deleted += 1
+
+			pairs = []
+			directories = [(source, destination)]
+			for relative in sorted(wanted.keys()):
+				entry = wanted[relative]
+				entry_type = _ScannedType(entry)
+				target = os.path.join(destination, relative)
+				if relative in existing and _ScannedType(existing[relative]) != entry_type and os.path.lexists(target):
+					self.__removeEntry(target)
+
+				if entry_type == DIRECTORY:
+					if not os.path.isdir(target):
+						os.mkdir(target)
+					directories.append((entry.fullpath, target))
+				elif entry_type == REGULAR_FILE:
+					pairs.append((entry.fullpath, target))
+				elif entry_type == SYMBOLIC_LINK:
+					link = os.readlink(entry.fullpath)
+					if os.path.islink(target) and os.readlink(target) == link:
+						report.files_skipped += 1
+						continue
+					temporary = target + ".sync-link"
+					if os.path.lexists(temporary):
+						os.remove(temporary)
+					os.symlink(link, temporary)
+					os.rename(temporary, target)
+					report.files_copied += 1
+				elif entry_type == FIFO:
+					if not os.path.exists(target):
+						os.mkfifo(target, stat.S_IMODE(entry.st_mode))
+				else:
+					raise ToolError("Unable to copy special file %s" % entry.fullpath)
+		except EnvironmentError as e:
+			raise ToolError("Unable to sync %s to %s: %s" % (source, destination, str(e)))
+
+		self.__copyFiles(pairs, compare, atomic=True, cache=cache, report=report)
+
+		if self.preserve:
+			for source_directory, target in reversed(directories):
+				try:
+					shutil.copystat(source_directory, target)
+				except OSError as e:
+					pass
+
+		Object.logIfVerbose(self, "sync %s %s: %s" % (source, destination, str(report)))
+		return report
+
+	# End sync
+
+
+	def deduplicate(self, directory, link_mode=LINK_HARD, algorithm="sha256", cache=None):
+		"""Replace the regular files below directory that have the same
+		contents, permissions and owner as an earlier one by links to it
+		(reflinks and/or hard links according to link_mode, see CopyFile).
+		Files are grouped by the digests of Directory.manifest, and with
+		the non-cryptographic algorithms candidates are also compared byte
+		for byte.  A file is never copied: when no link can be made to it,
+		for example across file systems, it is left as it is and counted in
+		files_not_linked.  Returns (files replaced, bytes saved)."""
+		root = Directory(str(directory))
+		self.files_not_linked = 0
+		if Object.global_dry_run:
+			Object.logIfDryRun(self, "deduplicate " + root.fullpath)
+			return (0, 0)
+
+		try:
+			manifest = root.manifest(algorithm, self.workers, cache=cache)
+		except FileSystemError as e:
+			raise ToolError(e.note)
+
+		groups = {}
+		for relative in manifest:
+			name = os.path.join(root.fullpath, relative)
+			try:
+				fsdata = os.lstat(name)
+			except OSError as e:
+				continue
+			digest, size, mtime = manifest[relative]
+			if size == 0:
+				continue
+			key = (digest, size, fsdata.st_mode, fsdata.st_uid, fsdata.st_gid, fsdata.st_dev)
+			groups.setdefault(key, []).append((name, fsdata))
+
+		verify = not algorithm in ("md5", "sha1", "sha224", "sha256", "sha384", "sha512")
+		replaced = 0
+		saved = 0
+		failures = []
+		for key in groups:
+			canonical, canonical_stat = groups[key][0]
+			for name, fsdata in groups[key][1:]:
+				if fsdata.st_ino == canonical_stat.st_ino:
+					continue
+				if verify and not SameContents(canonical, name):
+					continue
+				try:
+					if CopyFile(canonical, name, True, COMPARE_NONE, True, link_mode | LINK_ONLY) == 0:
+						replaced += 1
+						saved += fsdata.st_size
+					else:
+						self.files_not_linked += 1
+				except EnvironmentError as e:
+					failures.append("%s: %s" % (name, str(e)))
+
+		if len(failures) > 0:
+			raise ToolError("Unable to deduplicate " + "; ".join(failures))
+
+		Object.logIfVerbose(self, "deduplicate %s: %d files replaced, %d bytes saved, %d files not linked" % (root.fullpath, replaced, saved, self.files_not_linked))
+		return (replaced, saved)
+
+	# End deduplicate
+
+
+	def __executeCopy(self, copy_command, options, sources, destination):
+		# copy and xcopy are built into cmd, so Windows needs a command line;
+		# elsewhere the arguments are passed as they are, with no quoting.
+		if not re.search(r'win32', sys.platform):
+			arguments = split(copy_command)
+			for opt in options:
+				arguments += split(str(opt))
+			self.execute(arguments + [ str(source) for source in sources ] + [str(destination)])
+			return
+
+		command = copy_command
 		for opt in options:
 			command += " " + str(opt)
 
+		for source in sources:
+			if self.use_escaped_characters:
+				source = self.__escapeDifficultCharacters(str(source))
+			command += " " + str(source)
+
 		if self.use_escaped_characters:
-			source = self.__escapeDifficultCharacters(str(source))
 			destination = self.__escapeDifficultCharacters(str(destination))
 
-		command += " " + str(source) + " " + str(destination)
+		command += " " + str(destination)
 		self.execute(command)
 
+	# End __executeCopy
+
+
+	def copy(self, source, destination, options = []):
+		if self.__useNative(options):
+			recursive = len([ opt for opt in options if str(opt) in RECURSIVE_OPTIONS ]) > 0
+			self.__copyNative([source], destination, recursive)
+			return
+
+		self.__executeCopy(self.copy_command, options, [source], destination)
+
 	# End copy
 
 
 	def copy_multiple(self, sources, destination):
 		if type(sources) != types.ListType and type(sources) != types.TupleType:
 			raise ToolError("First argument of copy_multiple method must be a list or tuple object.")
-		shell = Shell()
-		source_list = ""
-		for source in sources:
-			if self.use_escaped_characters:
-				source = self.__escapeDifficultCharacters(str(source))
-			source_list += str(source) + " "
 
-		if self.use_escaped_characters:
-			destination = self.__escapeDifficultCharacters(str(destination))
+		if self.__useNative([]):
+			self.__copyNative(sources, destination, False)
+			return
 
-		command = self.copy_command + " " + source_list + str(destination)
-		self.execute(command)
+		self.__executeCopy(self.copy_command, [], sources, destination)
 
 	# End copy_multiple
 
 
 	def copy_recursively(self, source, destination, options=[]):
+		if self.__useNative(options) and not re.search(r'win32', sys.platform):
+			self.__copyNative([source], destination, True)
+			return
+
 		if re.search(r'win32', sys.platform):
 			copy_command = 'xcopy'
 		else:
@@ -90,16 +697,7 @@ class CopyTool(ToolBaseObject):
 		if re.search(r'cmake',self.copy_command):
 			copy_command = self.copy_command
 
-		command = copy_command
-		for opt in options:
-			command += " " + str(opt)
-
-		if self.use_escaped_characters:
-			source = self.__escapeDifficultCharacters(str(source))
-			destination = self.__escapeDifficultCharacters(str(destination))
-
-		command += " " + str(source) + " " + str(destination)
-		self.execute(command)
+		self.__executeCopy(copy_command, options, [source], destination)
 
 	# End copy_recursively
 
@@ -3,40 +3,425 @@
 import os
 import re
 import sys
-import types
+import stat
+import struct
+import tempfile
 from .. Objects import Object
-from .. Tools import ToolBaseObject, ToolError
+from .. Tools import ToolBaseObject, ToolError, NewFileMode
 from .. Commands import CommandError
 from .. Commands.Shells import Shell
 
 
+AR_MAGIC = b"!<arch>\n"
+AR_THIN_MAGIC = b"!<thin>\n"
+AR_HEADER_SIZE = 60
+AR_FMAG = b"`\n"
+AR_COPY_SIZE = 1024 * 1024
+
+# The special members of GNU (System V) and BSD archives.
+AR_SYMBOL_INDEX = b"/"
+AR_SYMBOL_INDEX_64 = b"/SYM64/"
+AR_LONG_NAMES = b"//"
+AR_BSD_SYMBOL_INDEXES = (b"__.SYMDEF", b"__.SYMDEF SORTED")
+
+ELF_MAGIC = b"\x7fELF"
+SHT_SYMTAB = 2
+SHN_UNDEF = 0
+STB_GLOBAL = 1
+STB_WEAK = 2
+STB_GNU_UNIQUE = 10
+
+
+class ArchiveMember(Object):
+	"""A member of a static library being written: size bytes from offset
+	of the file source, and the symbols it defines."""
+
+	def __init__(self, name, source, offset, size, **kwargs):
+		Object.__init__(self, **kwargs)
+		self.name = name
+		self.source = source
+		self.offset = offset
+		self.size = size
+		self.mtime = 0
+		self.uid = 0
+		self.gid = 0
+		self.mode = 0o644
+		self.symbols = None
+		for key in kwargs:
+			if hasattr(self, key):
+				setattr(self, key, kwargs[key])
+
+	# End __init__
+
+
+	def __repr__(self):
+		return self.__class__.__name__ + "(" + repr(self.name) + ")"
+
+	# End __repr__
+
+# End ArchiveMember
+
+
+def _Bytes(value):
+	if isinstance(value, bytes):
+		return value
+	return value.encode("utf-8", "surrogateescape" if sys.version_info[0] >= 3 else "strict")
+
+# End _Bytes
+
+
+def _Number(field):
+	field = field.strip()
+	if len(field) == 0:
+		return 0
+	return int(field)
+
+# End _Number
+
+
+def ElfSymbols(f, offset, size):
+	"""Return the names of the global symbols defined by the ELF object of
+	size bytes at offset in the open file f, or None if it is not one.
+	Only the section headers and the symbol and string tables are read."""
+	f.seek(offset)
+	identification = f.read(16)
+	if len(identification) < 16 or identification[:4] != ELF_MAGIC:
+		return None
+	elf_class = bytearray(identification[4:5])[0]
+	order = "<" if bytearray(identification[5:6])[0] == 1 else ">"
+	header = f.read(48)
+	if elf_class == 2:
+		section_offset = struct.unpack(order + "Q", header[24:32])[0]
+		section_size, section_count = struct.unpack(order + "HH", header[42:46])
+		section_format = order + "IIQQQQIIQQ"
+		symbol_format = order + "IBBHQQ"
+	else:
+		section_offset = struct.unpack(order + "I", header[16:20])[0]
+		section_size, section_count = struct.unpack(order + "HH", header[30:34])
+		section_format = order + "IIIIIIIIII"
+		symbol_format = order + "IIIBBH"
+	symbol_size = struct.calcsize(symbol_format)
+	if section_offset == 0 or section_offset >= size:
+		return []
+
+	def read(start, length):
+		if start + length > size:
+			raise ToolError("Truncated ELF object")
+		f.seek(offset + start)
+		return f.read(length)
+
+	def section(index):
+		return struct.unpack(section_format, read(section_offset + index * section_size, struct.calcsize(section_format)))
+
+	if section_count == 0:
+		section_count = section(0)[5]
+
+	symbols = []
+	for index in range(section_count):
+		fields = section(index)
+		if fields[1] != SHT_SYMTAB:
+			continue
+		table = read(fields[4], fields[5])
+		strings_fields = section(fields[6])
+		strings = read(strings_fields[4], strings_fields[5])
+		for position in range(symbol_size, len(table) - symbol_size + 1, symbol_size):
+			values = struct.unpack(symbol_format, table[position:position + symbol_size])
+			if elf_class == 2:
+				name, info, shndx = (values[0], values[1], values[3])
+			else:
+				name, info, shndx = (values[0], values[3], values[5])
+			if shndx == SHN_UNDEF or not (info >> 4) in (STB_GLOBAL, STB_WEAK, STB_GNU_UNIQUE):
+				continue
+			end = strings.find(b"\0", name)
+			symbols.append(strings[name:end if end >= 0 else len(strings)])
+	return symbols
+
+# End ElfSymbols
+
+
+def _GnuSymbolIndex(data, width):
+	# Return {member header offset: [symbol, ...]} of a System V index.
+	code = ">I" if width == 4 else ">Q"
+	count = struct.unpack(code, data[:width])[0]
+	offsets = struct.unpack(">" + code[1] * count, data[width:width * (count + 1)])
+	names = data[width * (count + 1):].split(b"\0")
+	index = {}
+	for position in range(min(count, len(names))):
+		index.setdefault(offsets[position], []).append(names[position])
+	return index
+
+# End _GnuSymbolIndex
+
+
+def _BsdSymbolIndex(data):
+	# Return {member header offset: [symbol, ...]} of a ranlib index.
+	length = struct.unpack("<I", data[:4])[0]
+	entries = data[4:4 + length]
+	strings_length = struct.unpack("<I", data[4 + length:8 + length])[0]
+	strings = data[8 + length:8 + length + strings_length]
+	index = {}
+	for position in range(0, len(entries) - 7, 8):
+		name, offset = struct.unpack("<II", entries[position:position + 8])
+		end = strings.find(b"\0", name)
+		index.setdefault(offset, []).append(strings[name:end if end >= 0 else len(strings)])
+	return index
+
+# End _BsdSymbolIndex
+
+
+def ReadArchiveMembers(name):
+	"""Generate an ArchiveMember for each file in the ar archive name, GNU
+	or BSD format, with the symbols given by its symbol index if it has
+	one.  Only the member headers, the name table and the index are read;
+	the data of the members stays in the archive."""
+	with open(name, "rb") as f:
+		magic = f.read(len(AR_MAGIC))
+		if magic == AR_THIN_MAGIC:
+			raise ToolError(name + " is a thin archive")
+		if magic != AR_MAGIC:
+			raise ToolError(name + " is not an ar archive")
+		long_names = b""
+		symbol_index = None
+		position = len(AR_MAGIC)
+		while True:
+			f.seek(position)
+			header = f.read(AR_HEADER_SIZE)
+			if len(header) < AR_HEADER_SIZE:
+				break
+			if header[58:60] != AR_FMAG:
+				raise ToolError("Corrupt member header at %d in %s" % (position, name))
+			member_name = header[:16].rstrip(b" ")
+			size = _Number(header[48:58])
+			data_offset = position + AR_HEADER_SIZE
+			header_offset = position
+			position = data_offset + size + (size & 1)
+
+			if member_name.startswith(b"#1/"):
+				length = int(member_name[3:])
+				member_name = f.read(length).rstrip(b"\0")
+				data_offset += length
+				size -= length
+			elif member_name in (AR_SYMBOL_INDEX, AR_SYMBOL_INDEX_64):
+				symbol_index = _GnuSymbolIndex(f.read(size), 4 if member_name == AR_SYMBOL_INDEX else 8)
+				continue
+			elif member_name == AR_LONG_NAMES:
+				long_names = f.read(size)
+				continue
+			elif member_name.startswith(b"/"):
+				start = int(member_name[1:])
+				end = long_names.find(b"\n", start)
+				member_name = long_names[start:end if end >= 0 else len(long_names)].rstrip(b"/")
+			elif member_name.endswith(b"/"):
+				member_name = member_name[:-1]
+
+			if member_name in AR_BSD_SYMBOL_INDEXES:
+				f.seek(data_offset)
+				symbol_index = _BsdSymbolIndex(f.read(size))
+				continue
+
+			member = ArchiveMember(member_name, name, data_offset, size,
+				mtime=_Number(header[16:28]), uid=_Number(header[28:34]),
+				gid=_Number(header[34:40]), mode=int(header[40:48].strip() or b"644", 8))
+			if symbol_index != None and header_offset in symbol_index:
+				member.symbols = symbol_index[header_offset]
+			else:
+				member.symbols = ElfSymbols(f, data_offset, size)
+			yield member
+
+# End ReadArchiveMembers
+
+
+def ObjectMember(name):
+	"""Return the ArchiveMember for the object file name."""
+	fsdata = os.stat(name)
+	member = ArchiveMember(_Bytes(os.path.basename(name)), name, 0, fsdata.st_size,
+		mtime=int(fsdata.st_mtime), uid=fsdata.st_uid, gid=fsdata.st_gid,
+		mode=stat.S_IMODE(fsdata.st_mode))
+	with open(name, "rb") as f:
+		member.symbols = ElfSymbols(f, 0, fsdata.st_size)
+	return member
+
+# End ObjectMember
+
+
+def _Header(name, size, mtime=0, uid=0, gid=0, mode=None):
+	mode = ("%o" % mode).encode("ascii") if mode != None else b""
+	header = name.ljust(16) + (b"%d" % mtime if mode else b"").ljust(12) + \
+		(b"%d" % uid if mode else b"").ljust(6) + (b"%d" % gid if mode else b"").ljust(6) + \
+		mode.ljust(8) + (b"%d" % size).ljust(10) + AR_FMAG
+	if len(header) != AR_HEADER_SIZE:
+		raise ToolError("Member header field overflow for %s" % name)
+	return header
+
+# End _Header
+
+
+def WriteArchive(f, members):
+	"""Write the ArchiveMember sequence members to the open file f as a GNU
+	ar archive with a symbol index (64 bit if the archive needs it)."""
+	long_names = b""
+	names = []
+	for member in members:
+		if len(member.name) > 15 or b"/" in member.name or b" " in member.name:
+			names.append(b"/%d" % len(long_names))
+			long_names += member.name + b"/\n"
+		else:
+			names.append(member.name + b"/")
+
+	symbols = []
+	for member in members:
+		symbols.extend(member.symbols or [])
+	strings = b"".join([ symbol + b"\0" for symbol in symbols ])
+
+	def layout(width):
+		index_size = width * (len(symbols) + 1) + len(strings)
+		offset = len(AR_MAGIC) + AR_HEADER_SIZE + index_size + (index_size & 1)
+		if len(long_names) > 0:
+			offset += AR_HEADER_SIZE + len(long_names) + (len(long_names) & 1)
+		offsets = []
+		for member in members:
+			offsets.append(offset)
+			offset += AR_HEADER_SIZE + member.size + (member.size & 1)
+		return (index_size, offsets, offset)
+
+	width = 4
+	index_size, offsets, end = layout(width)
+	if end >= 1 << 32:
+		width = 8
+		index_size, offsets, end = layout(width)
+
+	f.write(AR_MAGIC)
+	code = ">I" if width == 4 else ">Q"
+	f.write(_Header(AR_SYMBOL_INDEX if width == 4 else AR_SYMBOL_INDEX_64, index_size, mode=0))
+	f.write(struct.pack(code, len(symbols)))
+	for member, offset in zip(members, offsets):
+		f.write(struct.pack(">" + code[1] * len(member.symbols or []), *([offset] * len(member.symbols or []))))
+	f.write(strings)
+	if index_size & 1:
+		f.write(b"\n")
+	if len(long_names) > 0:
+		f.write(_Header(AR_LONG_NAMES, len(long_names)))
+		f.write(long_names)
+		if len(long_names) & 1:
+			f.write(b"\n")
+
+	source = None
+	try:
+		for member, name in zip(members, names):
+			f.write(_Header(name, member.size, member.mtime, member.uid, member.gid, member.mode))
+			if source == None or source.name != member.source:
+				if source != None:
+					source.close()
+				source = open(member.source, "rb")
+			source.seek(member.offset)
+			remaining = member.size
+			while remaining > 0:
+				chunk = source.read(min(remaining, AR_COPY_SIZE))
+				if not chunk:
+					raise ToolError(member.source + " changed while it was read")
+				f.write(chunk)
+				remaining -= len(chunk)
+			if member.size & 1:
+				f.write(b"\n")
+	finally:
+		if source != None:
+			source.close()
+
+# End WriteArchive
+
+
+def FindProgram(program):
+	"""Return True if program is an executable in a directory of PATH."""
+	for path in os.environ.get("PATH", "").split(os.pathsep):
+		if path and os.access(os.path.join(path, program), os.X_OK):
+			return True
+	return False
+
+# End FindProgram
+
+
 class LibTool(ToolBaseObject):
-	"""The LibTool class."""
+	"""The LibTool class.
+
+	join merges static libraries and object files in-process into a GNU ar
+	archive with a symbol index, unless native is False, in which case it
+	runs libtool -o.  native defaults to False on Darwin, whose Mach-O
+	objects need the index libtool writes, unless libtool is not found."""
 
 	def __init__(self, **kwargs):
 		ToolBaseObject.__init__(self,**kwargs)
 
+		if 'native' in kwargs:
+			self.native = kwargs["native"]
+		else:
+			self.native = not re.search(r'darwin', sys.platform) or not FindProgram("libtool")
+
 	# End __init__
 
 
 	def __make_command(self, output, input):
-		command = "libtool -o " + str(output)
-		for ifile in input:
-			command += " " + str(ifile)
-
-		return command
+		return ["libtool", "-o", str(output)] + [ str(ifile) for ifile in input ]
 
 	# End __make_command
 
 
+	def members(self, input_files):
+		"""Generate the ArchiveMember of each object file of input_files, in
+		order, where archives contribute each of their members."""
+		for name in input_files:
+			name = str(name)
+			with open(name, "rb") as f:
+				magic = f.read(len(AR_MAGIC))
+			if magic in (AR_MAGIC, AR_THIN_MAGIC):
+				for member in ReadArchiveMembers(name):
+					yield member
+			else:
+				yield ObjectMember(name)
+
+	# End members
+
+
+	def __join(self, output_file, input_files):
+		output_file = str(output_file)
+		if Object.global_dry_run:
+			Object.logIfDryRun(self, "join %s (%d inputs)" % (output_file, len(input_files)))
+			return
+
+		fd, temporary = tempfile.mkstemp(prefix="." + os.path.basename(output_file) + ".", dir=os.path.dirname(output_file) or ".")
+		try:
+			try:
+				members = list(self.members(input_files))
+				with os.fdopen(fd, "wb") as f:
+					WriteArchive(f, members)
+				os.chmod(temporary, NewFileMode())
+				os.rename(temporary, output_file)
+			except (EnvironmentError, ValueError, struct.error) as e:
+				raise ToolError("Unable to create %s: %s" % (output_file, str(e)))
+		finally:
+			if os.path.lexists(temporary):
+				os.remove(temporary)
+
+		Object.logIfVerbose(self, "join %s (%d members)" % (output_file, len(members)))
+
+	# End __join
+
+
 	def join(self, output_file, input_files):
-		if type(input_files) != types.ListType and type(input_files) != types.TupleType:
+		"""Create the static library output_file from input_files, a list of
+		object files and archives whose members are all copied.  The
+		symbol index is made from the indexes of the input archives and the
+		symbol tables of ELF objects.  Member data is copied a chunk at a
+		time, and no command line is built however many inputs there are."""
+		if not isinstance(input_files, (list, tuple)):
 			raise ToolError("2nd argument must be a list or tuple of file names")
 
+		if self.native:
+			self.__join(output_file, input_files)
+			return
+
 		command = self.__make_command(output_file,input_files)
 		self.execute(command)
 
 	# End join
 
 # End LibTool
-
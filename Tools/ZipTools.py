@@ -1,31 +1,837 @@
 #! /usr/bin/env python
 
 import os
-import re
 import sys
-import types
+import stat
+import time
+import zlib
+import struct
+import tarfile
+import tempfile
+import collections
+from multiprocessing.pool import ThreadPool
 from .. Objects import Object
-from .. Tools import ToolBaseObject, ToolError
+from .. Tools import ToolBaseObject, ToolError, NewFileMode
 from .. Commands import CommandError
 from .. Commands.Shells import Shell
+from .. FileSystems import FileSystemError
 from .. FileSystems.Directories import Directory
+from .. FileSystems.SymbolicLinks import SymbolicLink
+
+try:
+	import zstandard
+except ImportError as e:
+	zstandard = None
+
+
+FORMAT_ZIP = "zip"
+FORMAT_TAR = "tar"
+FORMAT_TAR_GZ = "tar.gz"
+FORMAT_TAR_ZST = "tar.zst"
+
+ARCHIVE_CHUNK_SIZE = 1024 * 1024
+
+# tar streams are compressed in independent blocks of this size, one per
+# worker task; concatenated gzip members and zstd frames are valid files.
+TAR_BLOCK_SIZE = 4 * 1024 * 1024
+
+# Compressed members are kept in memory up to this size, then on disk.
+SPOOL_SIZE = 8 * 1024 * 1024
+
+# Files that are already compressed, which are stored rather than deflated.
+STORED_EXTENSIONS = [
+	".7z", ".bz2", ".gif", ".gz", ".jar", ".jpeg", ".jpg", ".lz", ".lzma",
+	".mp3", ".mp4", ".png", ".rar", ".tgz", ".txz", ".war", ".webp",
+	".whl", ".xz", ".zip", ".zst"
+]
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP_MAX_32 = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+ZIP_VERSION_MADE_BY = (3 << 8) | 30		# Unix, 3.0
+ZIP_FLAG_UTF8 = 0x800
+ZIP_EXTRA_ZIP64 = 0x0001
+ZIP_EXTRA_TIMESTAMP = 0x5455
+ZIP_FLAG_ENCRYPTED = 0x1
+ZIP_FLAG_DATA_DESCRIPTOR = 0x8
+
+# The timestamp of every member of a deterministic archive: the earliest
+# time a zip archive can record, 1980-01-01 00:00:00 UTC.
+DETERMINISTIC_MTIME = 315532800
+
+
+def ArchiveFormat(name):
+	"""Return the archive format of the file name from its extension, or
+	None if it is not one of the formats written by ZipTool.archive."""
+	name = str(name).lower()
+	if name.endswith(".zip"):
+		return FORMAT_ZIP
+	if name.endswith(".tar.gz") or name.endswith(".tgz"):
+		return FORMAT_TAR_GZ
+	if name.endswith(".tar.zst") or name.endswith(".tzst"):
+		return FORMAT_TAR_ZST
+	if name.endswith(".tar"):
+		return FORMAT_TAR
+	return None
+
+# End ArchiveFormat
+
+
+def DosDateTime(mtime):
+	"""Return the (time, date) pair of the MS-DOS format used by zip for the
+	modification time mtime, in local time like zip itself."""
+	t = time.localtime(mtime)
+	if t[0] < 1980:
+		return (0, (1 << 5) | 1)
+	return ((t[3] << 11) | (t[4] << 5) | (t[5] // 2), ((t[0] - 1980) << 9) | (t[1] << 5) | t[2])
+
+# End DosDateTime
+
+
+def ArchiveName(name):
+	"""Return name as the bytes of a member name with / separators."""
+	if os.sep != "/":
+		name = name.replace(os.sep, "/")
+	if not isinstance(name, bytes):
+		name = name.encode("utf-8", "surrogateescape" if sys.version_info[0] >= 3 else "strict")
+	return name
+
+# End ArchiveName
+
+
+def CrcOfFile(name):
+	"""Return the CRC-32 of the contents of the file name."""
+	crc = 0
+	with open(name, "rb") as f:
+		while True:
+			chunk = f.read(ARCHIVE_CHUNK_SIZE)
+			if not chunk:
+				break
+			crc = zlib.crc32(chunk, crc)
+	return crc & 0xFFFFFFFF
+
+# End CrcOfFile
+
+
+def DeflateFile(arguments):
+	"""Deflate the file arguments[0] at level arguments[1].  Returns (crc,
+	size, compressed size, data), where data is a string for files smaller
+	than ARCHIVE_CHUNK_SIZE (arguments[2] is the expected size) and a
+	spooled temporary file otherwise, and None when deflating does not
+	make the file smaller or level is None.
+
+	If arguments[3] is not None it is the CRC of the member the file may
+	replace, and None is returned when the file still has that CRC."""
+	name, level, expected_size, known_crc = arguments
+	if known_crc != None:
+		crc = CrcOfFile(name)
+		if crc == known_crc:
+			return None
+		if level == None:
+			return (crc, expected_size, expected_size, None)
+	elif level == None:
+		return None
+	compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+	if expected_size < ARCHIVE_CHUNK_SIZE:
+		with open(name, "rb") as f:
+			contents = f.read()
+		data = compressor.compress(contents) + compressor.flush()
+		if len(data) >= len(contents):
+			data = None
+		return (zlib.crc32(contents) & 0xFFFFFFFF, len(contents), len(data or contents), data)
+
+	data = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+	crc = 0
+	size = 0
+	with open(name, "rb") as f:
+		while True:
+			chunk = f.read(ARCHIVE_CHUNK_SIZE)
+			if not chunk:
+				break
+			crc = zlib.crc32(chunk, crc)
+			size += len(chunk)
+			data.write(compressor.compress(chunk))
+	data.write(compressor.flush())
+	compressed_size = data.tell()
+	if compressed_size >= size:
+		data.close()
+		return (crc & 0xFFFFFFFF, size, size, None)
+	data.seek(0)
+	return (crc & 0xFFFFFFFF, size, compressed_size, data)
+
+# End DeflateFile
+
+
+def DeflateFiles(arguments):
+	"""DeflateFile each element of arguments that is not None, so that many
+	small files make one task."""
+	return [ DeflateFile(element) if element != None else None for element in arguments ]
+
+# End DeflateFiles
+
+
+def CompressBlock(arguments):
+	"""Compress the block of tar data arguments[1] as a gzip member or zstd
+	frame (arguments[0]) at level arguments[2]."""
+	archive_format, block, level = arguments
+	if archive_format == FORMAT_TAR_ZST:
+		return zstandard.ZstdCompressor(level=level).compress(block)
+	compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + 15)
+	return compressor.compress(block) + compressor.flush()
+
+# End CompressBlock
+
+
+def OrderedResults(pool, function, items, window):
+	"""Generate (item, result) for each (item, arguments) of items in order,
+	running function(arguments) on pool with at most window calls pending.
+	Items whose arguments are None are passed through with a None result."""
+	pending = collections.deque()
+	for item, arguments in items:
+		if arguments == None:
+			pending.append((item, None))
+		else:
+			pending.append((item, pool.apply_async(function, (arguments,))))
+		while len(pending) > window:
+			item, result = pending.popleft()
+			yield (item, result.get() if result != None else None)
+	while len(pending) > 0:
+		item, result = pending.popleft()
+		yield (item, result.get() if result != None else None)
+
+# End OrderedResults
+
+
+def ExtendedTimestamp(extra):
+	"""Return the modification time in the extended timestamp field of the
+	zip extra data extra, or None if it has none."""
+	position = 0
+	while position + 4 <= len(extra):
+		tag, length = struct.unpack("<HH", extra[position:position + 4])
+		if tag == ZIP_EXTRA_TIMESTAMP and length >= 5 and bytearray(extra[position + 4:position + 5])[0] & 1:
+			return struct.unpack("<l", extra[position + 5:position + 9])[0]
+		position += 4 + length
+	return None
+
+# End ExtendedTimestamp
+
+
+def ReadZipEntries(fileobj):
+	"""Return a dictionary of the ZipEntry of each member of the zip archive
+	fileobj by name, read from its central directory."""
+	fileobj.seek(0, 2)
+	end = fileobj.tell()
+	tail_size = min(end, 22 + 0xFFFF)
+	fileobj.seek(end - tail_size)
+	tail = fileobj.read(tail_size)
+	position = tail.rfind(b"PK\x05\x06")
+	if position < 0 or position + 22 > len(tail):
+		raise ToolError("Not a zip archive")
+	count, size, start = struct.unpack("<HII", tail[position + 10:position + 20])
+	if (count == ZIP_MAX_ENTRIES or size == ZIP_MAX_32 or start == ZIP_MAX_32) and position >= 20 and tail[position - 20:position - 16] == b"PK\x06\x07":
+		fileobj.seek(struct.unpack("<Q", tail[position - 12:position - 4])[0])
+		record = fileobj.read(56)
+		count, size, start = struct.unpack("<QQQ", record[32:56])
+
+	fileobj.seek(start)
+	directory = fileobj.read(size)
+	entries = {}
+	position = 0
+	for index in range(count):
+		fields = struct.unpack("<IHHHHHHIIIHHHHHII", directory[position:position + 46])
+		if fields[0] != 0x02014b50:
+			raise ToolError("Corrupt zip central directory")
+		name_end = position + 46 + fields[10]
+		extra_end = name_end + fields[11]
+		name = directory[position + 46:name_end]
+		extra = directory[name_end:extra_end]
+		entry = ZipEntry(name, flags=fields[3], method=fields[4], dos_time=fields[5],
+			dos_date=fields[6], crc=fields[7], compressed_size=fields[8], size=fields[9],
+			external_attr=fields[15], offset=fields[16])
+		entry.mtime = ExtendedTimestamp(extra)
+
+		field = 0
+		while field + 4 <= len(extra):
+			tag, length = struct.unpack("<HH", extra[field:field + 4])
+			if tag == ZIP_EXTRA_ZIP64:
+				values = struct.unpack("<" + "Q" * (length // 8), extra[field + 4:field + 4 + 8 * (length // 8)])
+				values = list(values)
+				for key in ("size", "compressed_size", "offset"):
+					if getattr(entry, key) == ZIP_MAX_32 and len(values) > 0:
+						setattr(entry, key, values.pop(0))
+			field += 4 + length
+
+		entries[name] = entry
+		position = extra_end + fields[12]
+	return entries
+
+# End ReadZipEntries
+
+
+class ZipEntry(Object):
+	"""The record of a member of a zip archive."""
+
+	def __init__(self, name, **kwargs):
+		Object.__init__(self, **kwargs)
+		self.name = name
+		self.method = ZIP_STORED
+		self.flags = 0
+		self.crc = 0
+		self.size = 0
+		self.compressed_size = 0
+		self.mtime = None
+		self.dos_time = 0
+		self.dos_date = (1 << 5) | 1
+		self.external_attr = 0
+		self.offset = 0
+		for key in kwargs:
+			if hasattr(self, key):
+				setattr(self, key, kwargs[key])
+		try:
+			self.name.decode("ascii")
+		except UnicodeDecodeError as e:
+			self.flags |= ZIP_FLAG_UTF8
+
+	# End __init__
+
+
+	def setModificationTime(self, mtime):
+		self.mtime = mtime
+		if mtime == None:
+			self.dos_time, self.dos_date = (0, (1 << 5) | 1)
+		else:
+			self.dos_time, self.dos_date = DosDateTime(mtime)
+
+	# End setModificationTime
+
+
+	def __zip64Fields(self, central):
+		# The local header carries both sizes or neither, the central header
+		# just the values that do not fit.
+		if not central:
+			if self.size >= ZIP_MAX_32 or self.compressed_size >= ZIP_MAX_32:
+				return [self.size, self.compressed_size]
+			return []
+		return [ value for value in (self.size, self.compressed_size, self.offset) if value >= ZIP_MAX_32 ]
+
+	# End __zip64Fields
+
+
+	def __extra(self, zip64_fields):
+		extra = b""
+		if len(zip64_fields) > 0:
+			extra += struct.pack("<HH", ZIP_EXTRA_ZIP64, 8 * len(zip64_fields))
+			extra += struct.pack("<" + "Q" * len(zip64_fields), *zip64_fields)
+		if self.mtime != None:
+			extra += struct.pack("<HHBl", ZIP_EXTRA_TIMESTAMP, 5, 1, int(self.mtime))
+		return extra
+
+	# End __extra
+
+
+	def localHeader(self):
+		zip64_fields = self.__zip64Fields(False)
+		extra = self.__extra(zip64_fields)
+		if len(zip64_fields) > 0:
+			version, size, compressed_size = (45, ZIP_MAX_32, ZIP_MAX_32)
+		else:
+			version, size, compressed_size = (20, self.size, self.compressed_size)
+		return struct.pack("<IHHHHHIIIHH", 0x04034b50, version, self.flags, self.method,
+			self.dos_time, self.dos_date, self.crc, compressed_size, size,
+			len(self.name), len(extra)) + self.name + extra
+
+	# End localHeader
+
+
+	def centralHeader(self):
+		zip64_fields = self.__zip64Fields(True)
+		extra = self.__extra(zip64_fields)
+		size, compressed_size, offset = [ min(value, ZIP_MAX_32) for value in (self.size, self.compressed_size, self.offset) ]
+		version = 45 if len(zip64_fields) > 0 else 20
+		return struct.pack("<IHHHHHHIIIHHHHHII", 0x02014b50, ZIP_VERSION_MADE_BY, version,
+			self.flags, self.method, self.dos_time, self.dos_date, self.crc,
+			compressed_size, size, len(self.name), len(extra), 0, 0, 0,
+			self.external_attr, offset) + self.name + extra
+
+	# End centralHeader
+
+
+	def __repr__(self):
+		return self.__class__.__name__ + "(" + repr(self.name) + ")"
+
+	# End __repr__
+
+# End ZipEntry
+
+
+class ZipWriter(Object):
+	"""Write the members of a zip archive, with the ZIP64 extensions where
+	sizes, offsets or the number of members need them, to the seekable
+	file object fileobj.  The data given to add is already compressed."""
+
+	def __init__(self, fileobj, **kwargs):
+		Object.__init__(self, **kwargs)
+		self.fileobj = fileobj
+		self.entries = []
+		self.offset = fileobj.tell()
+
+	# End __init__
+
+
+	def add(self, entry, data=None):
+		"""Append entry followed by data, a string or a file object of
+		entry.compressed_size bytes."""
+		entry.offset = self.offset
+		header = entry.localHeader()
+		self.fileobj.write(header)
+		self.offset += len(header)
+		if data != None:
+			if isinstance(data, bytes):
+				self.fileobj.write(data)
+			else:
+				while True:
+					chunk = data.read(ARCHIVE_CHUNK_SIZE)
+					if not chunk:
+						break
+					self.fileobj.write(chunk)
+		self.offset += entry.compressed_size
+		self.entries.append(entry)
+
+	# End add
+
+
+	def addStored(self, entry, source):
+		"""Append entry with the data of the file object source stored as it
+		is; entry.size must be its size.  The CRC is computed while copying
+		and patched into the header."""
+		entry.method = ZIP_STORED
+		entry.compressed_size = entry.size
+		entry.offset = self.offset
+		header = entry.localHeader()
+		self.fileobj.write(header)
+		crc = 0
+		copied = 0
+		while True:
+			chunk = source.read(ARCHIVE_CHUNK_SIZE)
+			if not chunk:
+				break
+			crc = zlib.crc32(chunk, crc)
+			copied += len(chunk)
+			self.fileobj.write(chunk)
+		if copied != entry.size:
+			raise ToolError("%s changed size while it was archived" % entry.name)
+		entry.crc = crc & 0xFFFFFFFF
+		end = self.fileobj.tell()
+		self.fileobj.seek(self.offset + 14)
+		self.fileobj.write(struct.pack("<I", entry.crc))
+		self.fileobj.seek(end)
+		self.offset = end
+		self.entries.append(entry)
+
+	# End addStored
+
+
+	def addRaw(self, entry, source, source_offset):
+		"""Append entry with its compressed data copied as it is from the
+		member whose local header is at source_offset in the zip archive
+		source."""
+		source.seek(source_offset)
+		header = source.read(30)
+		if len(header) != 30 or struct.unpack("<I", header[:4])[0] != 0x04034b50:
+			raise ToolError("Corrupt zip member %s" % entry.name)
+		name_length, extra_length = struct.unpack("<HH", header[26:30])
+		source.seek(source_offset + 30 + name_length + extra_length)
+		entry.flags &= ~ZIP_FLAG_DATA_DESCRIPTOR
+		entry.offset = self.offset
+		header = entry.localHeader()
+		self.fileobj.write(header)
+		remaining = entry.compressed_size
+		while remaining > 0:
+			chunk = source.read(min(remaining, ARCHIVE_CHUNK_SIZE))
+			if not chunk:
+				raise ToolError("Truncated zip member %s" % entry.name)
+			self.fileobj.write(chunk)
+			remaining -= len(chunk)
+		self.offset += len(header) + entry.compressed_size
+		self.entries.append(entry)
+
+	# End addRaw
+
+
+	def close(self):
+		"""Write the central directory."""
+		start = self.offset
+		for entry in self.entries:
+			self.fileobj.write(entry.centralHeader())
+		end = self.fileobj.tell()
+		count = len(self.entries)
+		size = end - start
+		if count >= ZIP_MAX_ENTRIES or size >= ZIP_MAX_32 or start >= ZIP_MAX_32:
+			self.fileobj.write(struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, 45, 45, 0, 0, count, count, size, start))
+			self.fileobj.write(struct.pack("<IIQI", 0x07064b50, 0, end, 1))
+			count, size, start = (min(count, ZIP_MAX_ENTRIES), min(size, ZIP_MAX_32), min(start, ZIP_MAX_32))
+		self.fileobj.write(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, count, count, size, start, 0))
+		self.fileobj.flush()
+
+	# End close
+
+# End ZipWriter
+
+
+class BlockCompressor(Object):
+	"""A write-only file object that compresses what is written to it in
+	TAR_BLOCK_SIZE blocks on pool and writes the compressed blocks to
+	fileobj in order."""
+
+	def __init__(self, fileobj, archive_format, level, pool, window, **kwargs):
+		Object.__init__(self, **kwargs)
+		self.fileobj = fileobj
+		self.archive_format = archive_format
+		self.level = level
+		self.pool = pool
+		self.window = window
+		self.buffer = []
+		self.buffered = 0
+		self.pending = collections.deque()
+
+	# End __init__
+
+
+	def __submit(self):
+		block = b"".join(self.buffer)
+		self.buffer = []
+		self.buffered = 0
+		self.pending.append(self.pool.apply_async(CompressBlock, ((self.archive_format, block, self.level),)))
+		while len(self.pending) > self.window:
+			self.fileobj.write(self.pending.popleft().get())
+
+	# End __submit
+
+
+	def write(self, data):
+		self.buffer.append(data)
+		self.buffered += len(data)
+		if self.buffered >= TAR_BLOCK_SIZE:
+			self.__submit()
+
+	# End write
+
+
+	def close(self):
+		if self.buffered > 0:
+			self.__submit()
+		while len(self.pending) > 0:
+			self.fileobj.write(self.pending.popleft().get())
+		self.fileobj.flush()
+
+	# End close
+
+# End BlockCompressor
 
 
 class ZipTool(ToolBaseObject):
-	"""The ZipTool class."""
+	"""The ZipTool class.
+
+	Archives are written in-process by archive, which reads the directory
+	with a streaming walk and compresses files on a pool of workers
+	threads; files with one of store_extensions are stored as they are.
+	With deterministic the members are sorted by name and their times,
+	and for tar their owners, are fixed, so the same tree always gives
+	the same bytes.  zip_directory uses archive, updating an existing
+	archive, unless native is False, in which case it runs zip."""
 
 	def __init__(self, **kwargs):
 		ToolBaseObject.__init__(self,**kwargs)
 
+		if 'native' in kwargs:
+			self.native = kwargs["native"]
+		else:
+			self.native = True
+
+		if 'workers' in kwargs:
+			self.workers = kwargs["workers"]
+		else:
+			self.workers = 8
+
+		if 'level' in kwargs:
+			self.level = kwargs["level"]
+		else:
+			self.level = 6
+
+		if 'store_extensions' in kwargs:
+			self.store_extensions = kwargs["store_extensions"]
+		else:
+			self.store_extensions = STORED_EXTENSIONS
+
+		if 'deterministic' in kwargs:
+			self.deterministic = kwargs["deterministic"]
+		else:
+			self.deterministic = False
+
+		self.members_compressed = 0
+		self.members_reused = 0
+
 	# End __init__
 
 
+	def __members(self, folder, store_links):
+		if store_links:
+			members = self.__walkMembers(folder, folder.name, None)
+		else:
+			root = os.stat(folder.fullpath)
+			members = self.__walkMembers(folder, folder.name, set([(root.st_dev, root.st_ino)]))
+		if self.deterministic:
+			return iter(sorted(members, key=lambda member: ArchiveName(member[0])))
+		return members
+
+	# End __members
+
+
+	def __walkMembers(self, folder, name, followed):
+		# Symbolic links are members themselves unless followed, the set of
+		# the (device, inode) of the directories walked, is given.  Then a
+		# link to a directory is walked like one, once, and a dangling link
+		# is left out, as zip -r does.
+		yield (name, folder)
+		for obj in folder.walk(workers=self.workers):
+			member = name + obj.fullpath[len(folder.fullpath):]
+			if followed != None and isinstance(obj, SymbolicLink):
+				try:
+					fsdata = os.stat(obj.fullpath)
+				except OSError as e:
+					continue
+				if stat.S_ISDIR(fsdata.st_mode):
+					if not (fsdata.st_dev, fsdata.st_ino) in followed:
+						followed.add((fsdata.st_dev, fsdata.st_ino))
+						for entry in self.__walkMembers(Directory(obj.fullpath), member, followed):
+							yield entry
+					continue
+			yield (member, obj)
+
+	# End __walkMembers
+
+
+	def __stored(self, name):
+		if self.level == 0:
+			return True
+		return os.path.splitext(name)[1].lower() in self.store_extensions
+
+	# End __stored
+
+
+	def __previousMember(self, previous, name, fsdata):
+		# The member of the archive being updated that may be reused for the
+		# regular file name, and whether its time says it is unchanged.
+		if previous == None or not stat.S_ISREG(fsdata.st_mode):
+			return (None, False)
+		entry = previous.get(ArchiveName(name))
+		if entry == None or entry.size != fsdata.st_size or entry.flags & ZIP_FLAG_ENCRYPTED:
+			return (None, False)
+		if not entry.method in (ZIP_STORED, ZIP_DEFLATED):
+			return (None, False)
+		if self.deterministic or entry.mtime == None:
+			return (entry, False)
+		return (entry, entry.mtime == int(fsdata.st_mtime))
+
+	# End __previousMember
+
+
+	def __writeZip(self, folder, output, pool, source, store_links):
+		writer = ZipWriter(output)
+		previous = None
+		if source != None:
+			previous = ReadZipEntries(source)
+
+		def batches():
+			# Consecutive members go to the workers in batches of about
+			# ARCHIVE_CHUNK_SIZE bytes.
+			batch = []
+			batch_size = 0
+			for name, obj in self.__members(folder, store_links):
+				if store_links:
+					fsdata = os.lstat(obj.fullpath)
+				else:
+					fsdata = os.stat(obj.fullpath)
+				arguments = None
+				entry, unchanged = self.__previousMember(previous, name, fsdata)
+				level = self.level
+				if not stat.S_ISREG(fsdata.st_mode) or fsdata.st_size == 0 or self.__stored(name):
+					level = None
+				if not unchanged and (level != None or entry != None):
+					arguments = (obj.fullpath, level, fsdata.st_size, entry.crc if entry != None else None)
+					batch_size += fsdata.st_size
+				batch.append(((name, obj, fsdata, entry, unchanged), arguments))
+				if batch_size >= ARCHIVE_CHUNK_SIZE or len(batch) >= 1024:
+					yield (batch, [ arguments for member, arguments in batch ])
+					batch = []
+					batch_size = 0
+			if len(batch) > 0:
+				yield (batch, [ arguments for member, arguments in batch ])
+
+		for batch, results in OrderedResults(pool, DeflateFiles, batches(), 2 * self.workers):
+			for (member, arguments), result in zip(batch, results):
+				self.__addZipMember(writer, member, result, arguments, source)
+
+		if previous != None:
+			# As with zip -r, the members that were not written again are
+			# kept as they are.
+			written = set([ entry.name for entry in writer.entries ])
+			kept = [ entry for entry in previous.values() if not entry.name in written ]
+			for entry in sorted(kept, key=lambda entry: entry.offset):
+				writer.addRaw(entry, source, entry.offset)
+		writer.close()
+
+	# End __writeZip
+
+
+	def __addZipMember(self, writer, member, result, arguments, source):
+		name, obj, fsdata, previous_entry, unchanged = member
+		mode = fsdata.st_mode
+		entry = ZipEntry(ArchiveName(name), external_attr=(mode & 0xFFFF) << 16)
+		entry.setModificationTime(None if self.deterministic else fsdata.st_mtime)
+		if previous_entry != None and (unchanged or (arguments != None and result == None)):
+			entry.method = previous_entry.method
+			entry.flags |= previous_entry.flags & ~ZIP_FLAG_DATA_DESCRIPTOR
+			entry.crc = previous_entry.crc
+			entry.size = previous_entry.size
+			entry.compressed_size = previous_entry.compressed_size
+			writer.addRaw(entry, source, previous_entry.offset)
+			self.members_reused += 1
+		elif stat.S_ISDIR(mode):
+			entry.name += b"/"
+			entry.external_attr |= 0x10
+			writer.add(entry)
+		elif stat.S_ISLNK(mode):
+			target = os.readlink(obj.fullpath)
+			if not isinstance(target, bytes):
+				target = ArchiveName(target)
+			entry.crc = zlib.crc32(target) & 0xFFFFFFFF
+			entry.size = entry.compressed_size = len(target)
+			writer.add(entry, target)
+		elif stat.S_ISREG(mode):
+			if result != None and result[3] != None:
+				entry.method = ZIP_DEFLATED
+				entry.crc, entry.size, entry.compressed_size, data = result
+				writer.add(entry, data)
+				self.members_compressed += 1
+				if not isinstance(data, bytes):
+					data.close()
+			else:
+				entry.size = result[1] if result != None else fsdata.st_size
+				with open(obj.fullpath, "rb") as f:
+					writer.addStored(entry, f)
+				self.members_compressed += 1
+
+	# End __addZipMember
+
+
+	def __writeTar(self, folder, output, archive_format, pool, store_links):
+		if archive_format == FORMAT_TAR:
+			stream = output
+		else:
+			stream = BlockCompressor(output, archive_format, self.level, pool, 2 * self.workers)
+		archive = tarfile.open(fileobj=stream, mode="w|", format=tarfile.GNU_FORMAT, dereference=not store_links)
+		try:
+			for name, obj in self.__members(folder, store_links):
+				info = archive.gettarinfo(obj.fullpath, name)
+				if info == None:
+					continue
+				if self.deterministic:
+					info.mtime = DETERMINISTIC_MTIME
+					info.uid = info.gid = 0
+					info.uname = info.gname = ""
+				if info.isreg():
+					with open(obj.fullpath, "rb") as f:
+						archive.addfile(info, f)
+				else:
+					archive.addfile(info)
+		finally:
+			archive.close()
+		if stream != output:
+			stream.close()
+
+	# End __writeTar
+
+
+	def archive(self, directory, output_name, archive_format=None, update=False, store_links=False):
+		"""Write the directory to the archive output_name, whose members
+		are named from the directory name down.  archive_format is one of
+		FORMAT_ZIP, FORMAT_TAR, FORMAT_TAR_GZ and FORMAT_TAR_ZST and is
+		taken from the extension of output_name when not given.  For the
+		compressed tar formats the tar stream is compressed in blocks on
+		the workers; FORMAT_TAR_ZST requires the zstandard module.  The
+		archive is written to a temporary file that replaces output_name
+		when it is complete.
+
+		Symbolic links are followed, as by zip -r, so the archive holds what
+		they point to, unless store_links is set, when they are stored as
+		links, as by zip -y or tar.  Zip archives leave out fifos and
+		sockets.
+
+		With update, and a zip archive at output_name, the members of the
+		existing archive whose file has the same size and either the same
+		time or the same CRC are copied into the new archive without being
+		compressed again, and, as with zip -r, the members that do not come
+		from the directory are kept.  Other formats are always written from
+		scratch.  members_compressed and members_reused count the files of
+		zip archives that were read and those that were copied."""
+		# Without a trailing separator the directory has its own name, which
+		# the members are named from.
+		folder = Directory(str(directory).rstrip(os.sep) or os.sep)
+		output_name = str(output_name)
+		if archive_format == None:
+			archive_format = ArchiveFormat(output_name)
+		if not archive_format in (FORMAT_ZIP, FORMAT_TAR, FORMAT_TAR_GZ, FORMAT_TAR_ZST):
+			raise ToolError("Unknown archive format for " + output_name)
+		if archive_format == FORMAT_TAR_ZST and zstandard == None:
+			raise ToolError("Writing " + output_name + " requires the zstandard module")
+
+		if Object.global_dry_run:
+			Object.logIfDryRun(self, "archive " + folder.fullpath + " " + output_name)
+			return
+
+		fd, temporary = tempfile.mkstemp(prefix="." + os.path.basename(output_name) + ".", dir=os.path.dirname(output_name) or ".")
+		pool = ThreadPool(max(1, self.workers))
+		source = None
+		try:
+			try:
+				if update and archive_format == FORMAT_ZIP and os.path.isfile(output_name):
+					source = open(output_name, "rb")
+				with os.fdopen(fd, "wb") as output:
+					if archive_format == FORMAT_ZIP:
+						self.__writeZip(folder, output, pool, source, store_links)
+					else:
+						self.__writeTar(folder, output, archive_format, pool, store_links)
+				os.chmod(temporary, NewFileMode())
+				os.rename(temporary, output_name)
+			except (EnvironmentError, FileSystemError) as e:
+				raise ToolError("Unable to archive %s to %s: %s" % (folder.fullpath, output_name, str(e)))
+		finally:
+			pool.close()
+			pool.join()
+			if source != None:
+				source.close()
+			if os.path.lexists(temporary):
+				os.remove(temporary)
+
+		Object.logIfVerbose(self, "archive " + folder.fullpath + " " + output_name)
+
+	# End archive
+
+
 	def zip_directory(self, directory, output_name):
-		folder = Directory(str(directory))
+		"""Zip the directory to output_name, which when relative is taken
+		from the directory containing it, as with zip -r run there."""
+		folder = Directory(str(directory).rstrip(os.sep) or os.sep)
+		if self.native:
+			self.archive(folder.fullpath, os.path.join(folder.path, str(output_name)), FORMAT_ZIP, True)
+			return
+
 		path = Directory(folder.path)
 		current_working_directory = path.make_current_directory()
 
-		command = "zip -q -r " + str(output_name) + " " + folder.name
+		command = ["zip", "-q", "-r", str(output_name), folder.name]
 		self.execute(command)
 
 		current_working_directory.make_current_directory()
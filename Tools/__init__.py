@@ -1,8 +1,16 @@
 #! /usr/bin/env python
 
+import os
 import re
 import sys
+import time
 import types
+import threading
+
+try:
+	import Queue as queue
+except ImportError as e:
+	import queue
 
 __all__ = ["CopyTools", "LibTools", "ZipTools"]
 
@@ -22,11 +30,83 @@ class ToolError(Error):
 # End ToolError
 
 
+# The umask can only be read by setting it, which would race with the
+# threads of the process that create files, so it is read once, here.
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def NewFileMode():
+	"""The mode of a newly created file: 0666 less the umask the process
+	had when the package was imported."""
+	return 0o666 & ~UMASK
+
+# End NewFileMode
+
+
+STEP_PENDING = "pending"
+STEP_SUCCEEDED = "succeeded"
+STEP_FAILED = "failed"
+STEP_SKIPPED = "skipped"
+
+
+class ToolStep(Object):
+	"""A command queued on a ToolBaseObject, with what happened when the
+	queue was run: state, exit_code, output, errors and the start, end
+	and elapsed times."""
+
+	def __init__(self, name, command, depends, **kwargs):
+		Object.__init__(self, **kwargs)
+		self.name = name
+		self.command = command
+		self.depends = depends
+		self.state = STEP_PENDING
+		self.exit_code = None
+		self.output = None
+		self.errors = None
+		self.start = None
+		self.end = None
+
+	# End __init__
+
+
+	@property
+	def elapsed(self):
+		if self.start == None or self.end == None:
+			return None
+		return self.end - self.start
+
+	# End elapsed
+
+
+	def __str__(self):
+		if self.state == STEP_FAILED:
+			return "%s: %s" % (self.name, str(self.errors).rstrip())
+		if self.state == STEP_SKIPPED:
+			return "%s: '%s' skipped: %s" % (self.name, str(self.command), str(self.errors))
+		return "%s: '%s' %s" % (self.name, str(self.command), self.state)
+
+	# End __str__
+
+
+	def __repr__(self):
+		return self.__class__.__name__ + "(" + repr(self.name) + ", " + repr(self.command) + ", " + repr(self.depends) + ")"
+
+	# End __repr__
+
+# End ToolStep
+
+
 class ToolBaseObject(Object):
-	"""The ToolBaseObject class."""
+	"""The ToolBaseObject class.
+
+	Besides running one command with execute, a tool can queue commands
+	with queue and run them all with runQueued, on as many threads as the
+	caller asks for and after the steps they depend on."""
 
 	def __init__(self, **kwargs):
 		Object.__init__(self, **kwargs)
+		self.steps = []
 
 	# End __init__
 
@@ -42,6 +122,131 @@ class ToolBaseObject(Object):
 	# End execute
 
 
+	def queue(self, command, name=None, depends=None):
+		"""Queue command to be run by runQueued after the queued steps named
+		in depends have succeeded.  Returns the name of the step, which is
+		name or, by default, its position in the queue."""
+		if name == None:
+			name = str(len(self.steps))
+		if name in [ step.name for step in self.steps ]:
+			raise ToolError("A step named " + name + " is already queued")
+		self.steps.append(ToolStep(name, command, list(depends or [])))
+		return name
+
+	# End queue
+
+
+	def __runStep(self, shell, step):
+		step.start = time.time()
+		try:
+			step.output = shell.execute(step.command)
+			step.state = STEP_SUCCEEDED
+		except Error as e:
+			# Every error of the package, CommandError and the
+			# ProcessError of a failed setrlimit among them, derives
+			# from BaseException rather than Exception.
+			step.errors = e.note
+			step.state = STEP_FAILED
+		except Exception as e:
+			step.errors = str(e)
+			step.state = STEP_FAILED
+		finally:
+			step.exit_code = shell.exit_code
+			step.end = time.time()
+
+	# End __runStep
+
+
+	def __worker(self, tasks, done):
+		shell = Shell(capture_output=True)
+		while True:
+			step = tasks.get()
+			if step == None:
+				break
+			try:
+				self.__runStep(shell, step)
+			finally:
+				# runQueued waits for every step it started, so even one
+				# stopped by an unexpected exception is reported.
+				if step.state == STEP_PENDING:
+					step.errors = "it was interrupted"
+					step.state = STEP_FAILED
+				done.put(step)
+
+	# End __worker
+
+
+	def runQueued(self, workers=1, keep_going=True):
+		"""Run the queued steps on workers threads, each as soon as the steps
+		it depends on have succeeded, and empty the queue.  A step whose
+		dependency fails is skipped, and with keep_going False no new steps
+		are started after the first failure.  Returns the ToolStep of every
+		step, in queue order, or raises a ToolError describing all failed
+		and skipped steps, whose steps attribute holds the ToolSteps."""
+		steps = self.steps
+		self.steps = []
+		by_name = dict([ (step.name, step) for step in steps ])
+		for step in steps:
+			for name in step.depends:
+				if not name in by_name:
+					raise ToolError("Step %s depends on unknown step %s" % (step.name, name))
+
+		tasks = queue.Queue()
+		done = queue.Queue()
+		threads = []
+		for index in range(max(1, min(workers, len(steps)))):
+			thread = threading.Thread(target=self.__worker, args=(tasks, done))
+			thread.daemon = True
+			thread.start()
+			threads.append(thread)
+
+		pending = list(steps)
+		running = 0
+		failed = False
+		try:
+			while len(pending) > 0 or running > 0:
+				waiting = []
+				for step in pending:
+					states = [ by_name[name].state for name in step.depends ]
+					if STEP_FAILED in states or STEP_SKIPPED in states:
+						step.state = STEP_SKIPPED
+						step.errors = "a step it depends on did not succeed"
+					elif failed and not keep_going:
+						step.state = STEP_SKIPPED
+						step.errors = "an earlier step failed"
+					elif len([ state for state in states if state != STEP_SUCCEEDED ]) == 0:
+						tasks.put(step)
+						running += 1
+					else:
+						waiting.append(step)
+				if len(waiting) == len(pending) and running == 0:
+					for step in waiting:
+						step.state = STEP_SKIPPED
+						step.errors = "its dependencies form a cycle"
+					waiting = []
+				pending = waiting
+				if running > 0:
+					step = done.get()
+					running -= 1
+					if step.state == STEP_FAILED:
+						failed = True
+		finally:
+			for thread in threads:
+				tasks.put(None)
+
+		unsuccessful = [ step for step in steps if step.state != STEP_SUCCEEDED ]
+		if len(unsuccessful) > 0:
+			message = "%d of %d steps did not succeed:\n" % (len(unsuccessful), len(steps))
+			message += "\n".join([ "  " + str(step) for step in unsuccessful ])
+			error = ToolError(message)
+			error.steps = steps
+			raise error
+
+		return steps
+
+	# End runQueued
+
+
 	def __str__(self):
 		return ""
 